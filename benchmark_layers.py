@@ -0,0 +1,222 @@
+import os
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+import argparse
+import ast
+import copy
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Bidirectional
+from tensorflow.keras.mixed_precision import experimental as mixed_precision
+
+import hparameters
+import layers_attn
+import layers_convgru2D
+
+"""Example of how to use
+
+    Time the forward and backward passes of each ConvGRU layer class used in TRUNET, for implementation 1 and 2 of the cells:
+        python3 benchmark_layers.py cells -bs 4 -gi "[1,2]"
+
+    Time the ConvGRU layers with and without hoisting the input convolutions out of the time loop:
+        python3 benchmark_layers.py cells -bs 4 -gi "[1]" -hic "[False,True]"
+
+    Time each bidirectional ConvGRU layer of TRUNET with Bidirectional and with FusedBidirectional:
+        python3 benchmark_layers.py bidirectional -bs 4
+
+    Time the attention of the first TRUNET attention layer, for implementation 1 and 2 of MultiHead2DAttention_v2:
+        python3 benchmark_layers.py attention -bs 4 -ai "[1,2]"
+"""
+
+policy = mixed_precision.Policy('mixed_float16')
+mixed_precision.set_policy(policy)
+
+def cell_layer_mkrs(model_type_settings, feature_count):
+    """Returns a dictionary mapping the name of each ConvGRU layer class in TRUNET to a function, which creates a layer
+        for a cell implementation, hoist_input_conv value and other layer kwargs, the shape of the layer's inputs, without the batch dimension,
+        and whether the layer's input convolutions can be hoisted.
+        Layers are created with the params of the first TRUNET layer of their class
+    """
+    m_params = hparameters.model_TRUNET_hparameters( model_type_settings=copy.deepcopy(model_type_settings) )()
+    encoder_params = m_params['encoder_params']
+    decoder_params = m_params['decoder_params']
+
+    h_w = m_params['region_grid_params']['outer_box_dims']
+    seq_len = m_params['data_pipeline_params']['lookback_feature']
+    slfr = encoder_params['seq_len_factor_reduction'][0]
+    filters = encoder_params['CGRUs_params'][0]['filters']
+
+    return {
+        'ConvGRU2D': ( lambda implementation, hoist_input_conv, **kwargs: layers_convgru2D.ConvGRU2D( **{ **encoder_params['CGRUs_params'][0],
+                                'implementation':implementation, 'hoist_input_conv':hoist_input_conv }, **kwargs ),
+                        [seq_len] + h_w + [feature_count], True ),
+
+        'ConvGRU2D_attn': ( lambda implementation, hoist_input_conv, **kwargs: layers_convgru2D.ConvGRU2D_attn( **{ **encoder_params['CGRUs_params'][1],
+                                'implementation':implementation, 'hoist_input_conv':hoist_input_conv },
+                                attn_params=encoder_params['ATTN_params'][0], attn_downscaling_params=encoder_params['ATTN_DOWNSCALING_params_enc'],
+                                attn_factor_reduc=slfr, trainable=True, **kwargs ),
+                        [seq_len] + h_w + [filters*2], False ),
+
+        'ConvGRU2D_Dualcell': ( lambda implementation, hoist_input_conv, **kwargs: layers_convgru2D.ConvGRU2D_Dualcell( **{ **decoder_params['CGRUs_params'][0],
+                                'implementation':implementation, 'hoist_input_conv':hoist_input_conv }, trainable=True, **kwargs ),
+                        [seq_len//slfr] + h_w + [filters*4], True )
+    }
+
+def time_layer(layer, inputs, iterations, **kwargs):
+    """Returns the time (ms) of a forward pass and of a forward and backward pass through layer, in training mode.
+        kwargs are passed to the layer with inputs
+    """
+
+    @tf.function
+    def forward():
+        return layer( inputs, training=True, **kwargs )
+
+    @tf.function
+    def forward_backward():
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_mean( tf.cast( layer( inputs, training=True, **kwargs ), tf.float32 ) )
+        return tape.gradient( loss, layer.trainable_variables )
+
+    li_times = []
+    for fn in [forward, forward_backward]:
+        tf.nest.map_structure( lambda t: t.numpy(), fn() ) # Warm up, tracing the function
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            outp = fn()
+        tf.nest.map_structure( lambda t: t.numpy(), outp ) # waiting for the last iteration to finish
+        li_times.append( 1000*( time.perf_counter() - start )/iterations )
+
+    return li_times
+
+def benchmark_cells(batch_size, model_type_settings, li_implementation, li_hoist_input_conv, feature_count, iterations):
+    """Times each ConvGRU layer class for each cell implementation and hoist_input_conv value.
+        Layers for each configuration share the weights of the first, the max difference of their inference outputs is reported
+    """
+    print( "{:<20}\t{:<14}\t{:<16}\t{:>12}\t{:>16}\t{:>12}".format("layer", "implementation", "hoist_input_conv", "forward ms", "forward+back ms", "max |diff|") )
+
+    for name, (layer_mkr, input_shape, hoistable) in cell_layer_mkrs(model_type_settings, feature_count).items():
+        inputs = tf.random.normal( [batch_size] + input_shape, dtype=tf.float16 )
+        reference_layer = None
+
+        li_config = [ (implementation, hoist_input_conv) for implementation in li_implementation
+                        for hoist_input_conv in li_hoist_input_conv if hoistable or not hoist_input_conv ]
+
+        for implementation, hoist_input_conv in li_config:
+            layer = layer_mkr( implementation, hoist_input_conv )
+            layer( inputs, training=False ) # building the layer
+            if reference_layer is not None:
+                layer.set_weights( reference_layer.get_weights() )
+
+            # The attention weights of ConvGRU2D_attn are dropped out in inference too, so the seed is reset for each configuration to draw the same dropout mask
+            tf.random.set_seed(0)
+            outp = layer( inputs, training=False )
+            if reference_layer is None:
+                reference_layer, reference_outp = layer, outp
+
+            max_diff = np.max( np.abs( outp.numpy().astype(np.float32) - reference_outp.numpy().astype(np.float32) ) )
+            forward_ms, forward_backward_ms = time_layer( layer, inputs, iterations )
+
+            print( "{:<20}\t{:<14}\t{:<16}\t{:>12.2f}\t{:>16.2f}\t{:>12.2e}".format( name, implementation, str(hoist_input_conv),
+                        forward_ms, forward_backward_ms, max_diff ) )
+
+def benchmark_bidirectional(batch_size, model_type_settings, feature_count, iterations):
+    """Times each ConvGRU layer class, wrapped by Bidirectional and by FusedBidirectional.
+        The cell implementation and hoist_input_conv are read from model_type_settings, as in training.
+        The FusedBidirectional layers share the weights of the Bidirectional layers, the max difference of their inference outputs is reported
+    """
+    implementation = model_type_settings.get('gru_implementation',1)
+    hoist_input_conv = model_type_settings.get('hoist_input_conv',False)
+
+    print( "{:<20}\t{:<20}\t{:>12}\t{:>16}\t{:>12}".format("layer", "wrapper", "forward ms", "forward+back ms", "max |diff|") )
+
+    for name, (layer_mkr, input_shape, hoistable) in cell_layer_mkrs(model_type_settings, feature_count).items():
+        inputs = tf.random.normal( [batch_size] + input_shape, dtype=tf.float16 )
+        reference_layer = None
+
+        for wrapper in [Bidirectional, layers_convgru2D.FusedBidirectional]:
+            layer = wrapper( layer=layer_mkr( implementation, hoist_input_conv and hoistable ),
+                            backward_layer=layer_mkr( implementation, hoist_input_conv and hoistable, go_backwards=True ),
+                            merge_mode='concat' )
+            outp = layer( inputs, training=False ) # building the layer
+
+            if reference_layer is None:
+                reference_layer, reference_outp = layer, outp
+            else:
+                layer.set_weights( reference_layer.get_weights() )
+                outp = layer( inputs, training=False )
+
+            max_diff = np.max( np.abs( outp.numpy().astype(np.float32) - reference_outp.numpy().astype(np.float32) ) )
+            forward_ms, forward_backward_ms = time_layer( layer, inputs, iterations )
+
+            print( "{:<20}\t{:<20}\t{:>12.2f}\t{:>16.2f}\t{:>12.2e}".format( name, wrapper.__name__, forward_ms, forward_backward_ms, max_diff ) )
+
+def benchmark_attention(batch_size, model_type_settings, li_attn_implementation, iterations):
+    """Times the attention of the first TRUNET attention layer for each implementation of MultiHead2DAttention_v2.
+        The attention is called as in a step of ConvGRU2DCell_attn, with a query of one timestep and attn_factor_reduc key/value timesteps.
+        Layers for each implementation share the weights of the first, the max difference of their inference outputs is reported
+    """
+    m_params = hparameters.model_TRUNET_hparameters( model_type_settings=copy.deepcopy(model_type_settings) )()
+    encoder_params = m_params['encoder_params']
+
+    h_w = m_params['region_grid_params']['outer_box_dims']
+    slfr = encoder_params['seq_len_factor_reduction'][0]
+    filters = encoder_params['CGRUs_params'][1]['filters']
+
+    q_antecedent = tf.random.normal( [batch_size, 1] + h_w + [filters], dtype=tf.float16 )
+    kv_antecedent = tf.random.normal( [batch_size, slfr] + h_w + [filters*2], dtype=tf.float16 )
+
+    print( "{:<14}\t{:>12}\t{:>16}\t{:>12}".format("implementation", "forward ms", "forward+back ms", "max |diff|") )
+    reference_layer = None
+
+    for implementation in li_attn_implementation:
+        layer = layers_attn.MultiHead2DAttention_v2( **{ **encoder_params['ATTN_params'][0], 'implementation':implementation },
+                    attention_scaling_params=encoder_params['ATTN_DOWNSCALING_params_enc'], attn_factor_reduc=slfr, trainable=True )
+        layer( q_antecedent, k_antecedent=kv_antecedent, v_antecedent=kv_antecedent, training=False ) # building the layer
+        if reference_layer is not None:
+            layer.set_weights( reference_layer.get_weights() )
+
+        # The attention weights are dropped out in inference too, so the seed is reset for each implementation to draw the same dropout mask
+        tf.random.set_seed(0)
+        outp = layer( q_antecedent, k_antecedent=kv_antecedent, v_antecedent=kv_antecedent, training=False )
+        if reference_layer is None:
+            reference_layer, reference_outp = layer, outp
+
+        max_diff = np.max( np.abs( outp.numpy().astype(np.float32) - reference_outp.numpy().astype(np.float32) ) )
+        forward_ms, forward_backward_ms = time_layer( layer, q_antecedent, iterations, k_antecedent=kv_antecedent, v_antecedent=kv_antecedent )
+
+        print( "{:<14}\t{:>12.2f}\t{:>16.2f}\t{:>12.2e}".format( implementation, forward_ms, forward_backward_ms, max_diff ) )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the layers of TRUNET on random inputs")
+
+    parser.add_argument('command', type=str, choices=["cells", "bidirectional", "attention"])
+
+    parser.add_argument('-bs','--batch_size', type=int, required=False, default=4)
+
+    parser.add_argument('-mts','--model_type_settings', type=str, help="m_params", required=False,
+                        default="{'stochastic':False,'stochastic_f_pass':1,'discrete_continuous':True,'var_model_type':'mc_dropout','location':['London']}")
+
+    parser.add_argument('-gi','--li_gru_implementation', type=str, help="cells: list of the ConvGRU cell implementations to time", required=False, default="[1,2]")
+
+    parser.add_argument('-hic','--li_hoist_input_conv', type=str, help="cells: list of the hoist_input_conv values to time", required=False, default="[False]")
+
+    parser.add_argument('-ai','--li_attn_implementation', type=str, help="attention: list of the attention implementations to time", required=False, default="[1,2]")
+
+    parser.add_argument('-fc','--feature_count', type=int, help="number of feature variables input to TRUNET", required=False, default=6)
+
+    parser.add_argument('-it','--iterations', type=int, help="number of timed calls for each layer", required=False, default=20)
+
+    args_dict = vars(parser.parse_args() )
+
+    if args_dict['command'] == "cells":
+        benchmark_cells( args_dict['batch_size'], ast.literal_eval(args_dict['model_type_settings']), ast.literal_eval(args_dict['li_gru_implementation']),
+            ast.literal_eval(args_dict['li_hoist_input_conv']), args_dict['feature_count'], args_dict['iterations'] )
+
+    elif args_dict['command'] == "bidirectional":
+        benchmark_bidirectional( args_dict['batch_size'], ast.literal_eval(args_dict['model_type_settings']), args_dict['feature_count'], args_dict['iterations'] )
+
+    elif args_dict['command'] == "attention":
+        benchmark_attention( args_dict['batch_size'], ast.literal_eval(args_dict['model_type_settings']), ast.literal_eval(args_dict['li_attn_implementation']),
+            args_dict['iterations'] )
@@ -0,0 +1,324 @@
+import os
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+import argparse
+import ast
+import multiprocessing
+import resource
+import time
+
+from netCDF4 import Dataset
+import numpy as np
+import tensorflow as tf
+
+import data_generators
+import hparameters
+
+"""Example of how to use
+
+    Measure the throughput of Era5_Eobs.load_data_era5eobs on synthetic data, for single city, multi city and ["All"] location sets.
+        The synthetic netCDF4 files are created in the fixture directory on first use:
+        python3 benchmark_pipeline.py pipeline -fs small -bs 4
+        python3 benchmark_pipeline.py pipeline -fs large -bs 4 -ts "{'parallel_reader':True}"
+
+    Measure the decode throughput of the parallel reader on the model field fixture, for threaded and process based reads:
+        python3 benchmark_pipeline.py decode -fs large -pc "[1,2,4,8]" -sl 112
+
+    Check that the memory mapped model field store produces the same batches as the model field netCDF4 file.
+        The store is created from the model field fixture on first use:
+        python3 benchmark_pipeline.py store -fs small -bs 4 -mb 50
+
+    Compare the fused and the unbatch/window/flat_map chains which window the model field chunks:
+        python3 benchmark_pipeline.py windowing -wl 112 -cc 8 -r 3
+"""
+
+# Number of days covered by each fixture size
+FIXTURE_DAYS = { 'small':365, 'large':3*365 }
+
+LOCATION_SETS = {
+    'single': ['London'],
+    'multi': ['London','Cardiff','Glasgow','Manchester','Birmingham','Leeds','Edinburgh','Belfast'],
+    'all': ['All']
+}
+
+# region -- synthetic fixtures
+def fixture_fns(fixture_size):
+    """Returns the filenames of the rain and model field fixtures of a given size"""
+    return "eobs_rain_{}.nc".format(fixture_size), "model_fields_{}.nc".format(fixture_size)
+
+def store_fixture_name(fixture_size):
+    """Returns the name of the model field store created from the model field fixture of a given size"""
+    return "mf_store_{}".format(fixture_size)
+
+def synthetic_land_mask(h=100, w=140):
+    """Returns a boolean (h,w) array, with latitude increasing along h, which is True within an ellipse roughly covering the British Isles"""
+    lat, lon = np.meshgrid( np.linspace(49.05, 58.95, h), np.linspace(-10.95, 2.95, w), indexing='ij' )
+    return ( (lat-54.0)/5.0 )**2 + ( (lon+3.5)/5.5 )**2 <= 1.0
+
+def create_rain_fixture(fp, days, chunk_len=365, seed=0):
+    """Creates an E-obs like netCDF4 file with a masked 'rr' variable of shape (days, 100, 140)"""
+    rng = np.random.default_rng(seed)
+    sea = np.logical_not( synthetic_land_mask() )
+
+    with Dataset(fp, "w", format="NETCDF4") as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('latitude', 100)
+        ds.createDimension('longitude', 140)
+
+        ds.createVariable('latitude', 'f4', ('latitude',))[:] = np.linspace(49.05, 58.95, 100)
+        ds.createVariable('longitude', 'f4', ('longitude',))[:] = np.linspace(-10.95, 2.95, 140)
+        var_time = ds.createVariable('time', 'f8', ('time',))
+        var_time.units = "days since 1950-01-01 00:00"
+        var_rr = ds.createVariable('rr', 'f4', ('time','latitude','longitude'), fill_value=-9999.0)
+
+        for idx in range(0, days, chunk_len):
+            _len = min(chunk_len, days-idx)
+            var_time[idx:idx+_len] = 10592 + np.arange(idx, idx+_len)
+            rain = rng.gamma( 0.5, 5.0, size=(_len, 100, 140) ).astype(np.float32)
+            var_rr[idx:idx+_len] = np.ma.masked_array( rain, np.broadcast_to(sea, rain.shape) )
+
+def create_mf_fixture(fp, days, vars_for_feature, shift, scale, chunk_len=4*90, seed=0):
+    """Creates an ERA5 like netCDF4 file with 6 hourly model fields of shape (4*days, 103, 144)"""
+    rng = np.random.default_rng(seed)
+    time_len = 4*days
+
+    with Dataset(fp, "w", format="NETCDF4") as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('latitude', 103)
+        ds.createDimension('longitude', 144)
+
+        var_time = ds.createVariable('time', 'f8', ('time',))
+        var_time.units = "hours since 1900-01-01 00:00"
+        li_vars = [ ds.createVariable(name, 'f4', ('time','latitude','longitude')) for name in vars_for_feature ]
+
+        for idx in range(0, time_len, chunk_len):
+            _len = min(chunk_len, time_len-idx)
+            var_time[idx:idx+_len] = 692496 + 6*np.arange(idx, idx+_len)
+            for var, _shift, _scale in zip(li_vars, shift, scale):
+                var[idx:idx+_len] = ( _shift + _scale*rng.standard_normal( (_len, 103, 144) ) ).astype(np.float32)
+
+def create_fixtures(fixture_dir, fixture_size):
+    """Creates the rain and model field fixtures of a given size in fixture_dir, unless they already exist"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    rain_fn, mf_fn = fixture_fns(fixture_size)
+    t_params = hparameters.train_hparameters_ati( batch_size=1, ctsm="1979_1980_1981" )()
+
+    if not os.path.exists( os.path.join(fixture_dir, rain_fn) ):
+        print("Creating {}".format(rain_fn))
+        create_rain_fixture( os.path.join(fixture_dir, rain_fn), FIXTURE_DAYS[fixture_size] )
+
+    if not os.path.exists( os.path.join(fixture_dir, mf_fn) ):
+        print("Creating {}".format(mf_fn))
+        create_mf_fixture( os.path.join(fixture_dir, mf_fn), FIXTURE_DAYS[fixture_size], t_params['vars_for_feature'],
+            t_params['normalization_shift']['model_fields'], t_params['normalization_scales']['model_fields'] )
+
+def create_store_fixture(fixture_dir, fixture_size):
+    """Creates the model field store from the model field fixture of a given size, unless it already exists"""
+    create_fixtures(fixture_dir, fixture_size)
+    _, mf_fn = fixture_fns(fixture_size)
+    store_dir = os.path.join( fixture_dir, store_fixture_name(fixture_size) )
+    t_params = hparameters.train_hparameters_ati( batch_size=1, ctsm="1979_1980_1981" )()
+
+    if not os.path.exists( os.path.join(store_dir, "metadata.json") ):
+        print("Creating {}".format(store_fixture_name(fixture_size)))
+        data_generators.create_mf_store( os.path.join(fixture_dir, mf_fn), store_dir, t_params['vars_for_feature'] )
+# endregion
+
+# region -- pipeline benchmark
+def params_mkr(fixture_dir, fixture_size, locations, batch_size, t_settings):
+    """Returns t_params and m_params for the TRUNET model, reading from the fixtures"""
+    rain_fn, mf_fn = fixture_fns(fixture_size)
+    m_params = hparameters.model_TRUNET_hparameters( model_type_settings={'location':locations} )()
+
+    # The fixtures start at the feature and target start dates, 1979-01-01
+    end_date = np.datetime64('1979-01-01') + np.timedelta64( FIXTURE_DAYS[fixture_size], 'D')
+    t_params = hparameters.train_hparameters_ati( batch_size=batch_size, ctsm="1979-01-01_{}_{}".format(end_date, end_date),
+                    data_dir=fixture_dir, rain_fn=rain_fn, mf_fn=mf_fn, t_settings=t_settings,
+                    lookback_target=m_params['data_pipeline_params']['lookback_target'],
+                    lookback_feature=m_params['data_pipeline_params']['lookback_feature'] )()
+    return t_params, m_params
+
+def run_pipeline(fixture_dir, fixture_size, locations, batch_size, t_settings, max_batches=None):
+    """Iterates once through the dataset produced by load_data_era5eobs
+
+        Returns:
+            dict: batches, examples, time to first batch (s), total time (s) and peak RSS (MB) of the process
+    """
+    t_params, m_params = params_mkr(fixture_dir, fixture_size, locations, batch_size, t_settings)
+
+    start = time.perf_counter()
+    era5_eobs = data_generators.Era5_Eobs(t_params, m_params)
+    batch_count = int( t_params['train_batches'] * era5_eobs.loc_count )
+    if max_batches:
+        batch_count = min(batch_count, max_batches)
+    ds, _ = era5_eobs.load_data_era5eobs( batch_count, t_params['start_date'], t_params['parallel_calls'] )
+
+    batches, examples, first_batch_time = 0, 0, None
+    for feature, target, mask in ds:
+        if first_batch_time is None:
+            first_batch_time = time.perf_counter() - start
+        batches += 1
+        examples += int(feature.shape[0])
+    total_time = time.perf_counter() - start
+    era5_eobs.close()
+
+    return { 'batches':batches, 'examples':examples, 'first_batch_time':first_batch_time, 'total_time':total_time,
+                'peak_rss':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 } # ru_maxrss is in KB on Linux
+
+def benchmark_pipeline(fixture_dir, fixture_size, batch_size, t_settings, max_batches):
+    create_fixtures(fixture_dir, fixture_size)
+
+    print( "{:<8}\t{:>8}\t{:>8}\t{:>12}\t{:>16}\t{:>12}".format("locations", "batches", "examples", "examples/s", "first batch (s)", "peak RSS (MB)") )
+    for name, locations in LOCATION_SETS.items():
+        # Each run is made in a fresh process, so that the peak RSS is not carried over between runs
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            result = pool.apply( run_pipeline, (fixture_dir, fixture_size, locations, batch_size, t_settings, max_batches) )
+
+        print( "{:<8}\t{:>8}\t{:>8}\t{:>12.1f}\t{:>16.2f}\t{:>12.0f}".format( name, result['batches'], result['examples'],
+                    result['examples']/result['total_time'], result['first_batch_time'] or float('nan'), result['peak_rss'] ) )
+
+def pipeline_batches(fixture_dir, fixture_size, locations, batch_size, t_settings, max_batches):
+    """Returns the (feature, target, mask) batches produced by load_data_era5eobs as numpy arrays"""
+    t_params, m_params = params_mkr(fixture_dir, fixture_size, locations, batch_size, t_settings)
+    era5_eobs = data_generators.Era5_Eobs(t_params, m_params)
+    batch_count = min( int( t_params['train_batches'] * era5_eobs.loc_count ), max_batches )
+    ds, _ = era5_eobs.load_data_era5eobs( batch_count, t_params['start_date'], t_params['parallel_calls'] )
+
+    li_batches = [ tuple( t.numpy() for t in batch ) for batch in ds ]
+    era5_eobs.close()
+    return li_batches
+
+def check_store(fixture_dir, fixture_size, batch_size, t_settings, max_batches):
+    """Checks that the batches read through the model field store match those read from the model field netCDF4 file.
+        The store holds float16 values, so features are compared with a tolerance of a few float16 steps of the normalized fields
+    """
+    create_store_fixture(fixture_dir, fixture_size)
+    max_batches = max_batches or 50
+
+    for name, locations in LOCATION_SETS.items():
+        li_batches_nc = pipeline_batches( fixture_dir, fixture_size, locations, batch_size, t_settings, max_batches )
+        li_batches_store = pipeline_batches( fixture_dir, fixture_size, locations, batch_size,
+                                {**t_settings, 'mf_store':store_fixture_name(fixture_size)}, max_batches )
+
+        assert len(li_batches_nc) == len(li_batches_store), "{}: {} batches from the netCDF4 file, {} from the store".format(name, len(li_batches_nc), len(li_batches_store))
+
+        max_diff = 0.0
+        for (feature_nc, target_nc, mask_nc), (feature_store, target_store, mask_store) in zip(li_batches_nc, li_batches_store):
+            np.testing.assert_array_equal( target_nc, target_store )
+            np.testing.assert_array_equal( mask_nc, mask_store )
+            max_diff = max( max_diff, float( np.max( np.abs( feature_nc.astype(np.float32) - feature_store.astype(np.float32) ) ) ) )
+
+        assert max_diff < 5e-2, "{}: features differ by up to {}".format(name, max_diff)
+        print( "{:<8}	{:>8} batches match	max |feature diff| {:.2e}".format(name, len(li_batches_store), max_diff) )
+
+def time_decode(fixture_dir, fixture_size, shard_len, parallel_calls, t_settings):
+    """Returns the throughput, in MB/s, of reading the model field fixture through Era5_Eobs.interleaved_reader.
+        The dataset is iterated twice and the second pass is timed, so that the reader processes have started
+    """
+    t_params, m_params = params_mkr(fixture_dir, fixture_size, ['London'], 1, {**t_settings, 'parallel_reader':True})
+    era5_eobs = data_generators.Era5_Eobs(t_params, m_params)
+    ds = era5_eobs.interleaved_reader( era5_eobs.mf_data, shard_len, (tf.float16, tf.bool),
+                ( tf.TensorShape([None, None, None, None]), tf.TensorShape([None, None, None, None]) ), parallel_calls )
+
+    for _ in ds:
+        pass
+
+    start = time.perf_counter()
+    decoded_bytes = 0
+    for data, mask in ds:
+        decoded_bytes += data.numpy().nbytes + mask.numpy().nbytes
+    duration = time.perf_counter() - start
+
+    era5_eobs.close()
+    return decoded_bytes/2**20/duration
+
+def benchmark_decode(fixture_dir, fixture_size, shard_len, li_parallel_calls, t_settings):
+    create_fixtures(fixture_dir, fixture_size)
+
+    print( "{:<8}\t{:>14}\t{:>10}".format("reader", "parallel_calls", "MB/s") )
+    for reader, process_reader in [ ("threads", False), ("processes", True) ]:
+        for parallel_calls in li_parallel_calls:
+            throughput = time_decode( fixture_dir, fixture_size, shard_len, parallel_calls, {**t_settings, 'process_reader':process_reader} )
+            print( "{:<8}\t{:>14}\t{:>10.1f}".format(reader, parallel_calls, throughput) )
+# endregion
+
+# region -- windowing benchmark
+def synthetic_chunks(chunk_count, chunk_len, h=100, w=140, c=6, seed=0):
+    """Returns a list of (data, mask) chunks of random model field data"""
+    rng = np.random.default_rng(seed)
+    return [ ( rng.standard_normal( (chunk_len, h, w, c) ).astype(np.float16), rng.random( (chunk_len, h, w, c) ) > 0.1 )
+                for _ in range(chunk_count) ]
+
+def era5_eobs_mkr(fused):
+    """Returns an Era5_Eobs instance with the normalization params, without opening any data files"""
+    era5_eobs = data_generators.Era5_Eobs.__new__(data_generators.Era5_Eobs)
+    era5_eobs.t_params = {
+        'normalization_shift':{'model_fields':np.array([15.442, 0.003758, 274.833, 54309.66, 3.08158, 0.54810])},
+        'normalization_scales':{'model_fields':np.array([6.805, 0.001786, 5.458, 1678.2178, 5.107268, 4.764533])},
+        'mask_fill_value':{'model_field':0.0},
+        't_settings':{'fused_window':fused} }
+    return era5_eobs
+
+def time_chain(chunks, window_len, fused, repeats=3):
+    """Returns the mean time, in seconds, taken to window, normalize and mask all chunks, and the number of windows"""
+    era5_eobs = era5_eobs_mkr(fused)
+    ds = tf.data.Dataset.from_generator( lambda: iter(chunks), output_types=(tf.float16, tf.bool),
+                output_shapes=( tf.TensorShape([None, None, None, None]), tf.TensorShape([None, None, None, None]) ) )
+    ds = era5_eobs.window_features( ds, window_len, fused=fused )
+
+    li_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        window_count = 0
+        for window in ds:
+            window_count += 1
+        li_times.append( time.perf_counter() - start )
+
+    return np.mean(li_times), window_count, window
+
+def benchmark_windowing(window_len, chunk_count, repeats):
+    chunks = synthetic_chunks( chunk_count, window_len*25 )
+
+    results = {}
+    for name, fused in [ ("window/flat_map", False), ("fused", True) ]:
+        duration, window_count, last_window = time_chain(chunks, window_len, fused, repeats)
+        results[name] = last_window.numpy()
+        print( "{:<16}\t{} windows\t{:.3f}s\t{:.1f} windows/s".format(name, window_count, duration, window_count/duration) )
+
+    print( "Max abs difference between chains: {}".format( np.max( np.abs( results["fused"] - results["window/flat_map"] ) ) ) )
+# endregion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline")
+
+    parser.add_argument('benchmark', type=str, choices=["pipeline", "decode", "store", "windowing"])
+
+    parser.add_argument('-fd','--fixture_dir', type=str, help='pipeline: directory for the synthetic netCDF4 files', required=False, default="./Data/benchmark_fixtures")
+
+    parser.add_argument('-fs','--fixture_size', type=str, help='pipeline: size of the synthetic netCDF4 files', required=False, default="small", choices=list(FIXTURE_DAYS.keys()))
+
+    parser.add_argument('-bs','--batch_size', type=int, required=False, default=4)
+
+    parser.add_argument('-ts','--t_settings', type=eval, help='pipeline: t_settings passed to the data pipeline', required=False, default='{}')
+
+    parser.add_argument('-mb','--max_batches', type=int, help='pipeline, store: maximum number of batches to produce per run', required=False, default=None)
+
+    parser.add_argument('-pc','--li_parallel_calls', type=str, help='decode: list of the numbers of shards read in parallel', required=False, default="[1,2,4,8]")
+
+    parser.add_argument('-sl','--shard_len', type=int, help='decode: number of time steps in each shard', required=False, default=112)
+
+    parser.add_argument('-wl','--window_len', type=int, help='windowing: number of time steps in each window, lookback_feature', required=False, default=112)
+
+    parser.add_argument('-cc','--chunk_count', type=int, help='windowing: number of synthetic chunks, each holding 25 windows', required=False, default=8)
+
+    parser.add_argument('-r','--repeats', type=int, help='windowing: number of times to time each chain', required=False, default=3)
+
+    args_dict = vars(parser.parse_args() )
+
+    if args_dict['benchmark'] == "pipeline":
+        benchmark_pipeline( args_dict['fixture_dir'], args_dict['fixture_size'], args_dict['batch_size'], args_dict['t_settings'], args_dict['max_batches'] )
+    elif args_dict['benchmark'] == "decode":
+        benchmark_decode( args_dict['fixture_dir'], args_dict['fixture_size'], args_dict['shard_len'], ast.literal_eval(args_dict['li_parallel_calls']), args_dict['t_settings'] )
+    elif args_dict['benchmark'] == "store":
+        check_store( args_dict['fixture_dir'], args_dict['fixture_size'], args_dict['batch_size'], args_dict['t_settings'], args_dict['max_batches'] )
+    else:
+        benchmark_windowing( args_dict['window_len'], args_dict['chunk_count'], args_dict['repeats'] )
@@ -0,0 +1,142 @@
+import os
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+import argparse
+import ast
+import multiprocessing
+import resource
+import time
+
+import tensorflow as tf
+
+import hparameters
+import train
+
+"""Example of how to use
+
+    Measure training steps/sec on synthetic batches, for several values of steps_per_execution:
+        python3 benchmark_training.py -mn "TRUNET" -bs 4 -spe "[1,2,4,8]" -b 32
+
+    Compare step times with and without XLA compilation of the model and the train step:
+        python3 benchmark_training.py -mn "TRUNET" -bs 4 -spe "[1]" -jc "[False,True]"
+
+    Compare throughput and peak memory of a batch size of 16 with a batch size of 4 accumulated over 4 batches:
+        python3 benchmark_training.py -mn "TRUNET" -bs 16 -spe "[1]" -ga "[1]"
+        python3 benchmark_training.py -mn "TRUNET" -bs 4 -spe "[1]" -ga "[4]"
+
+    Compare peak memory and step times with and without recomputing the ConvGRU activations in the backward pass:
+        python3 benchmark_training.py -mn "TRUNET" -bs 4 -spe "[1]" -rc "[False,True]"
+"""
+
+def params_mkr(model_name, batch_size, model_type_settings, t_settings, grad_accum_steps=1):
+    """Returns t_params and m_params for a model, without reading any data"""
+    if model_name == "TRUNET":
+        m_params = hparameters.model_TRUNET_hparameters( model_type_settings=model_type_settings )()
+    elif model_name == "HCGRU":
+        m_params = hparameters.model_HCGRU_hparamaters( model_type_settings=model_type_settings )()
+
+    t_params = hparameters.train_hparameters_ati( batch_size=batch_size, ctsm="1979_1980_1981", t_settings=t_settings, grad_accum_steps=grad_accum_steps,
+                    lookback_target=m_params['data_pipeline_params']['lookback_target'],
+                    lookback_feature=m_params['data_pipeline_params']['lookback_feature'] )()
+    return t_params, m_params
+
+def synthetic_dataset(t_params, m_params):
+    """Returns an infinite dataset repeating one batch of random (feature, target, mask) tensors"""
+    h_w = m_params['region_grid_params']['outer_box_dims']
+    bs = t_params['batch_size']
+
+    feature = tf.random.normal( [bs, t_params['lookback_feature']] + h_w + [len(t_params['vars_for_feature'])], dtype=tf.float16 )
+    target = tf.random.uniform( [bs, t_params['lookback_target']] + h_w, maxval=10.0, dtype=tf.float32 )
+    mask = tf.random.uniform( [bs, t_params['lookback_target']] + h_w ) > 0.1
+    return tf.data.Dataset.from_tensors( (feature, target, mask) ).repeat()
+
+def weather_model_mkr(model_name, batch_size, model_type_settings, t_settings, grad_accum_steps=1):
+    """Returns a WeatherModel, with its model and optimizer, iterating over synthetic batches"""
+    t_params, m_params = params_mkr(model_name, batch_size, model_type_settings, t_settings, grad_accum_steps)
+
+    weather_model = train.WeatherModel(t_params, m_params)
+    weather_model.initialize_model()
+
+    ds = weather_model.strategy.experimental_distribute_dataset( synthetic_dataset(t_params, m_params) )
+    weather_model.iter_train_val = iter(ds)
+    weather_model.initialize_step_functions( ds.element_spec )
+    return weather_model
+
+def time_train_steps(weather_model, steps_per_execution, batches):
+    """Returns training steps/sec when running batches batches, steps_per_execution at a time"""
+    executions = max( batches//steps_per_execution, 1 )
+
+    # Warm up, tracing the step functions
+    weather_model.train_steps( steps_per_execution )
+    weather_model.loss_agg_batch.result().numpy()
+
+    start = time.perf_counter()
+    for _ in range(executions):
+        weather_model.train_steps( steps_per_execution )
+    weather_model.loss_agg_batch.result().numpy() # waiting for the last execution to finish
+    return executions*steps_per_execution / ( time.perf_counter() - start )
+
+def peak_gpu_memory():
+    """Returns the peak memory (MB) allocated on the first GPU, or None without a GPU or when TensorFlow does not report it"""
+    if len( tf.config.list_physical_devices('GPU') ) == 0 or not hasattr(tf.config.experimental, 'get_memory_info'):
+        return None
+    return tf.config.experimental.get_memory_info('GPU:0')['peak']/2**20
+
+def run_config(model_name, batch_size, model_type_settings, t_settings, grad_accum_steps, li_steps_per_execution, batches):
+    """Times the training steps of one model configuration, for each steps_per_execution value
+
+        Returns:
+            tuple: list of steps/sec for each steps_per_execution value, peak RSS (MB) of the process, peak GPU memory (MB), step function trace counts
+    """
+    weather_model = weather_model_mkr( model_name, batch_size, model_type_settings, t_settings, grad_accum_steps )
+
+    li_steps_per_sec = [ time_train_steps(weather_model, steps_per_execution, batches) for steps_per_execution in li_steps_per_execution ]
+
+    return li_steps_per_sec, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, peak_gpu_memory(), weather_model.trace_counts # ru_maxrss is in KB on Linux
+
+def main(model_name, batch_size, model_type_settings, t_settings, li_steps_per_execution, batches, li_jit_compile, li_grad_accum_steps, li_recompute):
+
+    print( "{:<12}\t{:<10}\t{:<16}\t{:<20}\t{:>10}\t{:>10}\t{:>12}\t{:>14}\t{:>14}".format("jit_compile", "recompute", "grad_accum_steps", "steps_per_execution", 
+                "steps/s", "ms/step", "examples/s", "peak RSS (MB)", "peak GPU (MB)") )
+    for jit_compile in li_jit_compile:
+        for recompute in li_recompute:
+            for grad_accum_steps in li_grad_accum_steps:
+                # Each configuration is run in a fresh process, so that the peak memory is not carried over between configurations
+                with multiprocessing.get_context("spawn").Pool(1) as pool:
+                    li_steps_per_sec, peak_rss, peak_gpu, trace_counts = pool.apply( run_config, ( model_name, batch_size,
+                                { **model_type_settings, 'jit_compile':jit_compile, 'recompute':recompute },
+                                { **t_settings, 'jit_compile':jit_compile }, grad_accum_steps, li_steps_per_execution, batches ) )
+
+                for steps_per_execution, steps_per_sec in zip(li_steps_per_execution, li_steps_per_sec):
+                    print( "{:<12}\t{:<10}\t{:<16}\t{:<20}\t{:>10.2f}\t{:>10.1f}\t{:>12.1f}\t{:>14.0f}\t{:>14}".format( str(jit_compile), str(recompute), grad_accum_steps,
+                                steps_per_execution, steps_per_sec, 1000/steps_per_sec, steps_per_sec*batch_size, peak_rss,
+                                "{:.0f}".format(peak_gpu) if peak_gpu is not None else "-" ) )
+
+                print( "Step function traces: {}".format(trace_counts) )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark training steps on synthetic data")
+
+    parser.add_argument('-mn','--model_name', type=str, required=False, default="TRUNET", choices=["TRUNET", "HCGRU"])
+
+    parser.add_argument('-bs','--batch_size', type=int, required=False, default=4)
+
+    parser.add_argument('-mts','--model_type_settings', type=str, help="m_params", required=False,
+                        default="{'stochastic':False,'stochastic_f_pass':1,'discrete_continuous':True,'var_model_type':'mc_dropout','location':['London']}")
+
+    parser.add_argument('-ts','--t_settings', type=str, help="dictioary of custom settings for training", required=False, default='{}')
+
+    parser.add_argument('-spe','--li_steps_per_execution', type=str, help="list of the steps_per_execution values to time", required=False, default="[1,2,4,8]")
+
+    parser.add_argument('-b','--batches', type=int, help="number of batches timed for each value", required=False, default=32)
+
+    parser.add_argument('-jc','--li_jit_compile', type=str, help="list of the jit_compile values to time", required=False, default="[False]")
+
+    parser.add_argument('-ga','--li_grad_accum_steps', type=str, help="list of the grad_accum_steps values to time", required=False, default="[1]")
+
+    parser.add_argument('-rc','--li_recompute', type=str, help="list of the recompute values to time", required=False, default="[False]")
+
+    args_dict = vars(parser.parse_args() )
+
+    main( args_dict['model_name'], args_dict['batch_size'], ast.literal_eval(args_dict['model_type_settings']), ast.literal_eval(args_dict['t_settings']),
+            ast.literal_eval(args_dict['li_steps_per_execution']), args_dict['batches'], ast.literal_eval(args_dict['li_jit_compile']),
+            ast.literal_eval(args_dict['li_grad_accum_steps']), ast.literal_eval(args_dict['li_recompute']) )
@@ -0,0 +1,105 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+
+import utility
+
+"""Example of how to use
+
+    List the dataset caches, with the size and the data pipeline params of each cache:
+        python3 cache_manager.py list
+
+    Check that each cache is complete and that its key matches its data pipeline params:
+        python3 cache_manager.py verify
+
+    Remove incomplete caches (with a lockfile older than one day), caches without metadata and caches unused for over 30 days:
+        python3 cache_manager.py gc -od 30
+"""
+
+def cache_files(cache_fp):
+    """Returns all files belonging to the tf.data cache at cache_fp, including its metadata"""
+    return sorted( set( glob.glob( glob.escape(cache_fp) + ".*" ) + glob.glob( glob.escape(cache_fp) + "_*" ) ) )
+
+def find_caches(cache_dir):
+    """Returns a dictionary mapping the filepath of each cache in cache_dir to its metadata (None if missing)"""
+    caches = {}
+    for fp in glob.glob( os.path.join(cache_dir, "*") ):
+        fn = os.path.basename(fp)
+        # tf.data caches consist of a .index file and data shards, with a .lockfile and temporary "_<shard>" files while being written
+        cache_fp = os.path.join( cache_dir, fn.split(".")[0] )
+        parent_fp, _, shard = cache_fp.rpartition("_")
+        if shard.isdigit() and glob.glob( glob.escape(parent_fp) + ".*" ):
+            cache_fp = parent_fp
+        caches.setdefault( cache_fp, None )
+
+        if fn.endswith(".json"):
+            with open(fp, "r") as f:
+                caches[cache_fp] = json.load(f)
+    return caches
+
+def verify_cache(cache_fp, metadata):
+    """Returns a list of problems with a cache, an empty list for a valid cache"""
+    problems = []
+    if metadata is None:
+        problems.append("missing metadata")
+    elif utility.params_hash( metadata['data_pipeline_params'] ) != metadata['key'] or not os.path.basename(cache_fp).endswith( metadata['key'] ):
+        problems.append("key does not match data pipeline params")
+
+    if os.path.exists( cache_fp + ".lockfile" ):
+        problems.append("incomplete, lockfile present")
+    if not os.path.exists( cache_fp + ".index" ):
+        problems.append("incomplete, index missing")
+    if len( glob.glob( glob.escape(cache_fp) + ".data-*" ) ) == 0:
+        problems.append("incomplete, data missing")
+    return problems
+
+def cache_size(cache_fp):
+    return sum( os.path.getsize(fp) for fp in cache_files(cache_fp) )
+
+def main(command, cache_dir, older_than=None, dry_run=False):
+    caches = find_caches(cache_dir)
+
+    for cache_fp, metadata in sorted( caches.items() ):
+        problems = verify_cache(cache_fp, metadata)
+
+        if command == "list":
+            print( "{}\t{:.1f}MB\tlast used:{}\tmodels:{}".format( os.path.basename(cache_fp), cache_size(cache_fp)/1e6,
+                    metadata.get('last_used') if metadata else None, metadata.get('model_names') if metadata else None ) )
+            if metadata:
+                print( "\t{}".format( json.dumps(metadata['data_pipeline_params'], sort_keys=True) ) )
+
+        elif command == "verify":
+            print( "{}\t{}".format( os.path.basename(cache_fp), "; ".join(problems) if problems else "OK" ) )
+
+        elif command == "gc":
+            if not problems and older_than is not None:
+                last_used = datetime.datetime.fromisoformat( metadata['last_used'] )
+                if datetime.datetime.now() - last_used > datetime.timedelta(days=older_than):
+                    problems.append( "unused for over {} days".format(older_than) )
+
+            # caches being written by a running job are left alone
+            lockfile = cache_fp + ".lockfile"
+            if os.path.exists(lockfile) and datetime.datetime.now().timestamp() - os.path.getmtime(lockfile) < 24*60*60:
+                continue
+
+            if problems:
+                print( "Removing {}\t{}".format( os.path.basename(cache_fp), "; ".join(problems) ) )
+                if not dry_run:
+                    for fp in cache_files(cache_fp):
+                        os.remove(fp)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List, verify and garbage collect dataset caches")
+
+    parser.add_argument('command', type=str, choices=["list", "verify", "gc"])
+
+    parser.add_argument('-cd','--cache_dir', type=str, help='the directory containing the caches', required=False, default="./Data/data_cache")
+
+    parser.add_argument('-od','--older_than', type=float, help='gc: also remove caches unused for this many days', required=False, default=None)
+
+    parser.add_argument('-dr','--dry_run', type=eval, required=False, default='False', choices=[True,False], help="gc: only print the caches that would be removed")
+
+    args_dict = vars(parser.parse_args() )
+    main(**args_dict)
@@ -0,0 +1,136 @@
+import csv
+import os
+import queue
+import threading
+
+import tensorflow as tf
+
+class CheckpointWriter():
+    """Writes checkpoints and training records on a background thread, off the critical path of the training loop
+
+        Checkpoints are written from shadow copies of the model and optimizer variables, held on the CPU.
+        Saving only blocks the training loop while the variables are copied to their shadows,
+            the checkpoint is then written by the background thread while training continues.
+        Jobs are run in the order they are submitted, so records written after a save are written after its checkpoint.
+
+        Example of how to use:
+        ckpt_writer = CheckpointWriter( tf.train.Checkpoint(model=shadow_model, optimizer=shadow_optimizer), checkpoint_dir,
+                        max_to_keep, model.variables + optimizer.variables(), shadow_model.variables + shadow_optimizer.variables() )
+        ckpt_path = ckpt_writer.save( epoch )                                   #Snapshots the variables and saves them in the background
+        ckpt_writer.append_record( "training_progress.csv", {'Epoch':epoch, 'Last_Trained_Batch':batch}, fieldnames )
+        ckpt_writer.close()                                                     #Waits for all pending writes
+    """
+    def __init__(self, shadow_checkpoint, directory, max_to_keep, variables, shadow_variables):
+        """
+            Args:
+                shadow_checkpoint (tf.train.Checkpoint): checkpoint of the shadow model and optimizer.
+                    It must have the same structure as the checkpoint of the model and optimizer, so that it can be restored into them
+                directory (str): directory the checkpoints are saved to
+                max_to_keep (int): number of checkpoints to keep
+                variables (list): variables of the model and optimizer
+                shadow_variables (list): the corresponding variables of the shadow model and optimizer
+        """
+        assert len(variables) == len(shadow_variables), "The shadow variables do not match the variables"
+        for var, shadow_var in zip(variables, shadow_variables):
+            assert var.shape == shadow_var.shape, "Shadow variable {} does not match variable {}".format(shadow_var.name, var.name)
+
+        self.directory = directory
+        self.ckpt_manager = tf.train.CheckpointManager( shadow_checkpoint, directory, max_to_keep=max_to_keep, keep_checkpoint_every_n_hours=None )
+        self.variables = variables
+        self.shadow_variables = shadow_variables
+
+        # Held from the snapshot of the variables until their checkpoint is written, so that a snapshot is never overwritten while being saved
+        self.shadow_lock = threading.Lock()
+
+        self.jobs = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread( target=self.run, daemon=True )
+        self.thread.start()
+
+    def run(self):
+        """Runs the submitted jobs until the None job is received"""
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+
+            fn, args = job
+            try:
+                fn(*args)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def raise_error(self):
+        """Raises any error from a job in the training loop's thread"""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, fn, *args):
+        self.raise_error()
+        self.jobs.put( (fn, args) )
+
+    @tf.function
+    def snapshot(self):
+        for var, shadow_var in zip(self.variables, self.shadow_variables):
+            shadow_var.assign( var )
+
+    def save(self, checkpoint_number):
+        """Snapshots the variables, then saves them as a checkpoint in the background
+
+            Args:
+                checkpoint_number (int): number of the checkpoint, e.g. the epoch
+
+            Returns:
+                str: path of the checkpoint
+        """
+        self.raise_error()
+        self.shadow_lock.acquire()
+        try:
+            self.snapshot()
+        except Exception as e:
+            self.shadow_lock.release()
+            raise e
+
+        # Queued without raising errors from earlier jobs, which are raised before the lock is acquired, 
+        # since the lock is only released once write_checkpoint has run
+        self.jobs.put( (self.write_checkpoint, (checkpoint_number,)) )
+        return os.path.join( self.directory, "ckpt-{}".format(checkpoint_number) )
+
+    @property
+    def latest_checkpoint(self):
+        """Path of the latest checkpoint in the directory, or None if there is none"""
+        return self.ckpt_manager.latest_checkpoint
+
+    def write_checkpoint(self, checkpoint_number):
+        try:
+            self.ckpt_manager.save( checkpoint_number=checkpoint_number )
+        finally:
+            self.shadow_lock.release()
+
+    def append_record(self, fp, record, fieldnames):
+        """Appends a record to the csv file fp in the background"""
+        self.submit( append_record, fp, record, fieldnames )
+
+    def flush(self):
+        """Waits for all submitted jobs to complete"""
+        self.jobs.join()
+        self.raise_error()
+
+    def close(self):
+        """Waits for all submitted jobs to complete, then stops the background thread"""
+        self.flush()
+        self.jobs.put(None)
+        self.thread.join()
+
+def append_record(fp, record, fieldnames):
+    """Appends one row to a csv file, writing the header first if the file is new. Fields missing from record are left empty"""
+    new_file = not os.path.exists(fp) or os.path.getsize(fp) == 0
+    with open(fp, "a", newline="") as f:
+        writer = csv.DictWriter( f, fieldnames=fieldnames )
+        if new_file:
+            writer.writeheader()
+        writer.writerow( record )
@@ -0,0 +1,37 @@
+import argparse
+import ast
+import os
+
+import data_generators
+
+"""Example of how to use
+
+    Convert the model field netCDF4 file into a memory mapped store:
+        python3 create_mf_store.py -dd "./Data" -mf "model_fields_linearly_interpolated_1979-2019.nc" -sn "mf_store"
+
+    Then train or predict from the store by passing its name (relative to the data directory) in the t_settings:
+        python3 train.py ... -ts "{'mf_store':'mf_store'}"
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert model field data to a memory mapped store")
+
+    parser.add_argument('-dd','--data_dir', type=str, help='the directory for the Data', required=False, default="./Data")
+
+    parser.add_argument('-mf','--mf_fn', type=str, help='filename of the model field netCDF4 file', required=False, default="model_fields_linearly_interpolated_1979-2019.nc")
+
+    parser.add_argument('-sn','--store_name', type=str, help='name of the store directory, created in the data directory', required=False, default="mf_store")
+
+    parser.add_argument('-vff','--vars_for_feature', type=str, required=False,
+                        default="['unknown_local_param_137_128', 'unknown_local_param_133_128', 'air_temperature', 'geopotential', 'x_wind', 'y_wind']")
+
+    parser.add_argument('-cl','--chunk_len', type=int, help='number of time steps converted at once', required=False, default=4*365)
+
+    args_dict = vars(parser.parse_args() )
+
+    metadata = data_generators.create_mf_store( fp=os.path.join(args_dict['data_dir'], args_dict['mf_fn']),
+                    store_dir=os.path.join(args_dict['data_dir'], args_dict['store_name']),
+                    vars_for_feature=ast.literal_eval(args_dict['vars_for_feature']),
+                    chunk_len=args_dict['chunk_len'] )
+
+    print("Created store with shape {}".format(metadata['shape']))
@@ -27,6 +27,47 @@ def mse( obs, preds, count=None):
 
     return mse
 
+def masked_count( mask ):
+    """Returns the number of True values in mask, as a float32 scalar"""
+    return tf.reduce_sum( tf.cast(mask, tf.float32) )
+
+def masked_mse( obs, preds, mask, count=None):
+    """Calculates MSE over the values where mask is True. 
+        Masked out values are zeroed, as opposed to removed with tf.boolean_mask, so that all shapes remain static
+
+    Args:
+        obs (tensor): True values
+        preds (tensor): Predicted values
+        mask (tensor): Boolean mask, True for values to include
+        count (tensor, optional): Custom sample size for MSE calc. Defaults to None, the number of True values in mask.
+
+    Returns:
+        mse (float32): mean squared error value, 0 if there are no values to include
+    """
+    if count is None:
+        count = masked_count(mask)
+
+    squared_error = tf.where( mask, tf.square( tf.cast(obs, tf.float32) - tf.cast(preds, tf.float32) ), 0.0 )
+    mse = tf.math.divide_no_nan( tf.reduce_sum(squared_error), tf.cast(count, tf.float32) )
+
+    return mse
+
+def masked_bce( labels, probs, mask):
+    """Calculates the mean binary cross entropy over the values where mask is True, with static shapes
+
+    Args:
+        labels (tensor): True labels, 0 or 1
+        probs (tensor): Predicted probabilities
+        mask (tensor): Boolean mask, True for values to include
+
+    Returns:
+        bce (float32): binary cross entropy value, 0 if there are no values to include
+    """
+    bce = tf.keras.backend.binary_crossentropy( tf.cast(labels, tf.float32), tf.cast(probs, tf.float32), from_logits=False )
+    bce = tf.where( mask, bce, 0.0 )
+
+    return tf.math.divide_no_nan( tf.reduce_sum(bce), masked_count(mask) )
+
 def rNmse(obs, preds , N):
     rN_mask = tf.where( obs >= N, True, False )
 
@@ -2,11 +2,13 @@ from netCDF4 import Dataset, num2date
 import numpy as np
 import tensorflow as tf
 
+import concurrent.futures
 import glob
-import itertools as it
 import json
+import multiprocessing
 import os
 import pickle
+import threading
 
 import utility
 
@@ -24,6 +26,11 @@ import xarray as xr
 
 """
 # region -- Era5_Eobs
+
+# netCDF4/HDF5 is not thread safe, every access to a netCDF4 file made by the parallel readers, 
+# through netCDF4 in Generator_rain or xarray in Generator_mf, is serialised with this lock
+netcdf_lock = threading.Lock()
+
 class Generator():
     """
         Base class for Generator classes
@@ -32,19 +39,31 @@ class Generator():
             rain_gen = Generator_rain(fn, all_at_once=True)
             datum = next(iter(grib_gen))
     """
+
+    # Boundaries of the patches returned by get_locs_for_whole_map, keyed by filepath and region_grid_params
+    whole_map_idxs_cache = {}
+
+    # Whether read can be called from several threads at once without being serialised by netcdf_lock
+    thread_safe = False
     
-    def __init__(self, fp, all_at_once=False):
+    def __init__(self, fp, all_at_once=False, start_idx=0, end_idx=None, stride=1):
         """Extendable Class handling the generation of model field and rain data
             from E-Obs and ERA5 datasets
 
         Args:
             fp (str): Filepath of netCDF4 file containing data.
             all_at_once (bool, optional): Whether or not to load all the data in RAM or not. Defaults to False.
+            start_idx (int, optional): Index of the first time step to yield. Defaults to 0.
+            end_idx (int, optional): Index after the last time step to yield. Defaults to None, the end of the dataset.
+            stride (int, optional): Step between the time steps to yield. Defaults to 1.
             
         """        
         self.generator = None
         self.all_at_once = all_at_once
         self.fp = fp
+        self.start_idx = start_idx
+        self.end_idx = end_idx
+        self.stride = stride
         self.city_latlon = {
             "London": [51.5074, -0.1278],
             "Cardiff": [51.4816 + 0.15, -3.1791 -0.05], #1st Rainiest
@@ -79,14 +98,39 @@ class Generator():
         self.longitude_array = np.linspace(-10.95, 2.95, 140)
         
         # Retrieving information on temporal length of  dataset        
-        with Dataset(self.fp, "r+", format="NETCDF4") as ds:
-            self.data_len = ds.dimensions['time'].size
+        self.data_len = self.get_data_len()
+
+    def get_data_len(self):
+        """Returns the length of the time dimension of the underlying dataset"""
+        with Dataset(self.fp, "r", format="NETCDF4") as ds:
+            return ds.dimensions['time'].size
+
+    def close(self):
+        """Releases any file handles kept open between reads"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
                 
     def yield_all(self):
         pass
 
     def yield_iter(self):
         pass
+
+    def read(self, time_slice):
+        """Reads the time steps in time_slice from file
+
+            Args:
+                time_slice (slice): slice along the time dimension
+
+            Returns:
+                tuple: (data, mask) arrays with a leading time dimension
+        """
+        raise NotImplementedError
     
     def __call__(self, ):
         if(self.all_at_once):
@@ -94,6 +138,30 @@ class Generator():
         else:
             return self.yield_iter()
 
+    def __getitem__(self, t):
+        """Random access to time step t, or to the time steps in a slice t. 
+            Note: t indexes the whole dataset, it is not offset by start_idx
+        """
+        if isinstance(t, slice):
+            return self.read(t)
+
+        t = int(t) if t >= 0 else self.data_len + int(t)
+        data, mask = self.read( slice(t, t+1) )
+        return data[0], mask[0]
+
+    def __len__(self):
+        return len( range(self.start_idx, self.stop_idx(), self.stride) )
+
+    def stop_idx(self):
+        """Returns the index after the last time step to yield"""
+        return self.data_len if self.end_idx is None else min(self.end_idx, self.data_len)
+
+    def time_slices(self, chunk_len):
+        """Yields slices spanning start_idx to end_idx, each containing at most chunk_len time steps"""
+        stop_idx = self.stop_idx()
+        for idx in range(self.start_idx, stop_idx, chunk_len*self.stride):
+            yield slice( idx, min(idx + chunk_len*self.stride, stop_idx), self.stride )
+
     
     def find_idxs_of_loc(self, loc="London"):
         """Returns the grid indexes on the 2D map of the UK which correspond to the location (loc) point
@@ -178,22 +246,48 @@ class Generator():
                 list : return a list of of tuples defining the boundaries of the region
                         of the form [ ([upper_h, lower_h]. [left_w, right_w]), ... ]
         """       
+        # Patches mainly covering non-land (water) surface are removed, see curated_patch_idxs and land_patch_idxs
+        key = ( self.fp, tuple( (k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(region_grid_params.items()) ) )
+
+        if key not in Generator.whole_map_idxs_cache:
+            if region_grid_params.get('min_land_fraction', None) is None:
+                Generator.whole_map_idxs_cache[key] = self.curated_patch_idxs(region_grid_params)
+            else:
+                Generator.whole_map_idxs_cache[key] = self.land_patch_idxs(region_grid_params)
+
+        li_boundaries = [ ( [int(u_h), int(l_h)], [int(l_w), int(r_w)] ) for u_h, l_h, l_w, r_w in Generator.whole_map_idxs_cache[key] ]
+        return li_boundaries 
+
+    def candidate_patch_idxs(self, region_grid_params):
+        """Returns the boundaries of all patches on the 2D map, in row-major order of their upper left corner
+
+            Returns:
+                np.ndarray : int32 array of shape (patches, 4), each row of the form [upper_h, lower_h, left_w, right_w]
+        """
         input_image_shape = region_grid_params['input_image_shape']
         h_shift = region_grid_params['vertical_shift']
         w_shift = region_grid_params['horizontal_shift']
         h_span, w_span = region_grid_params['outer_box_dims']
 
-        #list of values for upper_h and lower_h
+        #values for upper_h and left_w of each candidate patch
         range_h = np.arange(0, input_image_shape[0]-h_span+1, step=h_shift, dtype=np.int32 ) 
-        # list of pairs of values (upper_h, lower_h)
-        li_range_h_pairs = [ [range_h[i], range_h[i]+h_span ] for i in range(0,len(range_h))]
-        
-        #list of values for left_w and right_w
         range_w = np.arange(0, input_image_shape[1]-w_span+1, step=w_shift, dtype=np.int32)
-        # list of pairs of values (left_w, right_w)
-        li_range_w_pairs = [ [range_w[i], range_w[i]+w_span ] for i in range(0,len(range_w))]
+        upper_h, left_w = [ arr.reshape(-1) for arr in np.meshgrid(range_h, range_w, indexing='ij') ]
 
-        li_boundaries = list( it.product( li_range_h_pairs, li_range_w_pairs ) )
+        return np.stack( [upper_h, upper_h+h_span, left_w, left_w+w_span], axis=-1 ).astype(np.int32)
+
+    def curated_patch_idxs(self, region_grid_params):
+        """Returns the boundaries of all patches on the 2D map, except the hand-curated list of patches covering 
+            non-land (water) surface on a UK part. This is the default set of patches used when location is ["All"]
+
+            Args:
+                region_grid_params (dictionary): a dictioary containing information on the sizes of 
+                    patches to be extract from the main image
+
+            Returns:
+                np.ndarray : int32 array of shape (patches, 4), each row of the form [upper_h, lower_h, left_w, right_w]
+        """
+        idxs = self.candidate_patch_idxs(region_grid_params)
 
         # A list of points on grid to remove representing non-land (water) surface on a UK part
         boundaries_to_remove = [ ([0,16],[0,16]), ([0,16],[4,20]), ([0,16],[8,24]), ([0,16],[12,28]), ([0,16],[16,32]), ([0,16],[20,36]), ([0,16],[24,40]), ([0,16],[28,44]),  ([0,16],[32,48]),                           ([0,16],[64,80]),([0,16],[68,84]),([0,16],[72,88]), ([0,16],[76,92]), ([0,16],[80,96]), ([0,16],[84,100]), ([0,16],[88,104]),([0,16],[92,108]),([0,16],[96,112]), ([0,16],[100,116]),([0,16],[104,120]),([0,16],[108,124]), ([0,16],[112,128]), ([0,16],[116,132]), ([0,16],[120,136]), ([0,16],[124,140]),
@@ -214,8 +308,39 @@ class Generator():
                                    ([80,96],[0,16]), ([80,96],[4,20]), ([80,96],[8,24]), ([80,96],[12,28]), ([80,96],[14,32]), ([80,96],[18,36]), ([80,96],[22,40]),
                                    ([84,100],[0,16]), ([84,100],[4,20]), ([84,100],[8,24]), ([84,100],[12,28]),([84,100],[14,32]), ([84,100],[18,36]), ([84,100],[22,40])  ]
 
-        li_boundaries = [ x for x in li_boundaries if x not in boundaries_to_remove]
-        return li_boundaries 
+        set_to_remove = set( (u_h, l_h, l_w, r_w) for (u_h, l_h), (l_w, r_w) in boundaries_to_remove )
+        keep = [ tuple(int(v) for v in row) not in set_to_remove for row in idxs ]
+        return idxs[ np.array(keep, dtype=np.bool_) ]
+
+    def land_patch_idxs(self, region_grid_params):
+        """Returns the boundaries of all patches on the 2D map which contain at least region_grid_params['min_land_fraction'] of land.
+            The land fraction of each candidate patch is computed from a summed-area table of the land mask.
+            This is used in place of curated_patch_idxs when min_land_fraction is set
+
+            Args:
+                region_grid_params (dictionary): a dictioary containing information on the sizes of 
+                    patches to be extract from the main image
+
+            Returns:
+                np.ndarray : int32 array of shape (patches, 4), each row of the form [upper_h, lower_h, left_w, right_w]
+        """
+        input_image_shape = region_grid_params['input_image_shape']
+        h_span, w_span = region_grid_params['outer_box_dims']
+        idxs = self.candidate_patch_idxs(region_grid_params)
+        upper_h, left_w = idxs[:, 0], idxs[:, 2]
+
+        # Summed-area table of the land mask, padded so that sat[h, w] = sum(land[:h, :w])
+        land = self.land_mask()[ :input_image_shape[0], :input_image_shape[1] ].astype(np.int32)
+        sat = np.pad( land.cumsum(axis=0).cumsum(axis=1), ((1,0),(1,0)) )
+
+        land_count = sat[upper_h+h_span, left_w+w_span] - sat[upper_h, left_w+w_span] - sat[upper_h+h_span, left_w] + sat[upper_h, left_w]
+        land_fraction = land_count / (h_span*w_span)
+
+        return idxs[ land_fraction >= region_grid_params['min_land_fraction'] ]
+
+    def land_mask(self):
+        """Returns a boolean (h,w) array which is True for land points"""
+        raise NotImplementedError
 
 class Generator_rain(Generator):
     """ A generator for E-obs 0.1 degree rain data
@@ -224,23 +349,44 @@ class Generator_rain(Generator):
         A python generator for the rain data
         
     """
-    def __init__(self, **generator_params ):
+    def __init__(self, chunk_len=365, **generator_params ):
+        """
+        Args:
+            chunk_len (int, optional): Number of days read from file at once. Defaults to 365.
+            generator_params : list of params to pass to base Generator class
+        """
         super(Generator_rain, self).__init__(**generator_params)
+        self.chunk_len = chunk_len
         
     def yield_all(self):
         """ Return all data at once
         """
         with Dataset(self.fp, "r", format="NETCDF4",keepweakref=True) as ds:
-            _data = ds.variables['rr'][:]
+            _data = ds.variables['rr'][ self.start_idx:self.stop_idx():self.stride ]
             yield np.ma.getdata(_data), np.ma.getmask(_data)   
             
     def yield_iter(self):
-        """ Return data in chunks"""
-        ds = Dataset(self.fp, "r", format="NETCDF4", keepweakref=True)
-        for chunk in ds.variables['rr'][:]:
-            data = np.ma.getdata(chunk)
-            mask = np.logical_not( np.ma.getmask(chunk) )
-            yield data[ ::-1 , :], mask[::-1, :]
+        """ Return data day by day, reading chunk_len days at a time from start_idx onwards"""
+        for time_slice in self.time_slices(self.chunk_len):
+            data, mask = self.read(time_slice)
+
+            for _idx in range(data.shape[0]):
+                yield data[_idx], mask[_idx]
+
+    def read(self, time_slice):
+        with netcdf_lock, Dataset(self.fp, "r", format="NETCDF4", keepweakref=True) as ds:
+            chunk = ds.variables['rr'][time_slice]
+        
+        data = np.ma.getdata(chunk)[ :, ::-1, : ]
+        mask = np.logical_not( np.ma.getmaskarray(chunk) )[ :, ::-1, : ]
+        return data, mask
+
+    def land_mask(self):
+        """Returns a boolean (h,w) array which is True for points with an E-obs rain observation on any of the 
+            first chunk_len days, i.e. land. Points missing an observation on a single day are still counted as land"""
+        with netcdf_lock, Dataset(self.fp, "r", format="NETCDF4", keepweakref=True) as ds:
+            _data = ds.variables['rr'][ :self.chunk_len ]
+            return np.logical_not( np.ma.getmaskarray(_data) ).any(axis=0)[::-1, :]
 
 
     def __call__(self):
@@ -260,8 +406,7 @@ class Generator_mf(Generator):
 
         self.vars_for_feature = vars_for_feature #['unknown_local_param_137_128', 'unknown_local_param_133_128', 'air_temperature', 'geopotential', 'x_wind', 'y_wind' ]       
         self.seq_len = seq_len*25 if seq_len else 1400
-        self.start_idx = 0
-        self.end_idx =0 
+        self.xr_gn = None
         #self.ds = Dataset(self.fp, "r", format="NETCDF4")
 
 
@@ -269,7 +414,7 @@ class Generator_mf(Generator):
         
         xr_gn = xr.open_dataset(self.fp, cache=False, decode_times=False, decode_cf=False)
 
-        slice_t = slice( self.start_idx , self.end_idx )
+        slice_t = slice( self.start_idx , self.end_idx, self.stride )
         slice_h = slice(1,103-2 )
         slice_w = slice(2,144-2)
         
@@ -278,27 +423,142 @@ class Generator_mf(Generator):
         return xr_gn
 
     def yield_iter(self):
-        xr_gn = xr.open_dataset(self.fp, cache=False, decode_times=False, decode_cf=False)
+        for time_slice in self.time_slices(self.seq_len):
+            yield self.read(time_slice)
+
+    def read(self, time_slice):
+        # The file is opened lazily, under the lock, by whichever parallel reader reads first
+        with netcdf_lock:
+            if self.xr_gn is None:
+                self.xr_gn = xr.open_dataset(self.fp, cache=False, decode_times=False, decode_cf=False)
+
+            next_marray = [ self.xr_gn[name].isel(time=time_slice).to_masked_array(copy=True) for name in self.vars_for_feature ]
+        
+        list_datamask = [(np.ma.getdata(_mar), np.ma.getmaskarray(_mar)) for _mar in next_marray]
         
-        idx = self.start_idx
+        _data, _masks = list(zip(*list_datamask))
+        _masks = [ np.logical_not(_mask_val) for _mask_val in _masks] 
+        stacked_data = np.stack(_data, axis=-1)
+        stacked_masks = np.stack(_masks, axis=-1)
         
-        while idx < self.data_len:
+        return stacked_data[ :, 1:-2, 2:-2, :], stacked_masks[ :, 1:-2 , 2:-2, :] #(100,140,6)
+
+    def __getstate__(self):
+        # The open file is not copied to reader processes, each opens its own
+        state = self.__dict__.copy()
+        state['xr_gn'] = None
+        return state
+
+    def close(self):
+        """Closes the model field file kept open by read"""
+        with netcdf_lock:
+            if self.xr_gn is not None:
+                self.xr_gn.close()
+                self.xr_gn = None
+
+class Generator_mf_store(Generator_mf):
+    """Creates a generator for a model field store produced by create_mf_store.
+        The store holds the cropped and stacked model fields as a float16 array and
+        the mask as a bit-packed uint8 array, both of which are read through np.memmap
+    """
 
-            adj_seq_len = min(self.seq_len, self.data_len - idx )
+    # Reads from the memmap store need no lock
+    thread_safe = True
 
-            _slice = slice( idx , idx  + adj_seq_len)
-            next_marray = [ xr_gn[name].isel(time=_slice).to_masked_array(copy=True) for name in self.vars_for_feature ]
-            
-            list_datamask = [(np.ma.getdata(_mar), np.ma.getmask(_mar)) for _mar in next_marray]
-            
-            _data, _masks = list(zip(*list_datamask))
-            _masks = [ np.logical_not(_mask_val) for _mask_val in _masks] 
-            stacked_data = np.stack(_data, axis=-1)
-            stacked_masks = np.stack(_masks, axis=-1)
+    def __init__(self, store_dir, vars_for_feature, seq_len=100, **generator_params):
+        """
+        Args:
+            store_dir (str): directory containing the store metadata, values and mask files
+            vars_for_feature (list): names of the model fields, must match the order used in the store
+            seq_len (int, optional): Number of lookback windows yielded per chunk. Defaults to 100.
+        """
+        self.store_dir = store_dir
+        with open( os.path.join(store_dir, "metadata.json"), "r") as f:
+            self.metadata = json.load(f)
 
-            idx += adj_seq_len
-            
-            yield stacked_data[ :, 1:-2, 2:-2, :], stacked_masks[ :, 1:-2 , 2:-2, :] #(100,140,6) 
+        if list(self.metadata['vars_for_feature']) != list(vars_for_feature):
+            raise ValueError("The model fields in the store {} do not match vars_for_feature {}".format(self.metadata['vars_for_feature'], vars_for_feature))
+
+        super(Generator_mf_store, self).__init__(fp=store_dir, vars_for_feature=vars_for_feature, seq_len=seq_len, **generator_params)
+
+        self.values = np.load( os.path.join(store_dir, "values.npy"), mmap_mode='r')
+        self.packed_mask = np.load( os.path.join(store_dir, "mask.npy"), mmap_mode='r')
+
+    def get_data_len(self):
+        return self.metadata['shape'][0]
+
+    def unpack_mask(self, packed_mask):
+        """Unpacks a (t, bytes) bit-packed mask to a boolean array of shape (t, h, w, c)"""
+        _shape = self.metadata['shape']
+        mask = np.unpackbits( packed_mask, axis=-1, count=int(np.prod(_shape[1:])) )
+        return mask.reshape( [-1] + _shape[1:] ).view(np.bool_)
+
+    def yield_all(self):
+        return self.read( slice( self.start_idx, self.end_idx, self.stride ) )
+
+    def read(self, time_slice):
+        # Copies are returned, the memmap slices are read-only views which must not be handed to tf.data
+        return np.array(self.values[time_slice]), self.unpack_mask(self.packed_mask[time_slice]) #(100,140,6)
+
+# The copy of the generator read by a reader process of Era5_Eobs.interleaved_reader
+process_generator = None
+
+def init_process_reader(generator):
+    """Initializes a reader process with its own copy of the generator"""
+    global process_generator
+    process_generator = generator
+
+def process_read(time_slice):
+    """Reads the time steps in time_slice with the reader process' generator"""
+    return process_generator.read(time_slice)
+
+def create_mf_store(fp, store_dir, vars_for_feature, chunk_len=4*365):
+    """Converts the model field netCDF4 file into a store that can be read by Generator_mf_store.
+        The cropping, stacking and unmasking in Generator_mf.yield_iter are performed once here, chunk by chunk.
+
+        Args:
+            fp (str): Filepath of the model fields netCDF4 file
+            store_dir (str): Directory to save the store to
+            vars_for_feature (list): names of the model fields to store
+            chunk_len (int, optional): Number of time steps to convert at once. Defaults to 4*365.
+
+        Returns:
+            dict: metadata describing the store
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    values = None
+
+    with Generator_mf(fp=fp, vars_for_feature=vars_for_feature, all_at_once=False, seq_len=None) as mf_gen:
+        mf_gen.seq_len = chunk_len
+
+        for _data, _mask in mf_gen.yield_iter():
+
+            if values is None:
+                shape = [ mf_gen.data_len ] + list(_data.shape[1:])
+                mask_bytes = int( np.ceil( np.prod(shape[1:]) / 8 ) )
+                values = np.lib.format.open_memmap( os.path.join(store_dir, "values.npy"), mode="w+", dtype=np.float16, shape=tuple(shape) )
+                packed_mask = np.lib.format.open_memmap( os.path.join(store_dir, "mask.npy"), mode="w+", dtype=np.uint8, shape=(shape[0], mask_bytes) )
+                idx = 0
+
+            _len = _data.shape[0]
+            values[idx:idx+_len] = _data.astype(np.float16)
+            packed_mask[idx:idx+_len] = np.packbits( _mask.reshape([_len, -1]), axis=-1 )
+            idx += _len
+
+    values.flush()
+    packed_mask.flush()
+
+    metadata = {
+        'source':os.path.abspath(fp),
+        'vars_for_feature':list(vars_for_feature),
+        'shape':shape,
+        'dtype':'float16',
+        'chunk_len':chunk_len
+    }
+    with open( os.path.join(store_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    return metadata
 
 class Era5_Eobs():
 
@@ -319,12 +579,29 @@ class Era5_Eobs():
         self.rain_data = Generator_rain(fp=fp_rain, all_at_once=False)
 
         # Create python generator for model field data 
-        mf_fp = data_dir + "/" + self.t_params.get('mf_fn', "model_fields_linearly_interpolated_1979-2019.nc")
-        self.mf_data = Generator_mf(fp=mf_fp, vars_for_feature=self.t_params['vars_for_feature'], all_at_once=False, seq_len=self.t_params.get('lookback_feature',None) )
+        mf_store = self.t_params.get('t_settings',{}).get('mf_store', None)
+        if mf_store:
+            # Reading from a pre-converted memory mapped store, see create_mf_store
+            self.mf_data = Generator_mf_store(store_dir=data_dir + "/" + mf_store, vars_for_feature=self.t_params['vars_for_feature'], all_at_once=False, seq_len=self.t_params.get('lookback_feature',None) )
+        else:
+            mf_fp = data_dir + "/" + self.t_params.get('mf_fn', "model_fields_linearly_interpolated_1979-2019.nc")
+            self.mf_data = Generator_mf(fp=mf_fp, vars_for_feature=self.t_params['vars_for_feature'], all_at_once=False, seq_len=self.t_params.get('lookback_feature',None) )
+
+        # Process pools decoding netCDF4 shards for interleaved_reader
+        self.read_pools = []
 
         # Update information on the locations of interest to extract data from
         self.location_size_calc()
 
+    def close(self):
+        """Closes the files kept open by the rain and model field generators and stops the reader processes, 
+            once the datasets produced by load_data_era5eobs are no longer iterated"""
+        self.rain_data.close()
+        self.mf_data.close()
+        for pool in self.read_pools:
+            pool.shutdown()
+        self.read_pools = []
+
     def location_size_calc(self, custom_location=None): 
         """ Updates list of locations to evaluate on
 
@@ -370,18 +647,23 @@ class Era5_Eobs():
         # Retreiving one index for each of the feature and target data. This index indicates the first value in the dataset to use
         start_idx_feat, start_idx_tar = self.get_start_idx(start_date)
         self.mf_data.start_idx = start_idx_feat
+        self.rain_data.start_idx = start_idx_tar
 
         
         # region - Preparing feature model fields        
-        ds_feat = tf.data.Dataset.from_generator( self.mf_data , output_types=(tf.float16, tf.bool),
-                     output_shapes=( tf.TensorShape([None, None, None, None]),tf.TensorShape([None, None, None, None])) ) #(values, mask) 
-        ds_feat = ds_feat.unbatch()
+        parallel_reader = self.t_params.get('t_settings',{}).get('parallel_reader', False)
+
+        if parallel_reader:
+            ds_feat = self.interleaved_reader( self.mf_data, self.mf_data.seq_len, (tf.float16, tf.bool),
+                            ( tf.TensorShape([None, None, None, None]),tf.TensorShape([None, None, None, None])), _num_parallel_calls ) #(values, mask) 
+        else:
+            ds_feat = tf.data.Dataset.from_generator( self.mf_data , output_types=(tf.float16, tf.bool),
+                        output_shapes=( tf.TensorShape([None, None, None, None]),tf.TensorShape([None, None, None, None])) ) #(values, mask) 
         
         if self.m_params['time_sequential'] == True:
-            ds_feat = ds_feat.window(size = self.t_params.get('lookback_feature',28) , stride=1, shift=self.t_params.get('lookback_feature',28) , drop_remainder=True )
-            ds_feat = ds_feat.flat_map( lambda *window: tf.data.Dataset.zip( tuple([w.batch(self.t_params.get('lookback_feature',28) ) for w in window ] ) ) )  # shape (lookback,h, w, 6)
-            ds_feat = ds_feat.map( lambda arr_data, arr_mask: self.mf_normalize_mask( arr_data, arr_mask), num_parallel_calls= _num_parallel_calls) 
+            ds_feat = self.window_features( ds_feat, self.t_params.get('lookback_feature',28), _num_parallel_calls )  # shape (lookback,h, w, 6)
         else:
+            ds_feat = ds_feat.unbatch()
             ds_feat = ds_feat.batch(4)
             ds_feat = ds_feat.map( lambda arr_data, arr_mask: self.mf_normalize_mask( arr_data, arr_mask), num_parallel_calls= _num_parallel_calls) 
             ds_feat = ds_feat.map( lambda arr_data: tf.reshape(tf.transpose(arr_data,[1,2,0,3]), [100,140,24])  , num_parallel_calls=_num_parallel_calls )
@@ -390,8 +672,12 @@ class Era5_Eobs():
         # endregion
 
         # region - Preparing Eobs target_rain_data   
-        ds_tar = tf.data.Dataset.from_generator( self.rain_data, output_types=(tf.float32, tf.bool), output_shapes=( tf.TensorShape([None, None]), tf.TensorShape([ None, None])) ) # (values, mask) 
-        ds_tar = ds_tar.skip(start_idx_tar)     #skipping to correct point
+        if parallel_reader:
+            ds_tar = self.interleaved_reader( self.rain_data, self.rain_data.chunk_len, (tf.float32, tf.bool), 
+                            ( tf.TensorShape([None, None, None]), tf.TensorShape([None, None, None])), _num_parallel_calls ) # (values, mask) 
+            ds_tar = ds_tar.unbatch()
+        else:
+            ds_tar = tf.data.Dataset.from_generator( self.rain_data, output_types=(tf.float32, tf.bool), output_shapes=( tf.TensorShape([None, None]), tf.TensorShape([ None, None])) ) # (values, mask) 
 
         if self.m_params['time_sequential'] == True:
             ds_tar = ds_tar.window(size = self.t_params.get('lookback_target',128) , stride=1, shift=self.t_params['window_shift'] , drop_remainder=True )
@@ -415,6 +701,78 @@ class Era5_Eobs():
         #     ds = ds.prefetch(prefetch)
         #     return ds, None        
 
+    def window_features(self, ds_feat, window_len, _num_parallel_calls=-1, fused=None):
+        """Splits chunks of model field data into non overlapping windows of window_len time steps, then normalizes and masks them
+
+            With fused=True each chunk is normalized and masked as a whole and reshaped into windows,
+                this requires every chunk except the last to have a multiple of window_len time steps.
+                The trailing time steps of the last chunk, which do not fill a window, are dropped.
+            Otherwise the chunks are unbatched and the time steps windowed and batched one by one.
+
+            Args:
+                ds_feat (tf.data.Dataset): Dataset of (data, mask) chunks, each with a leading time dimension
+                window_len (int): number of time steps in each window
+                _num_parallel_calls (int, optional): Number of parallel calls. Defaults to -1.
+                fused (bool, optional): Whether to window chunks by reshaping. Defaults to the 'fused_window' t_setting, or True.
+
+            Returns:
+                tf.data.Dataset: Dataset of normalized and masked windows of shape (window_len, h, w, c)
+        """
+        if fused is None:
+            fused = self.t_params.get('t_settings',{}).get('fused_window', True) and self.mf_data.seq_len % window_len == 0
+
+        if fused:
+            ds_feat = ds_feat.map( lambda arr_data, arr_mask: self.mf_window_normalize_mask( arr_data, arr_mask, window_len), num_parallel_calls=_num_parallel_calls )
+            ds_feat = ds_feat.unbatch()
+        else:
+            ds_feat = ds_feat.unbatch()
+            ds_feat = ds_feat.window(size = window_len , stride=1, shift=window_len , drop_remainder=True )
+            ds_feat = ds_feat.flat_map( lambda *window: tf.data.Dataset.zip( tuple([w.batch( window_len ) for w in window ] ) ) )
+            ds_feat = ds_feat.map( lambda arr_data, arr_mask: self.mf_normalize_mask( arr_data, arr_mask), num_parallel_calls= _num_parallel_calls) 
+        return ds_feat
+
+    def interleaved_reader(self, generator, shard_len, output_types, output_shapes, _num_parallel_calls=-1):
+        """Reads a generator's time span as shards of shard_len time steps. Shards are read in parallel
+            through the generator's random access interface and returned in time order
+
+            Args:
+                generator (Generator): generator to read from, between its start_idx and end_idx
+                shard_len (int): number of time steps in each shard
+                output_types (tuple): tf dtypes of the (data, mask) arrays returned by the generator
+                output_shapes (tuple): tf shapes of the (data, mask) shards
+                _num_parallel_calls (int, optional): Number of shards to read in parallel. Defaults to -1.
+
+            Returns:
+                tf.data.Dataset: Dataset of (data, mask) shards, each with a leading time dimension
+        """
+        stop_idx = generator.stop_idx()
+        shard_starts = np.arange( generator.start_idx, stop_idx, shard_len*generator.stride, dtype=np.int64 )
+        np_types = [ _type.as_numpy_dtype for _type in output_types ]
+
+        if generator.thread_safe or not self.t_params.get('t_settings',{}).get('process_reader', True):
+            read = generator.read
+        else:
+            # netCDF4 reads are serialised by netcdf_lock within a process, so the shards are decoded by a pool of processes,
+            # each holding its own copy of the generator. Processes are spawned, since forking after Tensorflow has started is unsafe
+            pool = concurrent.futures.ProcessPoolExecutor( max_workers=_num_parallel_calls if _num_parallel_calls > 0 else os.cpu_count(),
+                        mp_context=multiprocessing.get_context("spawn"), initializer=init_process_reader, initargs=(generator,) )
+            self.read_pools.append( pool )
+            read = lambda time_slice: pool.submit( process_read, time_slice ).result()
+        
+        def read_shard(shard_start):
+            time_slice = slice( int(shard_start), min( int(shard_start) + shard_len*generator.stride, stop_idx), generator.stride )
+            return tuple( np.asarray(arr, dtype=np_type) for arr, np_type in zip( read(time_slice), np_types) )
+
+        def shard_ds(shard_start):
+            data, mask = tf.numpy_function( read_shard, [shard_start], output_types )
+            data.set_shape( output_shapes[0] )
+            mask.set_shape( output_shapes[1] )
+            return tf.data.Dataset.from_tensors( (data, mask) )
+
+        ds = tf.data.Dataset.from_tensor_slices( shard_starts )
+        ds = ds.interleave( shard_ds, block_length=1, num_parallel_calls=_num_parallel_calls, deterministic=True )
+        return ds
+
     def get_start_idx(self, start_date):
         """ Returns two indexes
                 The first index is the idx at which to start extracting data from the feature dataset
@@ -468,6 +826,22 @@ class Era5_Eobs():
         arr_data = tf.where( arr_mask, arr_data, self.t_params['mask_fill_value']['model_field'])
         return arr_data #(h,w,c)
 
+    def mf_window_normalize_mask(self, arr_data, arr_mask, window_len):
+        """Normalize and Mask a chunk of model field data, then reshape it into non overlapping windows
+
+            Args:
+                arr_data (tensor): model field data of shape (t, h, w, c)
+                arr_mask (tensor): model field mask of shape (t, h, w, c)
+                window_len (int): number of time steps in each window
+
+            Returns:
+                tensor: Masked and normalized model field data of shape (t//window_len, window_len, h, w, c)
+        """
+        window_count = tf.shape(arr_data)[0] // window_len
+        arr_data = self.mf_normalize_mask( arr_data[ :window_count*window_len ], arr_mask[ :window_count*window_len ] )
+
+        return tf.reshape( arr_data, tf.concat( [ [window_count, window_len], tf.shape(arr_data)[1:] ], axis=0 ) )
+
     def location_extractor(self, ds, locations, batch_count):
         """Extracts the temporal slice of patches corresponding to the locations of interest 
 
@@ -488,17 +862,31 @@ class Era5_Eobs():
         else:
             li_hw_idxs = [ self.rain_data.find_idx_of_loc_region( _loc, self.m_params['region_grid_params'] ) for _loc in locations ] #[ (h_idx,w_idx), ... ]
         
-        # Creating seperate datasets for each location
-        li_ds = [ ds.map( lambda mf, rain, rmask : self.select_region(mf, rain, rmask, _idx[0], _idx[1]), num_parallel_calls=-1) for _idx in li_hw_idxs ]
-        
-        # Concatenating all datasets for each location
         batches_per_loc = int(batch_count/len(li_hw_idxs))
-        for idx in range(len(li_ds)):
-            li_ds[idx] = li_ds[idx].unbatch().batch( self.t_params['batch_size'], drop_remainder=True ).take(batches_per_loc)
-            if idx==0:
-                ds = li_ds[0]
-            else:
-                ds = ds.concatenate( li_ds[idx] )
+
+        if self.t_params.get('t_settings',{}).get('patch_gather', False):
+            # Extracting all patches from each time window with one gather. Batches contain a single location, 
+            # but are interleaved across locations in time order, as opposed to location by location.
+            # Opt-in, since the take/skip train/val split and the state reset indexes in train.py assume location by location order
+            ds = ds.map( lambda mf, rain, rmask: self.gather_patches(mf, rain, rmask, li_hw_idxs), num_parallel_calls=-1 )
+            ds = ds.unbatch() # flat stream of (mf, rain, rmask, loc_id)
+            ds = ds.apply( tf.data.experimental.group_by_window( key_func=lambda mf, rain, rmask, loc_id: loc_id,
+                        reduce_func=lambda key, _ds: _ds.batch( self.t_params['batch_size'], drop_remainder=True ),
+                        window_size=self.t_params['batch_size'] ) )
+            ds = ds.take( batches_per_loc*len(li_hw_idxs) )
+            ds = ds.map( lambda mf, rain, rmask, loc_id: (mf, rain, rmask), num_parallel_calls=-1 )
+
+        else:
+            # Creating seperate datasets for each location
+            li_ds = [ ds.map( lambda mf, rain, rmask : self.select_region(mf, rain, rmask, _idx[0], _idx[1]), num_parallel_calls=-1) for _idx in li_hw_idxs ]
+            
+            # Concatenating all datasets for each location
+            for idx in range(len(li_ds)):
+                li_ds[idx] = li_ds[idx].unbatch().batch( self.t_params['batch_size'], drop_remainder=True ).take(batches_per_loc)
+                if idx==0:
+                    ds = li_ds[0]
+                else:
+                    ds = ds.concatenate( li_ds[idx] )
         
         # pair of indexes locating the central location within the grid region extracted for any location
         idx_loc_in_region = np.floor_divide( self.m_params['region_grid_params']['outer_box_dims'], 2) #This specifies the index of the central location of interest within the (h,w) patch    
@@ -527,4 +915,54 @@ class Era5_Eobs():
         rain_mask = rain_mask[ ..., h_idxs[0]:h_idxs[1] , w_idxs[0]:w_idxs[1] ]
             
         return tf.expand_dims(mf,axis=0), tf.expand_dims(rain,axis=0), tf.expand_dims(rain_mask,axis=0) #Note: expand_dim for unbatch/batch compatibility
+
+    def gather_patches(self, mf, rain, rain_mask, li_hw_idxs):
+        """ Extract the regions relating to all [h_idxs, w_idxs] pairs with a single gather per tensor
+
+            Args:
+                mf : model field data (..., h, w, c)
+                rain : target rain data (..., h, w)
+                rain_mask : target rain mask (..., h, w)
+                li_hw_idxs : list of ([upper_h, lower_h], [left_w, right_w]) boundaries
+
+            Returns:
+                tuple: (mf, rain, rain_mask, loc_id) each with a leading dimension of size len(li_hw_idxs)
+        """
+        img_h, img_w = self.m_params['region_grid_params']['input_image_shape']
+        flat_idxs = self.patch_flat_idxs(li_hw_idxs, img_w) # (locs, h_span, w_span)
+
+        # flattening the spatial dims so that each patch is one gather along a single axis
+        mf = tf.reshape( mf, tf.concat( [ tf.shape(mf)[:-3], [img_h*img_w, tf.shape(mf)[-1]] ], axis=0) )
+        rain = tf.reshape( rain, tf.concat( [ tf.shape(rain)[:-2], [img_h*img_w] ], axis=0) )
+        rain_mask = tf.reshape( rain_mask, tf.concat( [ tf.shape(rain_mask)[:-2], [img_h*img_w] ], axis=0) )
+
+        mf = tf.gather( mf, flat_idxs, axis=len(mf.shape)-2 )                           # (..., locs, h_span, w_span, c)
+        rain = tf.gather( rain, flat_idxs, axis=len(rain.shape)-1 )                     # (..., locs, h_span, w_span)
+        rain_mask = tf.gather( rain_mask, flat_idxs, axis=len(rain_mask.shape)-1 )      # (..., locs, h_span, w_span)
+
+        # moving the location dimension to the front
+        mf = tf.transpose( mf, self.loc_first_perm(len(mf.shape), 4) )
+        rain = tf.transpose( rain, self.loc_first_perm(len(rain.shape), 3) )
+        rain_mask = tf.transpose( rain_mask, self.loc_first_perm(len(rain_mask.shape), 3) )
+
+        loc_id = tf.range( len(li_hw_idxs), dtype=tf.int64 )
+        return mf, rain, rain_mask, loc_id
+
+    @staticmethod
+    def patch_flat_idxs(li_hw_idxs, img_w):
+        """Returns an array (locs, h_span, w_span) of indexes into a flattened (h*w) image for each patch"""
+        upper_h = np.array( [ _idx[0][0] for _idx in li_hw_idxs ], dtype=np.int32 )
+        left_w = np.array( [ _idx[1][0] for _idx in li_hw_idxs ], dtype=np.int32 )
+        h_span = li_hw_idxs[0][0][1] - li_hw_idxs[0][0][0]
+        w_span = li_hw_idxs[0][1][1] - li_hw_idxs[0][1][0]
+
+        rows = upper_h[:, None] + np.arange(h_span, dtype=np.int32)    # (locs, h_span)
+        cols = left_w[:, None] + np.arange(w_span, dtype=np.int32)     # (locs, w_span)
+        return rows[:, :, None]*img_w + cols[:, None, :]
+
+    @staticmethod
+    def loc_first_perm(rank, loc_dims):
+        """Permutation moving the location axis, followed by loc_dims-1 patch axes, to the front of the leading axes"""
+        lead = rank - loc_dims
+        return [lead] + list(range(lead)) + list(range(lead+1, rank))
 # endregion
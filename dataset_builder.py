@@ -0,0 +1,181 @@
+import os
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
+import json
+import shutil
+
+import tensorflow as tf
+
+import data_generators
+import utility
+
+"""Example of how to use
+
+    Export the preprocessed training and validation datasets used by train.py, for the same arguments:
+        python3 dataset_builder.py -mn "TRUNET" -ctsm "1979_2009_2014" -mts "{'stochastic':False,'stochastic_f_pass':1,'discrete_continuous':True,'var_model_type':'mc_dropout','do':0.2,'ido':0.2,'rdo':0.3,'location':['London','Cardiff']}" -dd "./Data" -bs 64
+
+    train.py then reads the exported shards, instead of building and caching the datasets, whenever
+        an export with matching data pipeline params exists in the export directory
+"""
+
+MANIFEST_FN = "manifest.json"
+
+def export_dir_mkr(t_params, m_params):
+    """Returns the directory holding the export for the data pipeline params of t_params and m_params"""
+    export_root = t_params.get('t_settings', {}).get('tfrecord_dir', './Data/tfrecords')
+    return os.path.join( export_root, utility.params_hash( utility.data_pipeline_params(t_params, m_params) ) )
+
+def load_manifest(export_dir):
+    """Returns the manifest of the export in export_dir, or None if the dataset has not been exported"""
+    fp = os.path.join(export_dir, MANIFEST_FN)
+    if not os.path.exists(fp):
+        return None
+    with open(fp, "r") as f:
+        return json.load(f)
+
+def build_dataset(t_params, m_params, shard_batches=100):
+    """Materialises the normalised, masked, windowed and patch extracted (feature, target, mask) tuples
+        for training and validation as sharded GZIP compressed TFRecord files.
+
+        Args:
+            t_params (dict): params for training
+            m_params (dict): params for model
+            shard_batches (int, optional): Number of batches to save in each shard. Defaults to 100.
+
+        Returns:
+            str: directory containing the shards and the manifest
+    """
+    export_dir = export_dir_mkr(t_params, m_params)
+    if load_manifest(export_dir) is not None:
+        print("Dataset already exported to {}".format(export_dir))
+        return export_dir
+
+    era5_eobs = data_generators.Era5_Eobs( t_params, m_params )
+    train_batches = int(t_params['train_batches'] * era5_eobs.loc_count)
+    val_batches = int(t_params['val_batches'] * era5_eobs.loc_count)
+
+    # Writing to a temporary directory so that a partially written export is never read
+    tmp_dir = export_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    ds, _ = era5_eobs.load_data_era5eobs( train_batches + val_batches, t_params['start_date'], t_params['parallel_calls'] )
+
+    # The train and val batches are written in one pass over ds, so the data pipeline is only run once
+    splits = write_shards( ds, tmp_dir, [ ("train", train_batches), ("val", val_batches) ], t_params['batch_size'], shard_batches, t_params['parallel_calls'] )
+
+    manifest = {
+        'hash':os.path.basename(export_dir),
+        'data_pipeline_params':utility.data_pipeline_params(t_params, m_params),
+        'batch_size':t_params['batch_size'],
+        'loc_count':era5_eobs.loc_count,
+        'element_spec':[ {'dtype':spec.dtype.name, 'shape':spec.shape.as_list()[1:] } for spec in ds.element_spec ],
+        'splits':splits
+    }
+    with open( os.path.join(tmp_dir, MANIFEST_FN), "w") as f:
+        json.dump( manifest, f, default=utility.default_pkl, indent=4 )
+    era5_eobs.close()
+
+    os.rename(tmp_dir, export_dir)
+    print("Exported dataset to {}".format(export_dir))
+    return export_dir
+
+def write_shards(ds, export_dir, li_splits, batch_size, shard_batches, _num_parallel_calls=-1):
+    """Writes each example in the batched dataset ds to shards of shard_batches batches, in a single pass over ds.
+        Batches are assigned to the splits in order, e.g. [("train", 100), ("val", 20)] writes the first 100 batches
+        to the train shards and the next 20 to the val shards
+
+        Args:
+            li_splits (list): (split, batches) pairs
+
+        Returns:
+            dict: information on the files and number of examples written, for each split
+    """
+    ds = ds.unbatch().map( lambda feature, target, mask: ( tf.io.serialize_tensor(feature), tf.io.serialize_tensor(target), tf.io.serialize_tensor(mask) ),
+                num_parallel_calls=_num_parallel_calls )
+    options = tf.io.TFRecordOptions(compression_type="GZIP")
+
+    splits = { split:{'files':[], 'examples':0 } for split, _ in li_splits }
+    examples_per_shard = shard_batches * batch_size
+    li_split_examples = [ (split, batches*batch_size) for split, batches in li_splits ]
+    split_idx = 0
+    writer = None
+
+    for feature, target, mask in ds.as_numpy_iterator():
+        # Moving to the next split once the current one holds all of its examples
+        while split_idx < len(li_split_examples) and splits[ li_split_examples[split_idx][0] ]['examples'] == li_split_examples[split_idx][1]:
+            split_idx += 1
+            if writer is not None:
+                writer.close()
+                writer = None
+        if split_idx == len(li_split_examples):
+            break
+
+        split = li_split_examples[split_idx][0]
+        if writer is None or splits[split]['examples'] % examples_per_shard == 0:
+            if writer is not None:
+                writer.close()
+            fn = "{}-{:05d}.tfrecord.gz".format(split, len(splits[split]['files']))
+            writer = tf.io.TFRecordWriter( os.path.join(export_dir, fn), options=options )
+            splits[split]['files'].append(fn)
+
+        example = tf.train.Example( features=tf.train.Features( feature={
+            'feature': tf.train.Feature( bytes_list=tf.train.BytesList(value=[feature]) ),
+            'target': tf.train.Feature( bytes_list=tf.train.BytesList(value=[target]) ),
+            'mask': tf.train.Feature( bytes_list=tf.train.BytesList(value=[mask]) ) } ) )
+        writer.write( example.SerializeToString() )
+        splits[split]['examples'] += 1
+
+    if writer is not None:
+        writer.close()
+
+    return splits
+
+def load_dataset(export_dir, split, batch_size, _num_parallel_calls=-1, shuffle_buffer=0, cycle_length=8):
+    """Loads an exported split as a dataset of (feature, target, mask) batches. 
+        Without a shuffle buffer, examples are read in the order they were exported.
+        Otherwise the order of the shards is shuffled on each iteration and examples are interleaved from cycle_length shards
+        at a time, then shuffled in a buffer of shuffle_buffer examples. Memory use is set by the buffer, not by the size of the split
+
+        Args:
+            export_dir (str): directory containing the shards and the manifest
+            split (str): "train" or "val"
+            batch_size (int): batch size
+            _num_parallel_calls (int, optional): Number of parallel calls used to read shards and parse examples. Defaults to -1.
+            shuffle_buffer (int, optional): Number of examples in the shuffle buffer. Defaults to 0, no shuffling.
+            cycle_length (int, optional): Number of shards read from at once when shuffling. Defaults to 8.
+
+        Returns:
+            tf.data.Dataset
+    """
+    manifest = load_manifest(export_dir)
+
+    fps = [ os.path.join(export_dir, fn) for fn in manifest['splits'][split]['files'] ]
+    if shuffle_buffer > 0:
+        ds = tf.data.Dataset.from_tensor_slices( fps ).shuffle( len(fps), reshuffle_each_iteration=True )
+        ds = ds.interleave( lambda fp: tf.data.TFRecordDataset( fp, compression_type="GZIP" ), cycle_length=min(cycle_length, len(fps)), 
+                block_length=1, num_parallel_calls=_num_parallel_calls )
+        ds = ds.shuffle( shuffle_buffer, reshuffle_each_iteration=True ) # shuffling the serialized examples, before they are parsed
+    else:
+        ds = tf.data.TFRecordDataset( fps, compression_type="GZIP" )
+    ds = ds.map( lambda record: parse_example(record, manifest['element_spec']), num_parallel_calls=_num_parallel_calls )
+    ds = ds.batch( batch_size, drop_remainder=True )
+    return ds
+
+def parse_example(record, element_spec):
+    """Parses a serialized example into a (feature, target, mask) tuple"""
+    features = tf.io.parse_single_example( record, { name:tf.io.FixedLenFeature([], tf.string) for name in ['feature','target','mask'] } )
+
+    li_tensors = []
+    for name, spec in zip( ['feature','target','mask'], element_spec ):
+        tensor = tf.io.parse_tensor( features[name], out_type=tf.dtypes.as_dtype(spec['dtype']) )
+        tensor.set_shape( spec['shape'] )
+        li_tensors.append(tensor)
+
+    return tuple(li_tensors)
+
+if __name__ == "__main__":
+    s_dir = utility.get_script_directory(None)
+    args_dict = utility.parse_arguments(s_dir)
+
+    t_params, m_params = utility.load_params(args_dict)
+    build_dataset(t_params, m_params)
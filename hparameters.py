@@ -50,7 +50,8 @@ class MParams(HParams):
                 'inner_box_dims':[4,4],
                 'vertical_shift':4,
                 'horizontal_shift':4,
-                'input_image_shape':[100,140]}
+                'input_image_shape':[100,140],
+                'min_land_fraction':None}   # None uses the hand-curated list of water patches, a fraction e.g. 0.25 removes patches with a lower fraction of land points, when location is ["All"]
             }
         )
     
@@ -138,7 +139,7 @@ class model_TRUNET_hparameters(MParams):
             {'bias':None, 'total_key_depth': kd  ,'total_value_depth':vd, 'output_depth': vd   ,
             'num_heads': nh , 'dropout_rate':DROPOUT, 'value_dropout':model_type_settings.get('value_dropout',True),
             'max_relative_position':None, "transform_value_antecedent":True,  "transform_output":True, 
-            'implementation':1, 'conv_ops_qk':self.conv_ops_qk,
+            'implementation':model_type_settings.get('attn_implementation',1), 'conv_ops_qk':self.conv_ops_qk,
             "value_conv":{ "filters":int(filters * 2), 'kernel_size':[3,3] ,'use_bias':True, "activation":'relu', 'name':"v", 'bias_regularizer':bias_reg_attn, 'kernel_regularizer':kernel_reg_attn ,'padding':'same' },
             "output_conv":{ "filters":int(filters * 2), 'kernel_size':[3,3] ,'use_bias':True, "activation":'relu', 'name':"outp", 'bias_regularizer':bias_reg_attn, 'kernel_regularizer':kernel_reg_attn, 'padding':'same' }
             } 
@@ -155,9 +156,11 @@ class model_TRUNET_hparameters(MParams):
             {'filters':filters , 'kernel_size':ks, 'padding':'same', 
                 'return_sequences':True, 'dropout':ido, 'recurrent_dropout':rdo,
                 'stateful':stateful, 'recurrent_regularizer': recurrent_reg, 'kernel_regularizer':kernel_reg,
-                'bias_regularizer':bias_reg, 'implementation':1 ,'layer_norm':None }
-             for ks in kernel_size_enc
+                'bias_regularizer':bias_reg, 'implementation':model_type_settings.get('gru_implementation',1) ,'layer_norm':None,
+                'hoist_input_conv':model_type_settings.get('hoist_input_conv',False) and idx==0 }
+             for idx, ks in enumerate(kernel_size_enc)
         ] #list of params for each ConvGRU layer in the Encoder
+            #Note: the inputs to the cells of the attention layers depend on their hidden state, so only the first layer's input convolutions are hoisted
       
         ENCODER_PARAMS = {
             'enc_layer_count': enc_layer_count,
@@ -185,7 +188,8 @@ class model_TRUNET_hparameters(MParams):
                 'recurrent_regularizer': recurrent_reg,
                 'bias_regularizer':bias_reg,
                 'stateful':stateful,
-                'implementation':1 ,'layer_norm':[ None, None ]  }
+                'implementation':model_type_settings.get('gru_implementation',1) ,'layer_norm':[ None, None ],
+                'hoist_input_conv':model_type_settings.get('hoist_input_conv',False)  }
              for ks in kernel_size_dec ] #list of dictionaries containing params for each ConvGRU layer in decoder
 
         decoder_layers_num_of_splits = attn_layers_num_of_splits[:decoder_layer_count]
@@ -258,7 +262,8 @@ class model_HCGRU_hparamaters(MParams):
                                 'recurrent_regularizer': None,
                                 'bias_regularizer':tf.keras.regularizers.l2(0.0),
                                 'layer_norm': None,
-                                'implementation':1, 'stateful':stateful  }
+                                'implementation':model_type_settings.get('gru_implementation',1), 'stateful':stateful,
+                                'hoist_input_conv':model_type_settings.get('hoist_input_conv',False)  }
                                 for ks,ps,rs,dp,rdp in zip( kernel_sizes, paddings, return_sequences, input_dropout, recurrent_dropout)  ]
 
         conv1_layer_params = {'filters': int(  8*(((filters*2)/3)//8)) , 'kernel_size':[3,3], 'activation':'relu','padding':'same','bias_regularizer':tf.keras.regularizers.l2(0.0) }  
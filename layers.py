@@ -16,6 +16,7 @@ from tensorflow.python.ops import clip_ops, math_ops, nn
 
 
 
+import layers_attn
 import layers_convgru2D
 import utility
 
@@ -30,7 +31,7 @@ except:
 class TRUNET_Encoder(tf.keras.layers.Layer):
 	"""TRU-NET Encoder-Decoder Encoder
 	"""	
-	def __init__(self, t_params, encoder_params, h_w, attn_ablation=0):
+	def __init__(self, t_params, encoder_params, h_w, attn_ablation=0, recompute=False, fused_bidirectional=False):
 		"""
 
 		Args:
@@ -43,13 +44,17 @@ class TRUNET_Encoder(tf.keras.layers.Layer):
 				2 = Concatenation
 				3 = Last hidden state
 				4 = Self Attention
+			recompute (bool, optional): Whether to recompute the activations of the ConvGRU layers
+				in the backward pass, instead of keeping them in memory. Defaults to False.
+			fused_bidirectional (bool, optional): Whether to step the forward and backward directions
+				of the ConvGRU layers in one time loop. Defaults to False.
 		"""		
 		super( TRUNET_Encoder, self ).__init__()
 		self.encoder_params = encoder_params
 		self.t_params = t_params
 		self.layer_count = encoder_params['enc_layer_count']	
 		
-		self.CGRU_Input_Layer = TRUNET_CGRU_Input_Layer( t_params, encoder_params['CGRUs_params'][0] )
+		self.CGRU_Input_Layer = TRUNET_CGRU_Input_Layer( t_params, encoder_params['CGRUs_params'][0], recompute, fused_bidirectional )
 
 		#Dynamically init ConvGRU w/ ILCA layers
 		self.CGRU_Attn_layers = []
@@ -57,7 +62,7 @@ class TRUNET_Encoder(tf.keras.layers.Layer):
 			_layer = TRUNET_CGRU_Attention_Layer( t_params, encoder_params['CGRUs_params'][idx+1],
 						encoder_params['ATTN_params'][idx], encoder_params['ATTN_DOWNSCALING_params_enc'] ,
 						encoder_params['seq_len_factor_reduction'][idx], self.encoder_params['attn_layers_num_of_splits'][idx],
-						h_w, attn_ablation )
+						h_w, attn_ablation, recompute, fused_bidirectional )
 
 			self.CGRU_Attn_layers.append(_layer)
 				
@@ -83,9 +88,11 @@ class TRUNET_Encoder(tf.keras.layers.Layer):
 		return hidden_states
 
 class TRUNET_Decoder(tf.keras.layers.Layer):
-	def __init__(self, t_params ,decoder_params, h_w):
+	def __init__(self, t_params ,decoder_params, h_w, recompute=False, fused_bidirectional=False):
 		"""
 		:param list decoder_params: a list of dictionaries of the contained LSTM's params
+		:param bool recompute: whether to recompute the activations of the ConvGRU layers in the backward pass
+		:param bool fused_bidirectional: whether to step the forward and backward directions of the ConvGRU layers in one time loop
 		"""
 		super( TRUNET_Decoder, self ).__init__()
 		self.decoder_params = decoder_params
@@ -98,7 +105,7 @@ class TRUNET_Decoder(tf.keras.layers.Layer):
 		for idx in range( self.layer_count ):
 			_layer = TRUNET_CGRU_Decoder_Layer( t_params, self.decoder_params['CGRUs_params'][idx], 
 												decoder_params['seq_len_factor_expansion'][idx],
-												decoder_params['seq_len'][idx], h_w )
+												decoder_params['seq_len'][idx], h_w, recompute, fused_bidirectional )
 			self.CGRU_2cell_layers.append(_layer)
 
 		self.seq_lens = self.decoder_params['attn_layer_no_splits']
@@ -191,17 +198,21 @@ class TRUNET_OutputLayer(tf.keras.layers.Layer):
 class TRUNET_CGRU_Input_Layer(tf.keras.layers.Layer):
 	"""Convolutional GRU Input Layer
 	"""	
-	def __init__(self, t_params, layer_params):
+	def __init__(self, t_params, layer_params, recompute=False, fused_bidirectional=False):
 		super( TRUNET_CGRU_Input_Layer, self ).__init__()
 			
 		self.layer_params = layer_params #list of dictionaries containing params for all layers
-		self.convGRU = Bidirectional( layer=layers_convgru2D.ConvGRU2D( **self.layer_params ), 
+		self.recompute = recompute
+		self.convGRU = bidirectional_wrapper(fused_bidirectional)( layer=layers_convgru2D.ConvGRU2D( **self.layer_params ), 
 										backward_layer=layers_convgru2D.ConvGRU2D( **copy.deepcopy(self.layer_params), go_backwards=True ),
 										merge_mode=None ) 		
 	def call( self, _input, training ):
-		hidden_states_f, hidden_states_b = self.convGRU(_input, training=training ) #(bs, seq_len_1, h, w, c)
-		hidden_states = tf.concat([hidden_states_f, hidden_states_b],axis=-1) 
-		return hidden_states #(bs, seq_len_1, h, w, c*2)
+		def _call(_input):
+			hidden_states_f, hidden_states_b = self.convGRU(_input, training=training ) #(bs, seq_len_1, h, w, c)
+			hidden_states = tf.concat([hidden_states_f, hidden_states_b],axis=-1) 
+			return hidden_states #(bs, seq_len_1, h, w, c*2)
+
+		return recompute_call( _call, [_input], self.recompute and training, self.convGRU.built )
 
 class TRUNET_CGRU_Attention_Layer(tf.keras.layers.Layer):
 	"""ConvGRU Layer w/ Inter Layer Cross Attention
@@ -210,15 +221,16 @@ class TRUNET_CGRU_Attention_Layer(tf.keras.layers.Layer):
 		Returns:
 			[type]: tensor of shape (bs, seq_len/n, h2, w2, c2)
 	"""	
-	def __init__(self, t_params, CGRU_params, attn_params, attn_downscaling_params ,seq_len_factor_reduction, num_of_splits, h_w, attn_ablation=0 ):
+	def __init__(self, t_params, CGRU_params, attn_params, attn_downscaling_params ,seq_len_factor_reduction, num_of_splits, h_w, attn_ablation=0, recompute=False, fused_bidirectional=False ):
 		super( TRUNET_CGRU_Attention_Layer, self ).__init__()
 
 		self.trainable 					= t_params['trainable']
 		self.num_of_splits 				= num_of_splits
 		self.slfr 						= seq_len_factor_reduction
 		self.attn_ablation				= attn_ablation
+		self.recompute					= recompute
 		
-		self.convGRU_attn		= Bidirectional( layer=layers_convgru2D.ConvGRU2D_attn( **CGRU_params,
+		self.convGRU_attn		= bidirectional_wrapper(fused_bidirectional)( layer=layers_convgru2D.ConvGRU2D_attn( **CGRU_params,
 													attn_params=attn_params , attn_downscaling_params=attn_downscaling_params ,
 													attn_factor_reduc=self.slfr ,trainable=self.trainable, attn_ablation=self.attn_ablation  ),
 
@@ -230,22 +242,25 @@ class TRUNET_CGRU_Attention_Layer(tf.keras.layers.Layer):
 
 	def call(self, input_hidden_states, training=True):
 		
-		hidden_states_f, hidden_states_b = self.convGRU_attn(input_hidden_states, training=training)
-		hidden_states = tf.concat( [hidden_states_f, hidden_states_b], axis=-1 )
+		def _call(input_hidden_states):
+			hidden_states_f, hidden_states_b = self.convGRU_attn(input_hidden_states, training=training)
+			hidden_states = tf.concat( [hidden_states_f, hidden_states_b], axis=-1 )
+			return hidden_states #shape(bs, seq_len, h, w, 2*c2)
 
-		return hidden_states #shape(bs, seq_len, h, w, 2*c2)
+		return recompute_call( _call, [input_hidden_states], self.recompute and training, self.convGRU_attn.built )
 
 class TRUNET_CGRU_Decoder_Layer(tf.keras.layers.Layer):
-	def __init__(self, t_params ,layer_params, input_2_factor_increase, seq_len, h_w ):
+	def __init__(self, t_params ,layer_params, input_2_factor_increase, seq_len, h_w, recompute=False, fused_bidirectional=False ):
 		super( TRUNET_CGRU_Decoder_Layer, self ).__init__()
 		
 		self.layer_params = layer_params
+		self.recompute = recompute
 		# The factor increase in repeated GRU operations between this decoder layer and the next
 		self.input_2_factor_increase = input_2_factor_increase
 		self.seq_len = seq_len
 		
 		# Shapes to facilitate tensorflow graph operations
-		self.convGRU =  tf.keras.layers.Bidirectional( layer=layers_convgru2D.ConvGRU2D_Dualcell(**layer_params,trainable=self.trainable ),
+		self.convGRU =  bidirectional_wrapper(fused_bidirectional)( layer=layers_convgru2D.ConvGRU2D_Dualcell(**layer_params,trainable=self.trainable ),
 														backward_layer=layers_convgru2D.ConvGRU2D_Dualcell( **copy.deepcopy(layer_params),go_backwards=True,trainable=self.trainable ),
 														merge_mode=None)
 	
@@ -263,12 +278,55 @@ class TRUNET_CGRU_Decoder_Layer(tf.keras.layers.Layer):
 				[type]: tensor wth shape #(bs, seq_len1, h,w,c3)
 		"""		
 
-		input2 = tf.keras.backend.repeat_elements( input2, self.input_2_factor_increase, axis=1) #(bs, seq_len1, h,w,c2)
-		
-		inputs = tf.concat( [input1, input2], axis=-1 ) 
-		hidden_states_f, hidden_states_b = self.convGRU( inputs, training=training )
-		hidden_states = tf.concat( [hidden_states_f,hidden_states_b], axis=-1 ) 
-		return hidden_states
+		def _call(input1, input2):
+			input2 = tf.keras.backend.repeat_elements( input2, self.input_2_factor_increase, axis=1) #(bs, seq_len1, h,w,c2)
+			
+			inputs = tf.concat( [input1, input2], axis=-1 ) 
+			hidden_states_f, hidden_states_b = self.convGRU( inputs, training=training )
+			hidden_states = tf.concat( [hidden_states_f,hidden_states_b], axis=-1 ) 
+			return hidden_states
+
+		return recompute_call( _call, [input1, input2], self.recompute and training, self.convGRU.built )
+
+def bidirectional_wrapper(fused_bidirectional):
+	"""Returns the wrapper class for bidirectional ConvGRU layers
+
+		Args:
+			fused_bidirectional (bool): whether the forward and backward directions are stepped in one time loop
+
+		Returns:
+			class: layers_convgru2D.FusedBidirectional or Bidirectional
+	"""
+	return layers_convgru2D.FusedBidirectional if fused_bidirectional else Bidirectional
+
+def recompute_call(fn, inputs, recompute, built):
+	"""Calls fn on inputs. If recompute is True, the intermediate activations of fn
+		are not kept for the backward pass, but recomputed from inputs by tf.recompute_grad,
+		trading compute for memory.
+
+		When recomputing, fn is run within layers_attn.seeded_dropout_scope with a seed sampled once per call,
+		so the recomputation applies the same ConvGRU and attention dropout masks as the forward pass
+
+		Args:
+			fn (function): function of the input tensors, returning a tensor
+			inputs (list): input tensors
+			recompute (bool): whether to recompute the activations of fn in the backward pass
+			built (bool): whether the layers called by fn are built. The first call, which creates
+				the layers' variables, is never recomputed
+
+		Returns:
+			tensor: output of fn
+	"""
+	if recompute and built:
+		seed = tf.random.uniform( [2], maxval=tf.int32.max, dtype=tf.int32 )
+
+		def seeded_fn(*inputs):
+			with layers_attn.seeded_dropout_scope(seed):
+				return fn(*inputs)
+
+		return tf.recompute_grad(seeded_fn)(*inputs)
+	else:
+		return fn(*inputs)
 # endregion
 
 
@@ -1,4 +1,8 @@
 
+import contextlib
+import functools
+import threading
+
 import numpy as np
 import tensorflow as tf
 tf.keras.backend.set_floatx('float16')
@@ -47,6 +51,8 @@ class MultiHead2DAttention_v2(Layer):
                                 unique relation embeddings for. Only relevant
                                 when using "dot_product_relative" attention.
             heads_share_relative_embedding: boolean to share relative embeddings
+            implementation: 1 for the Tensor2Tensor attention ops, 2 for tf.einsum ops on static
+                        shapes, which avoid the transposes and reshapes of split_heads and _relative_attention_inner
             add_relative_to_values: a boolean for whether to add relative component to
                                         values.
             name: an optional string.
@@ -94,6 +100,7 @@ class MultiHead2DAttention_v2(Layer):
                         conv_ops_qk = False,
                         key_conv = None,
                         query_conv = None,
+                        implementation = 1,
                         **kwargs):
         #region --- arguments
         self.trainable = trainable
@@ -117,6 +124,7 @@ class MultiHead2DAttention_v2(Layer):
         
         self.conv_ops_qk = conv_ops_qk
         self.dropout_broadcast_dims = dropout_broadcast_dims
+        self.implementation = implementation
 
         self.kq_downscale_kernelshape = attention_scaling_params['kq_downscale_kernelshape']
         self.kq_downscale_stride = attention_scaling_params['kq_downscale_stride']
@@ -145,15 +153,15 @@ class MultiHead2DAttention_v2(Layer):
         if self.transform_value_antecedent == True:
             #model variant - convolution operation on value antecedent
             self.conv_value = tf.keras.layers.TimeDistributed( tf.keras.layers.Conv2D(  **self.value_conv ) ) 
-            self.do_v1 = tf.keras.layers.TimeDistributed( tf.keras.layers.SpatialDropout2D( value_dropout_rate ) )
+            self.do_v1 = tf.keras.layers.TimeDistributed( SeededSpatialDropout2D( value_dropout_rate ) )
         
         if self.transform_output == True:
             self.conv_output = tf.keras.layers.TimeDistributed( tf.keras.layers.Conv2D(  **output_conv) ) 
-            self.do_v2= tf.keras.layers.TimeDistributed( tf.keras.layers.SpatialDropout2D( value_dropout_rate ) )
+            self.do_v2= tf.keras.layers.TimeDistributed( SeededSpatialDropout2D( value_dropout_rate ) )
 
         #Maximum relative attention
         if( self.max_relative_position==None ):
-           self.max_relative_position =  tf.constant( int(self.attn_factor_reduc/2 - 1) , dtype=tf.int32 )
+           self.max_relative_position =  int(self.attn_factor_reduc/2 - 1)
 
         embding_size = int( self.attn_factor_reduc ) #int(self.max_relative_position * 2 + 1)
         
@@ -219,61 +227,117 @@ class MultiHead2DAttention_v2(Layer):
         
         #region Scaled --- Relative Multi-Head Dot-Product Attention
         
-        # gathering multiple heads # Link to Paper: Equation 
-        q = split_heads(q, self.num_heads)
-        k = split_heads(k, self.num_heads) #[batch_size, num_heads, length, hidden_size/num_heads]
-        v = split_heads(v, self.num_heads)
-        
-        if self.conv_ops_qk==True or self.value_dropout==True:
-            q *= tf.cast( k.shape[-1], dtype=q.dtype)**-0.5     
-        else:
-            q *= tf.cast(self.key_depth_per_head,dtype=q.dtype)**-0.5
+        if self.implementation == 2:
+            outp = self.einsum_attention(q, k, v) #Link To Paper: Equations (3)
 
-        # relative positional embeddings for keys and values
-        q_length = q.shape.as_list()[2]
-        k_length = k.shape.as_list()[2]
-        relations_keys = _generate_relative_positions_embeddings( q_length, k_length,
-                                self.max_relative_position, self.embeddings_table_k, self._compute_dtype )
+        else:
+            # gathering multiple heads # Link to Paper: Equation 
+            q = split_heads(q, self.num_heads)
+            k = split_heads(k, self.num_heads) #[batch_size, num_heads, length, hidden_size/num_heads]
+            v = split_heads(v, self.num_heads)
+        
+            if self.conv_ops_qk==True or self.value_dropout==True:
+                q *= tf.cast( k.shape[-1], dtype=q.dtype)**-0.5     
+            else:
+                q *= tf.cast(self.key_depth_per_head,dtype=q.dtype)**-0.5
 
-        relations_values = _generate_relative_positions_embeddings(q_length, k_length,
-                                self.max_relative_position, self.embeddings_table_v, self._compute_dtype )
+            # relative positional embeddings for keys and values
+            q_length = q.shape.as_list()[2]
+            k_length = k.shape.as_list()[2]
+            relations_keys, relations_values = self.relative_positions_embeddings( q_length, k_length )
         
-        # Compute attention w/ relative positional embeddings
-        logits = _relative_attention_inner(q, k, relations_keys, transpose=True) #Link To Paper: Equations (3) - Score operation
+            # Compute attention w/ relative positional embeddings
+            logits = _relative_attention_inner(q, k, relations_keys, transpose=True) #Link To Paper: Equations (3) - Score operation
 
-        # masking attention logits using bias #In our implementation no bias is used
-        if self.bias is not None:
-            bias = cast_like(self.bias, logits)
-            logits += bias
+            # masking attention logits using bias #In our implementation no bias is used
+            if self.bias is not None:
+                bias = cast_like(self.bias, logits)
+                logits += bias
 
-        # If logits are fp16, upcast before softmax
-        logits = maybe_upcast(logits, self._compute_dtype, self.dtype)
-        weights = tf.nn.softmax(logits, name="attention_weights") #Link To Paper: Equations (3) - normalizing exp()/sum(exp()) operation
-        weights = cast_like(weights, q)
+            # If logits are fp16, upcast before softmax
+            logits = maybe_upcast(logits, self._compute_dtype, self.dtype)
+            weights = tf.nn.softmax(logits, name="attention_weights") #Link To Paper: Equations (3) - normalizing exp()/sum(exp()) operation
+            weights = cast_like(weights, q)
 
-        # Dropping out attention links for each head.
-        weights = dropout_with_broadcast_dims(
-            weights, 1.0 - self.dropout_rate, broadcast_dims=self.dropout_broadcast_dims) 
+            # Dropping out attention links for each head.
+            weights = dropout_with_broadcast_dims(
+                weights, 1.0 - self.dropout_rate, broadcast_dims=self.dropout_broadcast_dims) 
 
-        outp = _relative_attention_inner(weights, v, relations_values, False) #Link To Paper: Equations (3) - calculating \hat(A}
+            outp = _relative_attention_inner(weights, v, relations_values, False) #Link To Paper: Equations (3) - calculating \hat(A}
 
-        #outp = combine_heads(outp)
-        outp = combine_last_two_dimensions(tf.transpose(outp, [0, 2, 1, 3]))
+            #outp = combine_heads(outp)
+            outp = combine_last_two_dimensions(tf.transpose(outp, [0, 2, 1, 3]))
         
         if self.transform_output == True:
             # convolution ops on output precedent \hat{A}
             outp.set_shape(outp.shape.as_list()[:-1] + [self.total_value_depth]) 
-            outp = tf.reshape( outp, output_shape )
+            outp = tf.reshape( outp, [-1] + output_shape[1:] )
             outp = self.conv_output( self.do_v2(outp,training=training), training=training)
             #outp = self.dense_output( outp, training=training)
             
         else:
-            outp = tf.reshape( outp, output_shape ) 
+            outp = tf.reshape( outp, [-1] + output_shape[1:] ) 
         
         # endregion
 
         return outp    #( batch_size, seq_len, height, width, filters_in)
 
+    def einsum_attention(self, q, k, v):
+        """Scaled relative multi-head dot-product attention, using tf.einsum on the static shapes of q, k and v
+
+            Args:
+                q : a Tensor with shape (batch_size, q_length, key_depth)
+                k : a Tensor with shape (batch_size, k_length, key_depth)
+                v : a Tensor with shape (batch_size, k_length, value_depth)
+
+            Returns:
+                tensor: A Tensor with shape (batch_size, q_length, value_depth)
+        """
+        q_length, key_depth = q.shape.as_list()[1:]
+        k_length, value_depth = v.shape.as_list()[1:]
+
+        # gathering multiple heads, along the third dimension
+        q = tf.reshape( q, [-1, q_length, self.num_heads, key_depth//self.num_heads] )
+        k = tf.reshape( k, [-1, k_length, self.num_heads, key_depth//self.num_heads] )
+        v = tf.reshape( v, [-1, k_length, self.num_heads, value_depth//self.num_heads] )
+
+        if self.conv_ops_qk==True or self.value_dropout==True:
+            q *= tf.cast( key_depth//self.num_heads, dtype=q.dtype)**-0.5
+        else:
+            q *= tf.cast(self.key_depth_per_head,dtype=q.dtype)**-0.5
+
+        # relative positional embeddings for keys and values
+        relations_keys, relations_values = self.relative_positions_embeddings( q_length, k_length )
+
+        # Compute attention w/ relative positional embeddings
+        logits = tf.einsum( 'bqhd,bkhd->bhqk', q, k ) + tf.einsum( 'bqhd,qkd->bhqk', q, relations_keys )
+
+        if self.bias is not None:
+            logits += cast_like(self.bias, logits)
+
+        logits = maybe_upcast(logits, self._compute_dtype, self.dtype)
+        weights = cast_like( tf.nn.softmax(logits, name="attention_weights"), q )
+
+        weights = dropout_with_broadcast_dims(
+            weights, 1.0 - self.dropout_rate, broadcast_dims=self.dropout_broadcast_dims)
+
+        outp = tf.einsum( 'bhqk,bkhd->bqhd', weights, v ) + tf.einsum( 'bhqk,qkd->bqhd', weights, relations_values )
+
+        # combining heads, which are already adjacent in the last two dimensions
+        return tf.reshape( outp, [-1, q_length, value_depth] )
+
+    def relative_positions_embeddings(self, q_length, k_length):
+        """Returns the relative positional embeddings for keys and values, each of shape [q_length, k_length, depth]
+
+            The relative position index matrix is memoised for each (q_length, k_length), so each call only gathers
+                the embeddings from the embedding tables
+        """
+        relative_positions_matrix = _relative_positions_matrix( q_length, k_length, self.max_relative_position )
+
+        relations_keys = tf.cast( tf.gather(self.embeddings_table_k, relative_positions_matrix), self._compute_dtype )
+        relations_values = tf.cast( tf.gather(self.embeddings_table_v, relative_positions_matrix), self._compute_dtype )
+        return relations_keys, relations_values
+
     def get_config(self):
         config = {
             'trainable':
@@ -307,11 +371,48 @@ class MultiHead2DAttention_v2(Layer):
             'max_relative_position':
                 self.max_relative_position,
             'heads_share_relative_embedding':
-                self.heads_share_relative_embedding    
+                self.heads_share_relative_embedding,
+            'implementation':
+                self.implementation
         }
 
         return config
 
+class SeededSpatialDropout2D(tf.keras.layers.SpatialDropout2D):
+    """SpatialDropout2D whose mask is sampled with a stateless random op within seeded_dropout_scope"""
+
+    def call(self, inputs, training=None):
+        seed = next_dropout_seed() if self.rate > 0 else None
+        if seed is None:
+            return super(SeededSpatialDropout2D, self).call(inputs, training=training)
+
+        if training is None:
+            training = K.learning_phase()
+
+        noise_shape = self._get_noise_shape(inputs)
+        return tf_utils.smart_cond( training, 
+                    lambda: stateless_dropout(inputs, self.rate, seed, noise_shape=noise_shape),
+                    lambda: tf.identity(inputs) )
+
+@functools.lru_cache(maxsize=None)
+def _relative_positions_matrix( length_q, length_k, max_relative_position ):
+    """ Generates a numpy array of size [length_q, length_k], holding the index of the 
+            relative positional embedding of each query and key position.
+            The lengths and max_relative_position must be python integers. Results are memoised, so they must not be modified
+
+        Refer to Self-Attention with Relative Position Representations
+            Peter Shaw, Jakob Uszkoreit, Ashish Vaswani
+    """
+    range_vec_k = np.arange(length_k)
+    range_vec_q = range_vec_k[-length_q:]
+
+    distance_mat = range_vec_k[None, :] - range_vec_q[:, None]
+    distance_mat_clipped = np.clip( distance_mat, -max_relative_position, max_relative_position )
+
+    # Shift values to be >= 0. Each integer still uniquely identifies a relative
+    # position difference.
+    return ( distance_mat_clipped + max_relative_position ).astype(np.int32)
+
 def _generate_relative_positions_embeddings( length_q, length_k,
                                         max_relative_position, embeddings_table, dtype):
     """ Generates tensor of size [length_q, length_k, depth],
@@ -320,19 +421,7 @@ def _generate_relative_positions_embeddings( length_q, length_k,
         Refer to Self-Attention with Relative Position Representations
             Peter Shaw, Jakob Uszkoreit, Ashish Vaswani
     """
-    if length_q == length_k:
-        range_vec_q = range_vec_k = tf.range(length_q)
-    else:
-        range_vec_k = tf.range(length_k)
-        range_vec_q = range_vec_k[-length_q:]
-    
-    distance_mat = range_vec_k[None, :] - range_vec_q[:, None]
-    distance_mat_clipped = tf.clip_by_value( distance_mat, -max_relative_position,
-                                                max_relative_position )
-    
-    # Shift values to be >= 0. Each integer still uniquely identifies a relative
-    # position difference.
-    relative_positions_matrix = distance_mat_clipped + max_relative_position
+    relative_positions_matrix = _relative_positions_matrix( length_q, length_k, int(max_relative_position) )
     
     embeddings = tf.gather(embeddings_table, relative_positions_matrix)
 
@@ -496,8 +585,51 @@ def dropout_with_broadcast_dims(x, keep_prob, broadcast_dims=None, **kwargs):
         kwargs["noise_shape"] = [
             1 if i in broadcast_dims else shape[i] for i in range(ndims)
         ]
+    seed = next_dropout_seed()
+    if seed is not None:
+        # As for tf.nn.dropout below, the second argument is the rate at which elements are dropped
+        return stateless_dropout(x, keep_prob, seed, noise_shape=kwargs.get("noise_shape", None))
     return tf.nn.dropout(x, keep_prob, **kwargs)
 
+# The seed and the number of masks sampled so far within seeded_dropout_scope, for each thread
+_dropout_seed_state = threading.local()
+
+@contextlib.contextmanager
+def seeded_dropout_scope(seed):
+    """Within this scope, the dropout masks of the ConvGRU cells and of MultiHead2DAttention_v2 are sampled 
+        with stateless random ops. The seed of each mask is derived from seed and from the number of masks sampled 
+        before it in the scope. Running the same function twice, each time within a scope with the same seed, 
+        therefore applies the same masks, e.g. when its activations are recomputed by tf.recompute_grad.
+
+        Args:
+            seed (tensor): int32 tensor of shape [2]
+    """
+    prev_state = ( getattr(_dropout_seed_state, 'seed', None), getattr(_dropout_seed_state, 'count', 0) )
+    _dropout_seed_state.seed, _dropout_seed_state.count = seed, 0
+    try:
+        yield
+    finally:
+        _dropout_seed_state.seed, _dropout_seed_state.count = prev_state
+
+def in_seeded_dropout_scope():
+    """Returns whether dropout masks are sampled within seeded_dropout_scope"""
+    return getattr(_dropout_seed_state, 'seed', None) is not None
+
+def next_dropout_seed():
+    """Returns the seed of the next dropout mask sampled within seeded_dropout_scope, or None outside of the scope"""
+    if not in_seeded_dropout_scope():
+        return None
+    seed = _dropout_seed_state.seed
+
+    _dropout_seed_state.count += 1
+    return seed + tf.constant( [0, _dropout_seed_state.count], dtype=seed.dtype )
+
+def stateless_dropout(x, rate, seed, noise_shape=None):
+    """Like tf.nn.dropout, but the mask is sampled with tf.random.stateless_uniform, seeded by seed"""
+    noise_shape = tf.shape(x) if noise_shape is None else noise_shape
+    keep_mask = tf.random.stateless_uniform( noise_shape, seed=seed, dtype=tf.float32 ) >= rate
+    return x * tf.cast(keep_mask, x.dtype) / tf.cast(1.0 - rate, x.dtype)
+
 def combine_last_two_dimensions(x):
     """Reshape x so that the last two dimension become one.
     Args:
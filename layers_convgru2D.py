@@ -20,8 +20,8 @@ from tensorflow.python.ops import array_ops
 from tensorflow.python.util import nest
 from tensorflow.python.util.tf_export import keras_export
 
-from tensorflow.keras.layers import Conv2D, RNN
-from layers_attn import MultiHead2DAttention_v2, _generate_relative_positions_embeddings, _relative_attention_inner, attn_shape_adjust
+from tensorflow.keras.layers import Bidirectional, Conv2D, RNN
+from layers_attn import MultiHead2DAttention_v2, _generate_relative_positions_embeddings, _relative_attention_inner, attn_shape_adjust, in_seeded_dropout_scope, next_dropout_seed, stateless_dropout
 
 
 class ConvRNN2D(RNN):
@@ -53,6 +53,10 @@ class ConvRNN2D(RNN):
       stateful: Boolean (default False). If True, the last state
         for each sample at index i in a batch will be used as initial
         state for the sample of index i in the following batch.
+      hoist_input_conv: Boolean (default False). If True, the input
+        convolutions of the whole sequence are computed before the time loop,
+        as one convolution over the samples and timesteps. The cell must
+        implement `sequence_input_conv` and accept `hoisted_inputs` in `call`.
       input_shape: Use this argument to specify the shape of the
         input when this layer is the first one in a model.
 
@@ -150,6 +154,7 @@ class ConvRNN2D(RNN):
                go_backwards=False,
                stateful=False,
                unroll=False,
+               hoist_input_conv=False,
                **kwargs):
     if unroll:
       raise TypeError('Unrolling isn\'t possible with '
@@ -169,6 +174,11 @@ class ConvRNN2D(RNN):
     self.states = None
     self._num_constants = None
 
+    if hoist_input_conv and not hasattr(cell, 'sequence_input_conv'):
+      raise ValueError('The input convolutions of ' + cell.__class__.__name__ +
+                       ' cannot be hoisted out of the time loop.')
+    self.hoist_input_conv = hoist_input_conv
+
   @tf_utils.shape_type_conversion
   def compute_output_shape(self, input_shape):
     if isinstance(input_shape, list):
@@ -279,6 +289,11 @@ class ConvRNN2D(RNN):
     else:
       return [initial_state]
 
+  def step_inputs(self, inputs):
+    """Returns the sequence of cell inputs the layer steps through, for the
+    layer's inputs."""
+    return inputs
+
   def __call__(self, inputs, initial_state=None, constants=None, **kwargs):
     inputs, initial_state, constants = _standardize_args(
         inputs, initial_state, constants, self._num_constants)
@@ -360,6 +375,12 @@ class ConvRNN2D(RNN):
     if generic_utils.has_arg(self.cell.call, 'training'):
       kwargs['training'] = training
 
+    if self.hoist_input_conv:
+      # The input convolutions of all timesteps are run as one convolution,
+      # leaving only the recurrent convolutions in the time loop.
+      inputs = self.cell.sequence_input_conv(inputs, training=training)
+      kwargs['hoisted_inputs'] = True
+
     if constants:
       if not generic_utils.has_arg(self.cell.call, 'constants'):
         raise ValueError('RNN cell does not support constants')
@@ -543,6 +564,9 @@ class ConvGRU2D(ConvRNN2D):
             recurrent_dropout: Float between 0 and 1.
             Fraction of the units to drop for
             the linear transformation of the recurrent state.
+            hoist_input_conv: Boolean (default False).
+            If True, the input convolutions of all timesteps are computed
+            as one convolution before the time loop.
 
         Call arguments:
             inputs: A 5D tensor.
@@ -778,7 +802,8 @@ class ConvGRU2D(ConvRNN2D):
                 'dropout': self.dropout,
                 'recurrent_dropout': self.recurrent_dropout,
                 'layer_norm':self.layer_norm,
-                'implementation':self.implementation }
+                'implementation':self.implementation,
+                'hoist_input_conv':self.hoist_input_conv }
 
         base_config = super(ConvGRU2D, self).get_config()
         del base_config['cell']
@@ -809,7 +834,31 @@ class ConvGRU2D(ConvRNN2D):
         else:
             return [initial_hidden_state]
 
-class ConvGRU2DCell(DropoutRNNCellMixin, Layer):
+class SeededDropoutRNNCellMixin(DropoutRNNCellMixin):
+    """DropoutRNNCellMixin whose input and recurrent dropout masks are sampled with stateless random ops 
+        within layers_attn.seeded_dropout_scope, so that recomputing a cell's activations reapplies the same masks
+    """
+
+    def get_dropout_mask_for_cell(self, inputs, training, count=1):
+        if self.dropout == 0 or not in_seeded_dropout_scope():
+            return super(SeededDropoutRNNCellMixin, self).get_dropout_mask_for_cell(inputs, training, count)
+        return self.seeded_dropout_mask(inputs, self.dropout, training, count)
+
+    def get_recurrent_dropout_mask_for_cell(self, inputs, training, count=1):
+        if self.recurrent_dropout == 0 or not in_seeded_dropout_scope():
+            return super(SeededDropoutRNNCellMixin, self).get_recurrent_dropout_mask_for_cell(inputs, training, count)
+        return self.seeded_dropout_mask(inputs, self.recurrent_dropout, training, count)
+
+    def seeded_dropout_mask(self, inputs, rate, training, count):
+        """Returns count dropout masks shaped like inputs, each sampled with the next seed of layers_attn.seeded_dropout_scope.
+            As with the masks of DropoutRNNCellMixin, a list is returned if count > 1
+        """
+        ones = array_ops.ones_like(inputs)
+        masks = [ K.in_train_phase( lambda seed=next_dropout_seed(): stateless_dropout(ones, rate, seed), ones, training=training )
+                    for _ in range(count) ]
+        return masks if count > 1 else masks[0]
+
+class ConvGRU2DCell(SeededDropoutRNNCellMixin, Layer):
     """Cell class for the ConvGRU2D layer.
 
         Arguments:
@@ -982,10 +1031,11 @@ class ConvGRU2DCell(DropoutRNNCellMixin, Layer):
         self.built = True
 
     #@tf.function
-    def call(self, inputs, states, training=None):
+    def call(self, inputs, states, training=None, hoisted_inputs=False):
         h_tm1 = tf.cast(states[0],dtype=inputs.dtype) # previous memory state
-            # dropout matrices for input units
-        dp_mask = self.get_dropout_mask_for_cell(inputs, training, count=3)
+        channel_axis = 1 if self.data_format == 'channels_first' else -1
+            # dropout matrices for input units, which were already applied to hoisted inputs
+        dp_mask = None if hoisted_inputs else self.get_dropout_mask_for_cell(inputs, training, count=3)
             # dropout matrices for recurrent units
         rec_dp_mask = self.get_recurrent_dropout_mask_for_cell(
             h_tm1, training, count=3)
@@ -1004,20 +1054,23 @@ class ConvGRU2DCell(DropoutRNNCellMixin, Layer):
 
         if self.implementation==1:
 
-            if 0 < self.dropout < 1.:
-                inputs_z = inputs * dp_mask[0]
-                inputs_r = inputs * dp_mask[1]
-                inputs_h = inputs * dp_mask[2]
+            if hoisted_inputs:
+                x_z, x_r, x_h = array_ops.split(inputs, 3, axis=channel_axis)
             else:
-                inputs_z = inputs
-                inputs_r = inputs
-                inputs_h = inputs
-
-            (kernel_z, kernel_r, kernel_h) = array_ops.split(self.kernel, 3, axis=3)
-
-            x_z = self.input_conv(inputs_z, kernel_z, bias_z, padding=self.padding)
-            x_r = self.input_conv(inputs_r, kernel_r, bias_r, padding=self.padding)
-            x_h = self.input_conv(inputs_h, kernel_h, bias_h, padding=self.padding)
+                if 0 < self.dropout < 1.:
+                    inputs_z = inputs * dp_mask[0]
+                    inputs_r = inputs * dp_mask[1]
+                    inputs_h = inputs * dp_mask[2]
+                else:
+                    inputs_z = inputs
+                    inputs_r = inputs
+                    inputs_h = inputs
+
+                (kernel_z, kernel_r, kernel_h) = array_ops.split(self.kernel, 3, axis=3)
+
+                x_z = self.input_conv(inputs_z, kernel_z, bias_z, padding=self.padding)
+                x_r = self.input_conv(inputs_r, kernel_r, bias_r, padding=self.padding)
+                x_h = self.input_conv(inputs_h, kernel_h, bias_h, padding=self.padding)
                         
             if 0 < self.recurrent_dropout < 1.:
                 h_tm1_z = h_tm1 * rec_dp_mask[0]
@@ -1053,8 +1106,47 @@ class ConvGRU2DCell(DropoutRNNCellMixin, Layer):
             
             hh = self.activation( x_h + recurrent_h ) #two state structure will have to be added here for cell_custom
 
-        elif self.implementation ==2 :
-            raise NotImplementedError
+        elif self.implementation == 2:
+            # Fused gates: one input conv and one recurrent conv with the full kernels, whose outputs are split into the z, r and h gates
+                # The gates share the first input dropout mask and the first recurrent dropout mask
+            bias, bias_rcrnt = self.split_bias()
+
+            if hoisted_inputs:
+                x_z, x_r, x_h = array_ops.split(inputs, 3, axis=channel_axis)
+            else:
+                # Applying input dropout
+                if 0 < self.dropout < 1.:
+                    inputs = inputs * dp_mask[0]
+
+                # Calculating input part of gates and hidden states
+                x_z, x_r, x_h = array_ops.split( self.input_conv(inputs, self.kernel, bias, padding=self.padding), 3, axis=channel_axis )
+
+            # Applying recurrent dropout
+            if 0 < self.recurrent_dropout < 1.:
+                h_tm1_dp = h_tm1 * rec_dp_mask[0]
+            else:
+                h_tm1_dp = h_tm1
+
+            if self.reset_after:
+                recurrent = self.recurrent_conv(h_tm1_dp, self.recurrent_kernel)
+                if self.use_bias:
+                    recurrent = K.bias_add( recurrent, bias_rcrnt, data_format=self.data_format )
+                recurrent_z, recurrent_r, recurrent_h = array_ops.split( recurrent, 3, axis=channel_axis )
+
+                z = self.recurrent_activation(x_z + recurrent_z)
+                r = self.recurrent_activation(x_r + recurrent_r)
+                recurrent_h = r * recurrent_h
+
+            else:
+                # The recurrent part of the hidden state depends on r, so only the z and r convs are fused
+                recurrent_kernel_zr, recurrent_kernel_h = array_ops.split(self.recurrent_kernel, [2*self.filters, self.filters], axis=3)
+                recurrent_z, recurrent_r = array_ops.split( self.recurrent_conv(h_tm1_dp, recurrent_kernel_zr), 2, axis=channel_axis )
+
+                z = self.recurrent_activation(x_z + recurrent_z)
+                r = self.recurrent_activation(x_r + recurrent_r)
+                recurrent_h = self.recurrent_conv( r*h_tm1_dp, recurrent_kernel_h )
+
+            hh = self.activation( x_h + recurrent_h )
         
         if self.bool_ln:
             hh = tf.cast( self.layer_norm(hh), self._compute_dtype)
@@ -1074,6 +1166,41 @@ class ConvGRU2DCell(DropoutRNNCellMixin, Layer):
                                 data_format=self.data_format)
         return conv_out
 
+    def split_bias(self):
+        """Returns the bias of the input convolutions and the bias of the recurrent convolutions, which is None unless reset_after"""
+        if self.use_bias and self.reset_after:
+            return array_ops.split(self.bias, 2)
+        return self.bias, None
+
+    def sequence_input_conv(self, inputs, training=None):
+        """Calculates the input part of the gates and hidden states for all timesteps, as one convolution over the samples and timesteps
+
+            Args:
+                inputs: A 5D tensor (samples, timesteps, ...)
+                training: Python boolean indicating whether the layer should behave in training mode or in inference mode
+
+            Returns:
+                A 5D tensor holding the input parts of the z, r and h gates, concatenated along the channel axis.
+                    Each timestep is passed to call with hoisted_inputs=True
+        """
+        channel_axis = 1 if self.data_format == 'channels_first' else -1
+        timesteps = K.int_shape(inputs)[1] or tf.shape(inputs)[1]
+        dp_mask = self.get_dropout_mask_for_cell(inputs[:, 0], training, count=3)
+        bias, _ = self.split_bias()
+
+        if 0 < self.dropout < 1. and self.implementation == 1:
+            # Each gate has its own input dropout mask
+            x = tf.concat( [ self.input_conv( merge_time_axis( inputs*tf.expand_dims(mask, 1) ), kernel, padding=self.padding )
+                                for mask, kernel in zip( dp_mask, array_ops.split(self.kernel, 3, axis=3) ) ], axis=channel_axis )
+            if bias is not None:
+                x = K.bias_add(x, bias, data_format=self.data_format)
+        else:
+            if 0 < self.dropout < 1.:
+                inputs = inputs * tf.expand_dims(dp_mask[0], 1)
+            x = self.input_conv( merge_time_axis(inputs), self.kernel, bias, padding=self.padding )
+
+        return split_time_axis(x, timesteps)
+
     def recurrent_conv(self, x, w):
         conv_out = K.conv2d(x, w, strides=(1, 1),
                             padding='same',
@@ -1186,6 +1313,9 @@ class ConvGRU2D_Dualcell(ConvRNN2D):
             recurrent_dropout: Float between 0 and 1.
                 Fraction of the units to drop for
                 the linear transformation of the recurrent state.
+            hoist_input_conv: Boolean (default False).
+                If True, the input convolutions of all timesteps are computed
+                as one convolution before the time loop.
         Call arguments:
             inputs: A 5D tensor.
             mask: Binary tensor of shape `(samples, timesteps)` indicating whether
@@ -1425,7 +1555,8 @@ class ConvGRU2D_Dualcell(ConvRNN2D):
                   'dropout': self.dropout,
                   'recurrent_dropout': self.recurrent_dropout,
                   'implementation':self.implementation,
-                  'layer_norm':self.layer_norm}
+                  'layer_norm':self.layer_norm,
+                  'hoist_input_conv':self.hoist_input_conv}
         base_config = super(ConvGRU2D_Dualcell, self).get_config()
         del base_config['cell']
         return dict(list(base_config.items()) + list(config.items()))
@@ -1454,7 +1585,7 @@ class ConvGRU2D_Dualcell(ConvRNN2D):
         else:
             return [initial_hidden_state]
 
-class ConvGRU2DCell_Dualcell(DropoutRNNCellMixin, Layer):
+class ConvGRU2DCell_Dualcell(SeededDropoutRNNCellMixin, Layer):
     """
         Cell class for the ConvGRU2D layer.
         Arguments:
@@ -1620,7 +1751,7 @@ class ConvGRU2DCell_Dualcell(DropoutRNNCellMixin, Layer):
             self.bias = None
         self.built = True
 
-    def call(self, inputs, states, training=None):
+    def call(self, inputs, states, training=None, hoisted_inputs=False):
         """Link To Paper: Dual State ConvGRU
             Note: self.reset_after==False methodology is explained in paper
 
@@ -1630,10 +1761,12 @@ class ConvGRU2DCell_Dualcell(DropoutRNNCellMixin, Layer):
 
         # previous hidden state state
         h_tm1 = tf.cast( states[0], dtype=inputs.dtype) 
+        channel_axis = 1 if self.data_format == 'channels_first' else -1
         
-        #dropout masks
-        dp_mask1 = self.get_dropout_mask_for_cell(inputs1, training, count=3)
-        dp_mask2 = self.get_dropout_mask_for_cell(inputs2, training, count=3)
+        #dropout masks, which were already applied to hoisted inputs
+        if not hoisted_inputs:
+            dp_mask1 = self.get_dropout_mask_for_cell(inputs1, training, count=3)
+            dp_mask2 = self.get_dropout_mask_for_cell(inputs2, training, count=3)
         rec_dp_mask = self.get_recurrent_dropout_mask_for_cell(h_tm1, training, count=3)
 
         # retreive bias units
@@ -1644,7 +1777,7 @@ class ConvGRU2DCell_Dualcell(DropoutRNNCellMixin, Layer):
                 bias_z_rcrnt, bias_r_rcrnt, bias_h_rcrnt = None, None, None
 
             elif self.reset_after:
-                bias_z1, bias_z2, bias_r1, bias_r2, bias_h1, bias_h2, bias_z_rcrnt, bias_r_rcrnt, bias_h_rcrnt = array_ops.split(self.bias, 3*2)
+                bias_z1, bias_z2, bias_r1, bias_r2, bias_h1, bias_h2, bias_z_rcrnt, bias_r_rcrnt, bias_h_rcrnt = array_ops.split(self.bias, 3*3)
 
         else:
             bias_z1, bias_z2, bias_r1, bias_r2, bias_h1, bias_h2 = None, None, None, None, None, None
@@ -1652,37 +1785,41 @@ class ConvGRU2DCell_Dualcell(DropoutRNNCellMixin, Layer):
 
         
         if self.implementation == 1:
-            # Applying dropout masks
-            if 0 < self.dropout < 1. and training:
-                inputs_z1 = inputs1 * dp_mask1[0]
-                inputs_r1 = inputs1 * dp_mask1[1]
-                inputs_h1 = inputs1 * dp_mask1[2]
-
-                inputs_z2 = inputs2 * dp_mask2[0]
-                inputs_r2 = inputs2 * dp_mask2[1]
-                inputs_h2 = inputs2 * dp_mask2[2]
-
+            if hoisted_inputs:
+                inp_z1, inp_r1, inp_h1 = array_ops.split(inputs1, 3, axis=channel_axis)
+                inp_z2, inp_r2, inp_h2 = array_ops.split(inputs2, 3, axis=channel_axis)
             else:
-                inputs_z1 = inputs1 
-                inputs_r1 = inputs1 
-                inputs_h1 = inputs1 
-
-                inputs_z2 = inputs2 
-                inputs_r2 = inputs2 
-                inputs_h2 = inputs2 
-
-            # Retreiving input kernels/weight matrices
-            (kernel_z1, kernel_z2, 
-            kernel_r1, kernel_r2,
-            kernel_h1, kernel_h2) = array_ops.split(self.kernel, 6, axis=3)
-
-            # Calculating input part of gates
-            inp_z1 = self.input_conv(inputs_z1, kernel_z1, bias_z1, padding=self.padding)
-            inp_z2 = self.input_conv(inputs_z2, kernel_z2, bias_z2, padding=self.padding)
-            inp_r1 = self.input_conv(inputs_r1, kernel_r1, bias_r1, padding=self.padding)
-            inp_r2 = self.input_conv(inputs_r2, kernel_r2, bias_r2, padding=self.padding)
-            inp_h1 = self.input_conv(inputs_h1, kernel_h1, bias_h1, padding=self.padding)
-            inp_h2 = self.input_conv(inputs_h2, kernel_h2, bias_h2, padding=self.padding)
+                # Applying dropout masks
+                if 0 < self.dropout < 1. and training:
+                    inputs_z1 = inputs1 * dp_mask1[0]
+                    inputs_r1 = inputs1 * dp_mask1[1]
+                    inputs_h1 = inputs1 * dp_mask1[2]
+
+                    inputs_z2 = inputs2 * dp_mask2[0]
+                    inputs_r2 = inputs2 * dp_mask2[1]
+                    inputs_h2 = inputs2 * dp_mask2[2]
+
+                else:
+                    inputs_z1 = inputs1 
+                    inputs_r1 = inputs1 
+                    inputs_h1 = inputs1 
+
+                    inputs_z2 = inputs2 
+                    inputs_r2 = inputs2 
+                    inputs_h2 = inputs2 
+
+                # Retreiving input kernels/weight matrices
+                (kernel_z1, kernel_z2, 
+                kernel_r1, kernel_r2,
+                kernel_h1, kernel_h2) = array_ops.split(self.kernel, 6, axis=3)
+
+                # Calculating input part of gates
+                inp_z1 = self.input_conv(inputs_z1, kernel_z1, bias_z1, padding=self.padding)
+                inp_z2 = self.input_conv(inputs_z2, kernel_z2, bias_z2, padding=self.padding)
+                inp_r1 = self.input_conv(inputs_r1, kernel_r1, bias_r1, padding=self.padding)
+                inp_r2 = self.input_conv(inputs_r2, kernel_r2, bias_r2, padding=self.padding)
+                inp_h1 = self.input_conv(inputs_h1, kernel_h1, bias_h1, padding=self.padding)
+                inp_h2 = self.input_conv(inputs_h2, kernel_h2, bias_h2, padding=self.padding)
 
             # Applying recurrent dropout mask
             if 0 < self.recurrent_dropout < 1. and training:
@@ -1729,8 +1866,56 @@ class ConvGRU2DCell_Dualcell(DropoutRNNCellMixin, Layer):
             hh1 = self.activation( inp_h1 + recurrent_h1 ) #two state structure will have to be added here for cell_custom
             hh2 = self.activation( inp_h2 + recurrent_h2 )
 
-        elif self.implementation ==2 :
-            raise NotImplementedError
+        elif self.implementation == 2:
+            # Fused gates: one input conv per input and one recurrent conv for the z and r gates, whose outputs are split into the gates
+                # The gates of each input share its first dropout mask, and the gates share the first recurrent dropout mask
+            kernel1, kernel2, bias1, bias2, bias_rcrnt = self.stream_kernels()
+
+            if not hoisted_inputs:
+                # Applying dropout masks
+                if 0 < self.dropout < 1. and training:
+                    inputs1 = inputs1 * dp_mask1[0]
+                    inputs2 = inputs2 * dp_mask2[0]
+
+                # Calculating input part of gates
+                inputs1 = self.input_conv(inputs1, kernel1, bias1, padding=self.padding)
+                inputs2 = self.input_conv(inputs2, kernel2, bias2, padding=self.padding)
+
+            inp_z1, inp_r1, inp_h1 = array_ops.split( inputs1, 3, axis=channel_axis )
+            inp_z2, inp_r2, inp_h2 = array_ops.split( inputs2, 3, axis=channel_axis )
+
+            # Applying recurrent dropout mask
+            if 0 < self.recurrent_dropout < 1. and training:
+                h_tm1_dp = h_tm1 * rec_dp_mask[0]
+            else:
+                h_tm1_dp = h_tm1
+
+            if self.reset_after:
+                recurrent = self.recurrent_conv(h_tm1_dp, self.recurrent_kernel)
+                if self.use_bias:
+                    recurrent = K.bias_add( recurrent, bias_rcrnt, data_format=self.data_format )
+                recurrent_z, recurrent_r, recurrent_h = array_ops.split( recurrent, 3, axis=channel_axis )
+
+            else:
+                recurrent_kernel_zr, recurrent_kernel_h = array_ops.split(self.recurrent_kernel, [2*self.filters, self.filters], axis=3)
+                recurrent_z, recurrent_r = array_ops.split( self.recurrent_conv(h_tm1_dp, recurrent_kernel_zr), 2, axis=channel_axis )
+
+            #calculating gates z, r 
+            z1 = self.recurrent_activation(inp_z1 + recurrent_z)
+            z2 = self.recurrent_activation(inp_z2 + recurrent_z)
+            r1 = self.recurrent_activation(inp_r1 + recurrent_r)
+            r2 = self.recurrent_activation(inp_r2 + recurrent_r)
+
+            # calculating gate \tilde{h}
+            if self.reset_after:
+                recurrent_h1 = r1 * recurrent_h 
+                recurrent_h2 = r2 * recurrent_h
+            else:
+                # The recurrent parts for both reset gates are calculated in one conv, stacked along the batch axis
+                recurrent_h1, recurrent_h2 = tf.split( self.recurrent_conv( tf.concat( [r1*h_tm1_dp, r2*h_tm1_dp], axis=0 ), recurrent_kernel_h ), 2, axis=0 )
+
+            hh1 = self.activation( inp_h1 + recurrent_h1 )
+            hh2 = self.activation( inp_h2 + recurrent_h2 )
             
         h = ((z1+z2)/2)*h_tm1 + (1-z1)*hh1 + (1-z2)*hh2
         
@@ -1746,6 +1931,61 @@ class ConvGRU2DCell_Dualcell(DropoutRNNCellMixin, Layer):
                                 data_format=self.data_format)
         return conv_out
 
+    def stream_kernels(self):
+        """Gathers the z, r and h input kernels and biases of each input, whose output channels are ordered z1, z2, r1, r2, h1, h2
+
+            Returns:
+                tuple: input kernel and bias of inputs1, input kernel and bias of inputs2, bias of the recurrent convolutions.
+                    The biases are None without use_bias, and the recurrent bias is None unless reset_after
+        """
+        kernel1, kernel2 = [ tf.reshape( kernel, self.kernel_size + (-1, self.filters*3) ) 
+                                for kernel in tf.unstack( tf.reshape(self.kernel, self.kernel_size + (-1, 3, 2, self.filters) ), axis=4 ) ]
+        if self.use_bias:
+            if self.reset_after:
+                bias, bias_rcrnt = array_ops.split(self.bias, [self.filters*3*2, self.filters*3])
+            else:
+                bias, bias_rcrnt = self.bias, None
+            bias1, bias2 = [ tf.reshape(b, [-1]) for b in tf.unstack( tf.reshape(bias, (3, 2, self.filters) ), axis=1 ) ]
+        else:
+            bias1, bias2, bias_rcrnt = None, None, None
+
+        return kernel1, kernel2, bias1, bias2, bias_rcrnt
+
+    def sequence_input_conv(self, inputs, training=None):
+        """Calculates the input part of the gates and hidden states of both inputs for all timesteps,
+            as one convolution per input over the samples and timesteps
+
+            Args:
+                inputs: A 5D tensor (samples, timesteps, ...), holding inputs1 and inputs2 concatenated along the last axis
+                training: Python boolean indicating whether the layer should behave in training mode or in inference mode
+
+            Returns:
+                A 5D tensor holding the input parts of the z, r and h gates of inputs1, then of inputs2, concatenated along the last axis.
+                    Each timestep is passed to call with hoisted_inputs=True
+        """
+        channel_axis = 1 if self.data_format == 'channels_first' else -1
+        timesteps = K.int_shape(inputs)[1] or tf.shape(inputs)[1]
+        inputs1, inputs2 = tf.split( inputs, 2, axis=-1)
+        dp_mask1 = self.get_dropout_mask_for_cell(inputs1[:, 0], training, count=3)
+        dp_mask2 = self.get_dropout_mask_for_cell(inputs2[:, 0], training, count=3)
+        kernel1, kernel2, bias1, bias2, _ = self.stream_kernels()
+
+        li_x = []
+        for _inputs, dp_mask, kernel, bias in zip( [inputs1, inputs2], [dp_mask1, dp_mask2], [kernel1, kernel2], [bias1, bias2] ):
+            if 0 < self.dropout < 1. and training and self.implementation == 1:
+                # Each gate has its own input dropout mask
+                x = tf.concat( [ self.input_conv( merge_time_axis( _inputs*tf.expand_dims(mask, 1) ), _kernel, padding=self.padding )
+                                    for mask, _kernel in zip( dp_mask, array_ops.split(kernel, 3, axis=3) ) ], axis=channel_axis )
+                if bias is not None:
+                    x = K.bias_add(x, bias, data_format=self.data_format)
+            else:
+                if 0 < self.dropout < 1. and training:
+                    _inputs = _inputs * tf.expand_dims(dp_mask[0], 1)
+                x = self.input_conv( merge_time_axis(_inputs), kernel, bias, padding=self.padding )
+            li_x.append( x )
+
+        return split_time_axis( tf.concat(li_x, axis=-1), timesteps )
+
     def recurrent_conv(self, x, w):
         conv_out = K.conv2d(x, w, strides=(1, 1),
                             padding='same',
@@ -1985,7 +2225,7 @@ class ConvGRU2D_attn(ConvRNN2D):
     def call(self, inputs, mask=None, training=None, initial_state=None):
         self._maybe_reset_cell_dropout_mask(self.cell)
         
-        inputs = attn_shape_adjust(inputs, self.attn_factor_reduc, reverse=False)
+        inputs = self.step_inputs(inputs)
 
         if initial_state is not None:
             pass
@@ -2130,6 +2370,10 @@ class ConvGRU2D_attn(ConvRNN2D):
         return cls(**config)
     # endregion 
 
+    def step_inputs(self, inputs):
+        """Groups the timesteps of inputs into chunks of attn_factor_reduc timesteps, each chunk being attended to by one step"""
+        return attn_shape_adjust(inputs, self.attn_factor_reduc, reverse=False)
+
     def get_initial_state(self, inputs):
         """inputs (samples, expanded_timesteps, rows, cols, filters)"""
         
@@ -2156,7 +2400,7 @@ class ConvGRU2D_attn(ConvRNN2D):
         else:
             return [initial_hidden_state]
         
-class ConvGRU2DCell_attn(DropoutRNNCellMixin, Layer):
+class ConvGRU2DCell_attn(SeededDropoutRNNCellMixin, Layer):
     """
         Cell class for the ConvGRU2D layer.
         Arguments:
@@ -2470,8 +2714,49 @@ class ConvGRU2DCell_attn(DropoutRNNCellMixin, Layer):
             
             hh = self.activation( x_h + recurrent_h )
 
-        elif self.implementation ==2:
-            raise NotImplementedError
+        elif self.implementation == 2:
+            # Fused gates: one input conv and one recurrent conv with the full kernels, whose outputs are split into the z, r and h gates
+                # The gates share the first input dropout mask and the first recurrent dropout mask
+            channel_axis = 1 if self.data_format == 'channels_first' else -1
+
+            if self.use_bias and self.reset_after:
+                bias, bias_rcrnt = array_ops.split(self.bias, 2)
+            else:
+                bias, bias_rcrnt = self.bias, None
+
+            # Applying input dropout
+            if 0 < self.dropout < 1.:
+                inputs = inputs * dp_mask[0]
+
+            # Calculating input part of gates and hidden states
+            x_z, x_r, x_h = array_ops.split( self.input_conv(inputs, self.kernel, bias, padding=self.padding), 3, axis=channel_axis )
+
+            # Applying recurrent dropout
+            if 0 < self.recurrent_dropout < 1.:
+                h_tm1_dp = h_tm1 * rec_dp_mask[0]
+            else:
+                h_tm1_dp = h_tm1
+
+            if self.reset_after:
+                recurrent = self.recurrent_conv(h_tm1_dp, self.recurrent_kernel)
+                if self.use_bias:
+                    recurrent = K.bias_add( recurrent, bias_rcrnt, data_format=self.data_format )
+                recurrent_z, recurrent_r, recurrent_h = array_ops.split( recurrent, 3, axis=channel_axis )
+
+                z = self.recurrent_activation(x_z + recurrent_z)
+                r = self.recurrent_activation(x_r + recurrent_r)
+                recurrent_h = r * recurrent_h
+
+            else:
+                # The recurrent part of the hidden state depends on r, so only the z and r convs are fused
+                recurrent_kernel_zr, recurrent_kernel_h = array_ops.split(self.recurrent_kernel, [2*self.filters, self.filters], axis=3)
+                recurrent_z, recurrent_r = array_ops.split( self.recurrent_conv(h_tm1_dp, recurrent_kernel_zr), 2, axis=channel_axis )
+
+                z = self.recurrent_activation(x_z + recurrent_z)
+                r = self.recurrent_activation(x_r + recurrent_r)
+                recurrent_h = self.recurrent_conv( r*h_tm1_dp, recurrent_kernel_h )
+
+            hh = self.activation( x_h + recurrent_h )
         
         if self.bool_ln:
             hh = tf.cast(self.layer_norm(hh),self._compute_dtype)
@@ -2541,3 +2826,101 @@ class ConvGRU2DCell_attn(DropoutRNNCellMixin, Layer):
 
 #endregion
 
+
+# region --- Fused Bidirectional wrapper
+class FusedBidirectional(Bidirectional):
+    """Bidirectional wrapper for ConvRNN2D layers, which steps the forward and backward layers in one time loop
+
+        The cell inputs and states of both directions are concatenated along the channel axis, the backward inputs being reversed in time.
+            Each step calls the forward and backward cells on their parts, so the number of sequential steps is halved and the
+            independent convolutions of both directions can run concurrently.
+        The forward and backward layers keep their own weights, so checkpoints are interchangeable with Bidirectional.
+        Calls with a mask, initial states or constants, and stateful layers or layers returning their state, are run by Bidirectional.
+
+        Example of how to use:
+        convGRU = FusedBidirectional( layer=ConvGRU2D(**params), backward_layer=ConvGRU2D(**copy.deepcopy(params), go_backwards=True), merge_mode=None )
+        hidden_states_f, hidden_states_b = convGRU( inputs, training=training )
+    """
+
+    def call(self, inputs, training=None, mask=None, initial_state=None, constants=None):
+        if ( mask is not None or initial_state is not None or constants is not None
+                or self.stateful or self.return_state ):
+            return super(FusedBidirectional, self).call(inputs, training=training, mask=mask,
+                        initial_state=initial_state, constants=constants)
+
+        layers = [ self.forward_layer, self.backward_layer ]
+        cells = [ layer.cell for layer in layers ]
+        if cells[0].data_format == 'channels_first':
+            channel_axis, seq_channel_axis = 1, 2
+        else:
+            channel_axis, seq_channel_axis = -1, -1
+
+        li_inputs, li_initial_state, li_kwargs = [], [], []
+        for layer in layers:
+            layer._maybe_reset_cell_dropout_mask(layer.cell)
+            _inputs = layer.step_inputs(inputs)
+            li_initial_state.append( layer.get_initial_state(_inputs)[0] )
+
+            kwargs = { 'training':training }
+            if layer.hoist_input_conv:
+                _inputs = layer.cell.sequence_input_conv(_inputs, training=training)
+                kwargs['hoisted_inputs'] = True
+            li_inputs.append( _inputs )
+            li_kwargs.append( kwargs )
+
+        # The backward layer steps through its inputs in reverse
+        li_inputs[1] = K.reverse( li_inputs[1], 1 )
+
+        input_channels = [ K.int_shape(_inputs)[seq_channel_axis] for _inputs in li_inputs ]
+        state_channels = [ cell.filters for cell in cells ]
+
+        def step(inputs, states):
+            li_step_inputs = tf.split( inputs, input_channels, axis=channel_axis )
+            li_states = tf.split( states[0], state_channels, axis=channel_axis )
+
+            h = tf.concat( [ cell.call(_inputs, [state], **kwargs)[0]
+                                for cell, _inputs, state, kwargs in zip(cells, li_step_inputs, li_states, li_kwargs) ], axis=channel_axis )
+            return h, [h]
+
+        last_output, outputs, _ = K.rnn( step,
+                                        tf.concat( li_inputs, axis=seq_channel_axis ),
+                                        [ tf.concat( li_initial_state, axis=channel_axis ) ],
+                                        input_length=K.int_shape(li_inputs[0])[1] )
+
+        if self.return_sequences:
+            y, y_rev = tf.split( outputs, state_channels, axis=seq_channel_axis )
+            y_rev = K.reverse( y_rev, 1 )
+        else:
+            y, y_rev = tf.split( last_output, state_channels, axis=channel_axis )
+
+        if self.merge_mode == 'concat':
+            output = K.concatenate( [y, y_rev] )
+        elif self.merge_mode == 'sum':
+            output = y + y_rev
+        elif self.merge_mode == 'ave':
+            output = (y + y_rev) / 2
+        elif self.merge_mode == 'mul':
+            output = y * y_rev
+        elif self.merge_mode is None:
+            output = [y, y_rev]
+        else:
+            raise ValueError('Unrecognized value for `merge_mode`: %s' % (self.merge_mode))
+
+        return output
+#endregion
+
+def merge_time_axis(inputs):
+    """ Merges the time dimension into the batch dimension, so that a 2D convolution is applied to all timesteps at once
+            :param tnsr inputs: (bs, t, h, w, c)
+            return outputs : (bs*t, h, w, c)
+    """
+    shape = [ dim if dim is not None else tf.shape(inputs)[idx] for idx, dim in enumerate(K.int_shape(inputs)) ]
+    return tf.reshape( inputs, [-1] + shape[2:] )
+
+def split_time_axis(inputs, timesteps):
+    """ Reverses merge_time_axis
+            :param tnsr inputs: (bs*t, h, w, c)
+            return outputs : (bs, t, h, w, c)
+    """
+    shape = [ dim if dim is not None else tf.shape(inputs)[idx] for idx, dim in enumerate(K.int_shape(inputs)) ]
+    return tf.reshape( inputs, [-1, timesteps] + shape[1:] )
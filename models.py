@@ -4,6 +4,7 @@ from tensorflow.keras.layers import TimeDistributed, Conv2D, Dropout, MaxPooling
 import layers
 import layers_convgru2D
 import copy
+import utility
 
 
 def model_loader(t_params,m_params ):
@@ -19,6 +20,10 @@ def model_loader(t_params,m_params ):
     elif(model_name=="UNET"):
         model = UNET(t_params, m_params )
 
+    if m_params['model_type_settings'].get('jit_compile', False):
+        # XLA compiling the model's forward pass
+        model.call = utility.tf_function( model.call, jit_compile=True )
+
     return model
 
 class HCGRU(tf.keras.Model):
@@ -30,7 +35,7 @@ class HCGRU(tf.keras.Model):
         self.layer_count = m_params['layer_count']
                
         
-        self.ConvGRU_layers = [ tf.keras.layers.Bidirectional( layer= layers_convgru2D.ConvGRU2D( **m_params['ConvGRU_layer_params'][idx] ), 
+        self.ConvGRU_layers = [ layers.bidirectional_wrapper( m_params['model_type_settings'].get('fused_bidirectional',False) )( layer= layers_convgru2D.ConvGRU2D( **m_params['ConvGRU_layer_params'][idx] ), 
                                                                 backward_layer= layers_convgru2D.ConvGRU2D( go_backwards=True,**copy.deepcopy(m_params['ConvGRU_layer_params'][idx]) ) ,
                                                                 merge_mode='concat' )  for idx in range( m_params['layer_count'] ) ]
          
@@ -58,13 +63,12 @@ class HCGRU(tf.keras.Model):
 
             self.output_activation = layers.CustomRelu_maker(t_params, dtype='float32')
         
-        self.new_shape1 = [0,m_params['region_grid_params']['outer_box_dims'][0], m_params['region_grid_params']['outer_box_dims'][1],  t_params['lookback_target'] ,int(6*4)]
+        self.new_shape1 = [-1,m_params['region_grid_params']['outer_box_dims'][0], m_params['region_grid_params']['outer_box_dims'][1],  t_params['lookback_target'] ,int(6*4)]
     
     @tf.function
     def call(self, _input, training):
         
         x = tf.transpose( _input, [0, 2,3,1,4])     # moving time axis next to channel axis
-        self.new_shape1[0] = _input.shape[0]
         x = tf.reshape( x, self.new_shape1 )        # reshape time and channel axis
         x = tf.transpose( x, [0,3,1,2,4 ] )   # converting back to bs, time, h,w, c
 
@@ -131,10 +135,14 @@ class TRUNET(tf.keras.Model):
         
         # Encoder
         self.encoder = layers.TRUNET_Encoder( t_params, m_params['encoder_params'], h_w_enc,  
-            attn_ablation=m_params['model_type_settings'].get('attn_ablation',0) )
+            attn_ablation=m_params['model_type_settings'].get('attn_ablation',0),
+            recompute=m_params['model_type_settings'].get('recompute',False),
+            fused_bidirectional=m_params['model_type_settings'].get('fused_bidirectional',False) )
 
         #Decoder
-        self.decoder = layers.TRUNET_Decoder( t_params, m_params['decoder_params'], h_w_dec )
+        self.decoder = layers.TRUNET_Decoder( t_params, m_params['decoder_params'], h_w_dec,
+            recompute=m_params['model_type_settings'].get('recompute',False),
+            fused_bidirectional=m_params['model_type_settings'].get('fused_bidirectional',False) )
         
         #Output Layer
         self.output_layer = layers.TRUNET_OutputLayer( t_params, m_params['output_layer_params'], 
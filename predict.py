@@ -128,13 +128,11 @@ class TestTruNet():
         
         # Caching datasets, Creating iterable
                 
-        cache_suffix = 'test_{}_loctest_{}_bs_{}'.format(self.t_params['ctsm_test'] , "_".join(utility.loc_name_shrtner(self.era5_eobs.li_loc) ), t_params['batch_size'] )
-                    
-        cache_dir =  t_params['data_dir'] 
-
-#        os.makedirs(cache_dir, exist_ok=True)
+        cache_fp = os.path.join( './Data/data_cache/', 'test' + utility.cache_suffix_mkr( self.m_params, self.t_params, self.era5_eobs.li_loc ) )
+        os.makedirs( './Data/data_cache/', exist_ok=True )
 
-        self.ds = self.ds.cache(os.path.join(os.path.dirname(cache_dir),cache_suffix))
+        self.ds = self.ds.cache( cache_fp )
+        utility.cache_metadata_update( cache_fp, self.m_params, self.t_params, self.era5_eobs.li_loc )
         
         self.ds = self.ds.repeat(1) 
         
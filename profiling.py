@@ -0,0 +1,125 @@
+import contextlib
+import time
+
+import numpy as np
+import tensorflow as tf
+
+class StepTimer():
+    """Lightweight always-on timing of training steps.
+
+        For each call to a step function it records the time spent waiting on the input pipeline and the time spent
+            computing the steps. Time spent outside of the step functions, e.g. on reporting, is recorded as bookkeeping.
+        Times are measured on the host. Unless the caller waits for the steps to finish executing on the device before
+            recording them, only the time taken to dispatch them is recorded, and the time spent executing them is recorded
+            against the next call that waits. When the caller waits at the end of each reporting group, the mean times and
+            examples/sec of the group are exact, while the latency percentiles are those of the dispatches.
+        When several steps are run per graph execution, their input waits happen within the graph and are counted as compute.
+
+        Example of how to use:
+        step_timer = StepTimer( batch_size )
+        step_timer.record( steps, input_wait, compute )
+        summary = step_timer.summary()          #Timings since the last reset
+        step_timer.reset()
+    """
+    # Columns of the timings returned by summary
+    columns = ['Steps','Input_wait_ms','Compute_ms','Bookkeeping_ms','Latency_p50_ms','Latency_p95_ms','Examples_per_sec']
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.perf_counter()
+        self.steps = 0
+        self.input_wait = 0.0
+        self.compute = 0.0
+        self.li_step_latency = []
+
+    def record(self, steps, input_wait, compute):
+        """Records a call to a step function
+
+            Args:
+                steps (int): number of steps run by the call
+                input_wait (float): seconds spent waiting on the input pipeline
+                compute (float): seconds spent in the step function, and waiting for the steps if the caller waited
+        """
+        self.steps += steps
+        self.input_wait += input_wait
+        self.compute += compute
+        self.li_step_latency.extend( [ (input_wait + compute)/steps ]*steps )
+
+    def summary(self):
+        """Returns the timings of the steps recorded since the last reset
+
+            Returns:
+                dict: steps, mean input wait, compute and bookkeeping time per step (ms),
+                    p50 and p95 step latency (ms) and examples/sec
+        """
+        total = time.perf_counter() - self.start_time
+        steps = max( self.steps, 1 )
+        li_step_latency = self.li_step_latency if self.li_step_latency else [0.0]
+
+        return { 'Steps':self.steps,
+                'Input_wait_ms':1000*self.input_wait/steps,
+                'Compute_ms':1000*self.compute/steps,
+                'Bookkeeping_ms':1000*( total - self.input_wait - self.compute )/steps,
+                'Latency_p50_ms':1000*np.percentile( li_step_latency, 50 ),
+                'Latency_p95_ms':1000*np.percentile( li_step_latency, 95 ),
+                'Examples_per_sec':self.steps*self.batch_size/total }
+
+class StepProfiler():
+    """Captures a tf.profiler trace of the training steps in the range [start_step, stop_step), counted from the start of training
+
+        Example of how to use:
+        step_profiler = StepProfiler( "10:20", logdir )
+        step_profiler.before_steps( step, steps )       #Starts the trace when the range is reached
+        with step_profiler.trace( step ):
+            train step
+        step_profiler.after_steps( step + steps )       #Stops the trace once the range is completed
+    """
+    def __init__(self, profile_steps, logdir):
+        """
+            Args:
+                profile_steps (str): range of steps to profile, "start_step:stop_step". None to never profile
+                logdir (str): directory the trace is saved to, readable by TensorBoard's profile plugin
+        """
+        self.range = parse_profile_steps( profile_steps )
+        self.logdir = logdir
+        self.profiling = False
+        self.completed = False
+
+    def before_steps(self, step, steps):
+        """Starts the trace if any of the next steps, from step, are in the range"""
+        if self.range is None or self.profiling or self.completed:
+            return
+        if step + steps > self.range[0]:
+            print("\tStarting profiler trace at step {}".format(step))
+            tf.profiler.experimental.start( self.logdir )
+            self.profiling = True
+
+    def trace(self, step):
+        """Returns a context manager marking a step in the trace"""
+        if self.profiling:
+            return tf.profiler.experimental.Trace( 'train', step_num=step, _r=1 )
+        return contextlib.nullcontext()
+
+    def after_steps(self, step):
+        """Stops the trace once step reaches the end of the range"""
+        if self.profiling and step >= self.range[1]:
+            self.stop()
+
+    def stop(self):
+        if self.profiling:
+            tf.profiler.experimental.stop()
+            print("\tSaved profiler trace to {}".format(self.logdir))
+            self.profiling = False
+            self.completed = True
+
+def parse_profile_steps(profile_steps):
+    """Parses a "start_step:stop_step" range of steps into a list [start_step, stop_step], or returns None"""
+    if not profile_steps:
+        return None
+    start_step, stop_step = [ int(step) for step in profile_steps.split(":") ]
+    if not 0 <= start_step < stop_step:
+        raise ValueError("profile_steps must be a range start_step:stop_step with 0 <= start_step < stop_step, got {}".format(profile_steps))
+    return [start_step, stop_step]
@@ -23,10 +23,13 @@ try:
 except Exception as e:
     tfa = None
 
+import checkpoint_writer
 import data_generators
+import dataset_builder
 import custom_losses as cl
 import hparameters
 import models
+import profiling
 import utility
 
 tf.keras.backend.set_floatx('float16')
@@ -69,52 +72,41 @@ class WeatherModel():
         WeatherModel.initialize_scheme_era5Eobs()    #Initializes datasets for ERA5 and Eobs
         WeatherModel.train_model()                   #Trains and saves model
     """    
+    # Columns of the checkpoint scores and of the training progress records
+    record_columns = ['Epoch','Train_loss','Train_mse','Val_loss','Val_mse','Checkpoint_Path','Last_Trained_Batch']
+
     def __init__(self, t_params, m_params): 
         """Train the TRU_NET Model
         """
         self.t_params = t_params
         self.m_params = m_params
-        
-    def initialize_scheme_era5Eobs(self):
-        """Initialization scheme for the ERA5 and E-OBS datasets.
-            This method creates the datasets
-        """        
-        # region ---- Parameters  related to training length and training reporting frequency 
-        era5_eobs = data_generators.Era5_Eobs( self.t_params, self.m_params)
 
-        # hparameters files calculates train_batches assuing we are only evaluating one location, 
-            # therefore we must adjust got multiple locations (loc_count)
-        self.t_params['train_batches'] = int(self.t_params['train_batches'] * era5_eobs.loc_count)
-        self.t_params['val_batches'] = int(self.t_params['val_batches'] * era5_eobs.loc_count)
+        # Number of batches trained on, or validated on, per call to a distributed step function
+        self.steps_per_execution = self.t_params.get('t_settings',{}).get('steps_per_execution', 1)
 
-        # The fequency at which we report during training and validation i.e every 10% of minibatches report training loss and training mse
-        self.train_batch_report_freq = max( int(self.t_params['train_batches']*self.t_params['reporting_freq']), 3)
-        self.val_batch_report_freq = max( int(self.t_params['val_batches']*self.t_params['reporting_freq']), 3)
-        #endregion
+        # During training we produce a prediction for a (n by n) square patch. But we caculate losses on a central (h, w) region within the (n by n) patch
+            # Python ints, so that the central region has a static shape within the step functions
+        self.bounds = [ int(bound) for bound in cl.central_region_bounds(self.m_params['region_grid_params']) ] #list [ lower_h_bound[0], upper_h_bound[0], lower_w_bound[1], upper_w_bound[1] ]
 
-        # region ---- Restoring/Creating New Training Records and Restoring training progress
-            #This training records keeps track of the losses on each epoch
-        try:
-            self.df_training_info = pd.read_csv( "checkpoints/{}/checkpoint_scores.csv".format(utility.model_name_mkr(m_params,t_params=self.t_params,htuning=m_params.get('htuning',False))), header=0, index_col=False) 
-            self.df_training_info = self.df_training_info[['Epoch','Train_loss','Train_mse','Val_loss','Val_mse','Checkpoint_Path','Last_Trained_Batch']]
-            self.start_epoch =  int(max([self.df_training_info['Epoch'][0]], default=0))
-            last_batch = int( self.df_training_info.loc[self.df_training_info['Epoch']==self.start_epoch,'Last_Trained_Batch'].iloc[0] )
-            if(last_batch in [-1, self.t_params['train_batches']] ):
-                self.start_epoch = self.start_epoch + 1
-                self.batches_to_skip = 0 
-            else:
-                self.batches_to_skip = last_batch
-            print("Recovered training records")
+        # Number of times each step function has been traced
+        self.trace_counts = {}
 
-        except FileNotFoundError as e:
-            #If no file found, then make new training records file
-            self.df_training_info = pd.DataFrame(columns=['Epoch','Train_loss','Train_mse','Val_loss','Val_mse','Checkpoint_Path','Last_Trained_Batch'] ) 
-            self.batches_to_skip = 0
-            self.start_epoch = 0
-            print("Did not recover training records. Starting from scratch")
-        # endregion
+        # Number of batches over which gradients are accumulated before being applied, and the number accumulated so far
+        self.grad_accum_steps = self.t_params.get('grad_accum_steps', 1)
+        self.accum_count = 0
 
-        # region ---- Defining Model / Optimizer / Losses / Metrics / Records / Checkpoints / Tensorboard 
+        # Whether to checkpoint the train/val iterator with the model at reporting batches, to resume training at the exact element
+        self.resumable_iterator = self.t_params.get('t_settings',{}).get('resumable_iterator', False)
+
+        # Timings of the training steps, and the tf.profiler trace of the training steps in the profile_steps range
+        self.train_step_count = 0
+        self.step_timer = profiling.StepTimer( self.t_params['batch_size'] )
+        self.step_profiler = profiling.StepProfiler( self.t_params.get('profile_steps', None),
+                                "log_tensboard/{}/profile".format(utility.model_name_mkr(m_params, t_params=self.t_params, htuning=self.m_params.get('htuning',False) )) )
+        
+    def initialize_model(self):
+        """Creates the distribution strategy, the model, the optimizer and the metrics which aggregate losses
+        """
         devices = tf.config.get_visible_devices() #tf.config.experimental.list_physical_devices('GPU')
         #gpus_names = [ device.name for device in devices if  device.device_type == "GPU" ]
         #self.strategy = tf.distribute.MirroredStrategy( devices=gpus_names ) #OneDeviceStrategy(device="/GPU:0") # 
@@ -128,9 +120,7 @@ class WeatherModel():
             self.model = models.model_loader( self.t_params, self.m_params )
             
             #Optimizer
-            optimizer = tfa.optimizers.RectifiedAdam( **self.m_params['rec_adam_params'], total_steps=self.t_params['train_batches']*20) 
-
-            self.optimizer = mixed_precision.LossScaleOptimizer( optimizer, loss_scale=tf.mixed_precision.experimental.DynamicLossScale() ) 
+            self.optimizer = self.optimizer_mkr()
                     
             # These objects will aggregate losses and metrics across batches and epochs
             self.loss_agg_batch = tf.keras.metrics.Mean(name='loss_agg_batch' )
@@ -140,23 +130,92 @@ class WeatherModel():
             
             self.loss_agg_val = tf.keras.metrics.Mean(name='loss_agg_val')
             self.mse_agg_val = tf.keras.metrics.Mean(name='mse_agg_val')
+
+    def optimizer_mkr(self):
+        """Returns the RectifiedAdam optimizer, wrapped in a LossScaleOptimizer for mixed precision training"""
+        optimizer = tfa.optimizers.RectifiedAdam( **self.m_params['rec_adam_params'], total_steps=self.t_params['train_batches']*20//self.grad_accum_steps) 
+
+        return mixed_precision.LossScaleOptimizer( optimizer, loss_scale=tf.mixed_precision.experimental.DynamicLossScale() ) 
+
+    def initialize_scheme_era5Eobs(self):
+        """Initialization scheme for the ERA5 and E-OBS datasets.
+            This method creates the datasets
+        """        
+        # region ---- Parameters  related to training length and training reporting frequency 
+        export_dir = dataset_builder.export_dir_mkr( self.t_params, self.m_params )
+        manifest = dataset_builder.load_manifest( export_dir )
+
+        if manifest is not None:
+            # Datasets previously exported by dataset_builder are read without opening the raw data files
+            era5_eobs = None
+            loc_count = manifest['loc_count']
+            self.t_params['train_batches'] = manifest['splits']['train']['examples'] // self.t_params['batch_size']
+            self.t_params['val_batches'] = manifest['splits']['val']['examples'] // self.t_params['batch_size']
+        else:
+            era5_eobs = data_generators.Era5_Eobs( self.t_params, self.m_params)
+            loc_count = era5_eobs.loc_count
+
+            # hparameters files calculates train_batches assuing we are only evaluating one location, 
+                # therefore we must adjust got multiple locations (loc_count)
+            self.t_params['train_batches'] = int(self.t_params['train_batches'] * loc_count)
+            self.t_params['val_batches'] = int(self.t_params['val_batches'] * loc_count)
+
+        # The fequency at which we report during training and validation i.e every 10% of minibatches report training loss and training mse
+        self.train_batch_report_freq = max( int(self.t_params['train_batches']*self.t_params['reporting_freq']), 3)
+        self.val_batch_report_freq = max( int(self.t_params['val_batches']*self.t_params['reporting_freq']), 3)
+        #endregion
+
+        # region ---- Restoring/Creating New Training Records and Restoring training progress
+            #This training records keeps track of the losses on each epoch
+        try:
+            self.df_training_info = utility.load_checkpoint_scores( "checkpoints/{}/checkpoint_scores.csv".format(utility.model_name_mkr(m_params,t_params=self.t_params,htuning=m_params.get('htuning',False))), self.t_params['checkpoints_to_keep'] ) 
+            self.df_training_info = self.df_training_info[self.record_columns]
+            self.start_epoch =  int(max([self.df_training_info['Epoch'][0]], default=0))
+            last_batch = int( self.df_training_info.loc[self.df_training_info['Epoch']==self.start_epoch,'Last_Trained_Batch'].iloc[0] )
+            self.start_epoch, self.batches_to_skip = self.resume_position( self.start_epoch, last_batch )
+            print("Recovered training records")
+
+        except FileNotFoundError as e:
+            #If no file found, then make new training records file
+            self.df_training_info = pd.DataFrame(columns=self.record_columns ) 
+            self.batches_to_skip = 0
+            self.start_epoch = 0
+            print("Did not recover training records. Starting from scratch")
+
+            #This append only record keeps track of the progress within each epoch. Its last record holds the last trained batch
+        self.progress_fp = "checkpoints/{}/training_progress.csv".format(utility.model_name_mkr(m_params,t_params=self.t_params,htuning=m_params.get('htuning',False)))
+            #This append only record keeps the timings of the training steps within each reporting group
+        self.step_timings_fp = "checkpoints/{}/step_timings.csv".format(utility.model_name_mkr(m_params,t_params=self.t_params,htuning=m_params.get('htuning',False)))
+        if os.path.exists(self.progress_fp):
+            df_progress = pd.read_csv( self.progress_fp, header=0, index_col=False )
+            if len(df_progress.index) > 0:
+                self.start_epoch, self.batches_to_skip = self.resume_position( int(df_progress['Epoch'].iloc[-1]), int(df_progress['Last_Trained_Batch'].iloc[-1]) )
+                print("Recovered training progress")
+        # endregion
+
+        # region ---- Defining Model / Optimizer / Losses / Metrics / Records / Checkpoints / Tensorboard 
+        self.initialize_model()
             
         #checkpoints  (For Epochs)
             #The CheckpointManagers can be called to serializae the weights within TRUNET
         checkpoint_path_epoch = "./checkpoints/{}/epoch".format(utility.model_name_mkr(m_params,t_params=self.t_params, htuning=m_params.get('htuning',False) ))
         os.makedirs(checkpoint_path_epoch,exist_ok=True)
         
+        # Saves the epoch checkpoints and the training records in the background. 
+            # Its CheckpointManager is the only one managing checkpoint_path_epoch, and is also used to find the checkpoint to restore
+        self.initialize_checkpoint_writer( checkpoint_path_epoch )
+
         with self.strategy.scope():
             ckpt_epoch = tf.train.Checkpoint(model=self.model, optimizer=self.optimizer)
-            self.ckpt_mngr_epoch = tf.train.CheckpointManager(ckpt_epoch, checkpoint_path_epoch, max_to_keep=self.t_params['checkpoints_to_keep'], keep_checkpoint_every_n_hours=None)    
         
             #restoring last checkpoint if it exists
-            if self.ckpt_mngr_epoch.latest_checkpoint: 
+            if self.ckpt_writer.latest_checkpoint: 
                 # compat: Initializing model and optimizer before restoring from checkpoint
+                self.build_model()
                 try:
-                    ckpt_epoch.restore(self.ckpt_mngr_epoch.latest_checkpoint).assert_consumed()            
+                    ckpt_epoch.restore(self.ckpt_writer.latest_checkpoint).assert_consumed()            
                 except AssertionError as e:
-                    ckpt_epoch.restore(self.ckpt_mngr_epoch.latest_checkpoint)              
+                    ckpt_epoch.restore(self.ckpt_writer.latest_checkpoint)              
                 print (' Restoring model from best checkpoint')
             else:
                 print (' Initializing model from scratch')
@@ -168,41 +227,213 @@ class WeatherModel():
         
         # region ---- Making Datasets
         
-        #caching dataset to file post pre-processing steps have been completed 
-        cache_suffix = utility.cache_suffix_mkr( m_params, self.t_params )
-        os.makedirs( './Data/data_cache/', exist_ok=True  )
+        shuffle_buffer_mb = self.t_params.get('t_settings',{}).get('shuffle_buffer_mb', 1024)
+
+        if manifest is not None:
+            # Reading datasets previously exported by dataset_builder
+            print("Reading datasets exported to {}".format(export_dir))
+            ds_val = dataset_builder.load_dataset( export_dir, "val", self.t_params['batch_size'], self.t_params['parallel_calls'] )
+
+            # Shuffling the order of the shards and the examples read from them
+            shuffle_buffer = self.shuffle_buffer_size( ds_val.element_spec, shuffle_buffer_mb )
+            ds_train = dataset_builder.load_dataset( export_dir, "train", self.t_params['batch_size'], self.t_params['parallel_calls'], shuffle_buffer=shuffle_buffer )
+        
+        else:
+            #caching dataset to file post pre-processing steps have been completed 
+            cache_suffix = utility.cache_suffix_mkr( m_params, self.t_params )
+            os.makedirs( './Data/data_cache/', exist_ok=True  )
 
-        _ds_train_val, _  = era5_eobs.load_data_era5eobs( self.t_params['train_batches'] + self.t_params['val_batches'] , self.t_params['start_date'], self.t_params['parallel_calls'] )
+            _ds_train_val, _  = era5_eobs.load_data_era5eobs( self.t_params['train_batches'] + self.t_params['val_batches'] , self.t_params['start_date'], self.t_params['parallel_calls'] )
 
-        ds_train = _ds_train_val.take(self.t_params['train_batches'] )
-        ds_val = _ds_train_val.skip(self.t_params['train_batches'] ).take(self.t_params['val_batches'])
+            ds_train = _ds_train_val.take(self.t_params['train_batches'] )
+            ds_val = _ds_train_val.skip(self.t_params['train_batches'] ).take(self.t_params['val_batches'])
 
-        #TODO: undo cache
-        ds_train = ds_train.cache('Data/data_cache/train'+cache_suffix ) 
-        ds_val = ds_val.cache('Data/data_cache/val'+cache_suffix )
+            #TODO: undo cache
+            ds_train = ds_train.cache('Data/data_cache/train'+cache_suffix ) 
+            ds_val = ds_val.cache('Data/data_cache/val'+cache_suffix )
+            utility.cache_metadata_update( 'Data/data_cache/train'+cache_suffix, self.m_params, self.t_params )
+            utility.cache_metadata_update( 'Data/data_cache/val'+cache_suffix, self.m_params, self.t_params )
 
-        ds_train = ds_train.unbatch().shuffle( self.t_params['batch_size']*int(self.t_params['train_batches']/5), reshuffle_each_iteration=True).batch(self.t_params['batch_size']) #.repeat(self.t_params['epochs']-self.start_epoch)
+            shuffle_buffer = self.shuffle_buffer_size( ds_train.element_spec, shuffle_buffer_mb )
+            ds_train = ds_train.unbatch().shuffle( shuffle_buffer, reshuffle_each_iteration=True).batch(self.t_params['batch_size']) #.repeat(self.t_params['epochs']-self.start_epoch)
 
         ds_train_val = ds_train.concatenate(ds_val)
-        ds_train_val = ds_train_val.repeat(self.t_params.get('epochs',100)-self.start_epoch)
+        if self.resumable_iterator:
+            # Repeating indefinitely, so that a restored iterator does not depend on the epoch training was started from
+            ds_train_val = ds_train_val.repeat()
+        else:
+            ds_train_val = ds_train_val.repeat(self.t_params.get('epochs',100)-self.start_epoch)
         self.ds_train_val = self.strategy.experimental_distribute_dataset(dataset=ds_train_val)
-        self.iter_train_val = enumerate(self.ds_train_val)
+        self.iter_train_val = iter(self.ds_train_val)
 
-        bc_ds_in_train = int( self.t_params['train_batches']/era5_eobs.loc_count  ) #batch_count
-        bc_ds_in_val = int( self.t_params['val_batches']/era5_eobs.loc_count )
+        if self.resumable_iterator:
+            self.initialize_batch_checkpoint( "./checkpoints/{}/batch".format(utility.model_name_mkr(m_params,t_params=self.t_params, htuning=m_params.get('htuning',False) )) )
 
-        self.reset_idxs_training = np.cumsum( [bc_ds_in_train]*era5_eobs.loc_count )
-        self.reset_idxs_validation = np.cumsum( [bc_ds_in_val]*era5_eobs.loc_count )        
+        self.initialize_step_functions( self.ds_train_val.element_spec )
+
+        bc_ds_in_train = int( self.t_params['train_batches']/loc_count  ) #batch_count
+        bc_ds_in_val = int( self.t_params['val_batches']/loc_count )
+
+        self.reset_idxs_training = np.cumsum( [bc_ds_in_train]*loc_count )
+        self.reset_idxs_validation = np.cumsum( [bc_ds_in_val]*loc_count )        
         # endregion
 
+    def shuffle_buffer_size(self, element_spec, buffer_mb):
+        """Returns the number of examples in the training shuffle buffer. 
+            A fifth of the training examples, capped so that the buffer holds at most buffer_mb of examples
+
+            Args:
+                element_spec (tuple): specs of the batched (feature, target, mask) elements
+                buffer_mb (float): memory limit of the shuffle buffer in MB
+        """
+        # The only dims left unknown by the data pipeline are the time dims, 
+        # of length lookback_feature for the features and lookback_target for the targets and masks
+        li_time_len = [ self.t_params['lookback_feature'] ] + [ self.t_params['lookback_target'] ]*( len(element_spec) - 1 )
+        example_bytes = sum( int( np.prod( [ time_len if dim is None else dim for dim in spec.shape.as_list()[1:] ] ) ) * spec.dtype.size
+                                for spec, time_len in zip(element_spec, li_time_len) )
+        max_examples = self.t_params['batch_size']*int(self.t_params['train_batches']/5)
+        shuffle_buffer = max( min( max_examples, int( buffer_mb*2**20 // example_bytes ) ), 1 )
+
+        if shuffle_buffer < max_examples:
+            print("Shuffle buffer capped at {} examples ({}MB). The 'shuffle_buffer_mb' t_setting raises the limit".format(shuffle_buffer, buffer_mb))
+        return shuffle_buffer
+
+    def resume_position(self, epoch, last_batch):
+        """Returns the epoch and the number of batches to skip, to resume training after last_batch of epoch
+
+            Args:
+                epoch (int): last epoch trained on
+                last_batch (int): last batch trained on within epoch, -1 if the epoch was completed
+        """
+        if(last_batch in [-1, self.t_params['train_batches']] ):
+            return epoch + 1, 0
+        else:
+            return epoch, last_batch
+
+    def model_input_shape(self):
+        """Returns the shape of the feature input to the model on each replica"""
+        if self.m_params['time_sequential'] == True:
+            inp_shape = [self.t_params['batch_size']//self.strategy_gpu_count, self.t_params['lookback_feature']] + self.m_params['region_grid_params']['outer_box_dims'] + [len(self.t_params['vars_for_feature'])]
+        else:
+            inp_shape = [self.t_params['batch_size']//self.strategy_gpu_count ] + self.m_params['region_grid_params']['outer_box_dims'] + [ int(self.t_params['lookback_feature']*len(self.t_params['vars_for_feature'])) ]
+        return inp_shape
+
+    def build_model(self, build_optimizer=True):
+        """Creates the model and optimizer variables, by passing a batch of zeros through the model and applying zero gradients
+
+            Args:
+                build_optimizer (bool, optional): Whether to also create the optimizer variables. Defaults to True.
+        """
+        inp_shape = self.model_input_shape()
+
+        def _build():
+            _ = self.model( tf.zeros( inp_shape, dtype=tf.float16), self.t_params['trainable'] )    #( bs, tar_seq_len, h, w)
+
+            if build_optimizer:
+                gradients = [ tf.zeros_like(t_var, dtype=tf.float32 ) for t_var in self.model.trainable_variables  ]
+                self.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+
+        self.strategy.run( _build )
+
+    def initialize_checkpoint_writer(self, checkpoint_path_epoch):
+        """Creates the background checkpoint writer. 
+            It saves checkpoints of a shadow copy of the model and optimizer on the CPU, which shares the structure of ckpt_epoch
+            
+            Args:
+                checkpoint_path_epoch (str): directory of the epoch checkpoints
+        """
+        if not self.model.built:
+            self.build_model()
+
+        with tf.device('/CPU:0'):
+            shadow_model = models.model_loader( self.t_params, self.m_params )
+            shadow_optimizer = self.optimizer_mkr()
+
+            _ = shadow_model( tf.zeros( self.model_input_shape(), dtype=tf.float16), self.t_params['trainable'] )
+            gradients = [ tf.zeros_like(t_var, dtype=tf.float32 ) for t_var in shadow_model.trainable_variables  ]
+            shadow_optimizer.apply_gradients(zip(gradients, shadow_model.trainable_variables))
+
+        self.ckpt_writer = checkpoint_writer.CheckpointWriter( tf.train.Checkpoint(model=shadow_model, optimizer=shadow_optimizer), checkpoint_path_epoch,
+                                self.t_params['checkpoints_to_keep'], self.model.variables + self.optimizer.variables(),
+                                shadow_model.variables + shadow_optimizer.variables() )
+
+    def initialize_step_functions(self, element_spec):
+        """Compiles the single batch step functions with a fixed input signature, taken from the distributed dataset's
+            element_spec, so that they are traced once regardless of the batch shapes passed
+
+            Args:
+                element_spec (tuple): specs of the (feature, target, mask) elements of the distributed dataset
+        """
+        self.distributed_train_step = tf.function( self.distributed_train_step, input_signature=list(element_spec) )
+        self.distributed_val_step = tf.function( self.distributed_val_step, input_signature=list(element_spec) )
+
+        if self.grad_accum_steps > 1:
+            self.initialize_grad_accumulation()
+
+        if self.t_params.get('t_settings',{}).get('jit_compile', False):
+            # XLA compiling the forward and backward passes. The model variables are created beforehand, outside of the compiled functions
+            self.build_model(build_optimizer=False)
+            self.compute_gradients = utility.tf_function( self.compute_gradients, jit_compile=True )
+            self.compute_val_losses = utility.tf_function( self.compute_val_losses, jit_compile=True )
+
+    def initialize_grad_accumulation(self):
+        """Creates a float32 accumulator for the gradient of each trainable variable. 
+            Accumulators are local to each replica, the accumulated gradients are aggregated across replicas when applied
+        """
+        self.build_model(build_optimizer=False)
+
+        with self.strategy.scope():
+            self.accum_gradients = [ tf.Variable( tf.zeros_like(t_var, dtype=tf.float32), trainable=False,
+                                        synchronization=tf.VariableSynchronization.ON_READ, aggregation=tf.VariableAggregation.SUM ) 
+                                        for t_var in self.model.trainable_variables ]
+        self.accum_count = 0
+
+        # Indices of the trainable variables that receive a gradient, set when train_step is traced
+        self.accum_var_idxs = None
+
+    def initialize_batch_checkpoint(self, checkpoint_path_batch):
+        """Creates the mid-epoch checkpoint of the model, the optimizer and the train/val iterator, restoring it if it exists.
+            A restored run continues from the exact element of the dataset the checkpointed run would have used next,
+            without replaying the data pipeline. The iterator state includes the contents of the shuffle buffer
+
+            Args:
+                checkpoint_path_batch (str): directory of the mid-epoch checkpoint
+        """
+        # The epoch and last trained batch (-1 once the epoch is completed) of the checkpointed state
+        self.ckpt_batch_position = tf.Variable( [0, 0], dtype=tf.int64, trainable=False )
+
+        with self.strategy.scope():
+            ckpt_batch = tf.train.Checkpoint(model=self.model, optimizer=self.optimizer, iterator=self.iter_train_val, position=self.ckpt_batch_position)
+            self.ckpt_mngr_batch = tf.train.CheckpointManager(ckpt_batch, checkpoint_path_batch, max_to_keep=1, keep_checkpoint_every_n_hours=None)
+
+            if self.ckpt_mngr_batch.latest_checkpoint:
+                ckpt_batch.restore(self.ckpt_mngr_batch.latest_checkpoint).assert_existing_objects_matched()
+                epoch, last_batch = [ int(val) for val in self.ckpt_batch_position.numpy() ]
+                self.start_epoch, self.batches_to_skip = self.resume_position( epoch, last_batch )
+                print(' Restoring model and data iterator from epoch {} batch {}'.format(epoch, last_batch) )
+
+    def save_batch_checkpoint(self, epoch, last_batch):
+        """Saves the model, the optimizer and the train/val iterator after last_batch of epoch. 
+            Skipped while gradients are being accumulated, since the accumulated gradients are not checkpointed
+        """
+        if self.accum_count > 0:
+            return
+        self.ckpt_batch_position.assign( [epoch, last_batch] )
+        self.ckpt_mngr_batch.save()
+
+    def count_trace(self, name):
+        """Records a trace of a step function. 
+            Called from within the step functions, so only runs while they are being traced
+        """
+        self.trace_counts[name] = self.trace_counts.get(name, 0) + 1
+        print("\tTracing {} (trace {})".format(name, self.trace_counts[name]))
+
     def train_model(self):
         """During training we produce a prediction for a (n by n) square patch. 
             But we caculate losses on a central (h, w) region within the (n by n) patch
-            This central region is defined by "bounds" below
+            This central region is defined by self.bounds
         """        
 
-        bounds = cl.central_region_bounds(self.m_params['region_grid_params']) #list [ lower_h_bound[0], upper_h_bound[0], lower_w_bound[1], upper_w_bound[1] ]
-        
         #Training for n epochs
         #self.t_params['train_batches'] = self.t_params['train_batches'] if self.m_params['time_sequential'] else int(self.t_params['train_batches']*self.t_params['lookback_target'] )
         #self.t_params['val_batches'] = self.t_params['val_batches'] if self.m_params['time_sequential'] else int(self.t_params['val_batches']*self.t_params['lookback_target'] )
@@ -218,8 +449,6 @@ class WeatherModel():
             self.loss_agg_val.reset_states()
             self.mse_agg_val.reset_states()
             
-            self.df_training_info = self.df_training_info.append( { 'Epoch':epoch, 'Last_Trained_Batch':0 }, ignore_index=True )
-            
             start_epoch_train = time.time()
             start_batch_group_time = time.time()
             batch=0           
@@ -228,29 +457,37 @@ class WeatherModel():
             #endregion 
             
             # --- Training Loops
-            for batch in range(self.batches_to_skip+1,self.t_params['train_batches'] +1):
-                               
-                # get next set of training datums
-                idx, (feature, target, mask) = next(self.iter_train_val)
+            batch = self.batches_to_skip
+            self.step_timer.reset()
+            while batch < self.t_params['train_batches']:
                 
-
-                gradients = self.distributed_train_step( feature, target, mask, bounds, 0.0 )
-                #print(gradients)
+                # train on the next set(s) of training datums, up to the next reporting or state reset batch
+                steps = self.steps_to_boundary( batch, self.t_params['train_batches'], self.train_batch_report_freq, self.reset_idxs_training )
+                if self.grad_accum_steps > 1:
+                    steps = min( steps, self.grad_accum_steps - self.accum_count )
+                report = ( (batch+steps) % self.train_batch_report_freq==0 or batch+steps == self.t_params['train_batches'] )
+                self.train_steps( steps, sync=report )
+                batch += steps
                 
                 # reporting
-                if( batch % self.train_batch_report_freq==0 or batch == self.t_params['train_batches']):
+                if report:
                     batch_group_time =  time.time() - start_batch_group_time
                     est_completion_time_seconds = (batch_group_time/self.t_params['reporting_freq']) * (1 - batch/self.t_params['train_batches'])
                     est_completion_time_mins = est_completion_time_seconds/60
 
-                    print("\t\tBatch:{}/{}\tTrain Loss: {:.8f} \t Batch Time:{:.4f}\tEpoch mins left:{:.1f}".format(batch, self.t_params['train_batches'], self.loss_agg_batch.result(), batch_group_time, est_completion_time_mins ) )
+                    step_timings = self.step_timer.summary()
+                    print("\t\tBatch:{}/{}\tTrain Loss: {:.8f} \t Batch Time:{:.4f}\tEpoch mins left:{:.1f}\tStep ms p50/p95:{:.1f}/{:.1f}\tInput wait ms:{:.1f}".format(batch, self.t_params['train_batches'], self.loss_agg_batch.result(), batch_group_time, est_completion_time_mins,
+                                step_timings['Latency_p50_ms'], step_timings['Latency_p95_ms'], step_timings['Input_wait_ms'] ) )
                     
                     # resetting time and losses
                     start_batch_group_time = time.time()
+                    self.ckpt_writer.append_record( self.step_timings_fp, { 'Epoch':epoch, 'Batch':batch, **step_timings }, ['Epoch','Batch'] + self.step_timer.columns )
+                    self.step_timer.reset()
 
-                    # Updating record of the last batch to be operated on in training epoch
-                    self.df_training_info.loc[ ( self.df_training_info['Epoch']==epoch) , ['Last_Trained_Batch'] ] = batch
-                    self.df_training_info.to_csv( path_or_buf="checkpoints/{}/checkpoint_scores.csv".format(utility.model_name_mkr(self.m_params,t_params=self.t_params, htuning=m_params.get('htuning',False) )), header=True, index=False )
+                    # Recording the last batch to be operated on in training epoch
+                    self.ckpt_writer.append_record( self.progress_fp, { 'Epoch':epoch, 'Train_loss':float(self.loss_agg_batch.result()), 'Last_Trained_Batch':batch }, self.record_columns )
+                    if self.resumable_iterator and batch < self.t_params['train_batches']:
+                        self.save_batch_checkpoint( epoch, batch )
 
 
                 li_losses = [self.loss_agg_batch.result()]
@@ -262,6 +499,13 @@ class WeatherModel():
 
                 if batch in self.reset_idxs_training:
                     self.model.reset_states()
+
+            # applying any gradients accumulated over the last batches of the epoch
+            if self.grad_accum_steps > 1 and self.accum_count > 0:
+                self.apply_accumulated_gradients()
+
+            # Batches are only skipped in the epoch training is resumed in
+            self.batches_to_skip = 0
                     
             # --- Tensorboard record          
             li_losses = [self.loss_agg_epoch.result(), self.mse_agg_epoch.result()]
@@ -273,12 +517,13 @@ class WeatherModel():
             start_batch_group_time = time.time()
 
             # --- Validation Loops
-            for batch in range(1, self.t_params['val_batches']+1):
+            batch = 0
+            while batch < self.t_params['val_batches']:
                 
-                # next datum
-                idx, (feature, target, mask) = next(self.iter_train_val)
-                
-                bool_cmpltd = self.distributed_val_step(feature, target, mask, bounds)
+                # validate on the next set(s) of datums, up to the next reporting or state reset batch
+                steps = self.steps_to_boundary( batch, self.t_params['val_batches'], self.val_batch_report_freq, self.reset_idxs_validation )
+                self.val_steps( steps )
+                batch += steps
 
                 # Reporting for validation
                 if batch % self.val_batch_report_freq == 0 or batch==self.t_params['val_batches'] :
@@ -297,10 +542,19 @@ class WeatherModel():
             print("\tEpoch:{}\t Train Loss:{:.8f}\t Train MSE:{:.5f}\t Val Loss:{:.5f}\t Val MSE:{:.5f}\t  Time:{:.5f}".format(epoch, self.loss_agg_epoch.result(), self.mse_agg_epoch.result(),
                          
                         self.loss_agg_val.result(), self.mse_agg_val.result()  ,time.time()-start_epoch_train  ) )
+            print("\tStep function traces: {}".format( ", ".join( "{}:{}".format(name, count) for name, count in sorted(self.trace_counts.items()) ) ) )
                     
             #utility.tensorboard_record( self.writer.as_default(), [self.loss_agg_val.result(), self.mse_agg_val.result()], ['Validation Loss', 'Validation MSE' ], epoch  )                    
-            self.df_training_info = utility.update_checkpoints_epoch(self.df_training_info, epoch, self.loss_agg_epoch, self.loss_agg_val, self.ckpt_mngr_epoch, self.t_params, 
+            self.df_training_info = utility.update_checkpoints_epoch(self.df_training_info, epoch, self.loss_agg_epoch, self.loss_agg_val, self.ckpt_writer, self.t_params, 
                     self.m_params, self.mse_agg_epoch ,self.mse_agg_val,  self.t_params['objective'] )
+
+            # Recording the completed epoch, after its checkpoint has been written
+            li_ckpt_paths = self.df_training_info.loc[ self.df_training_info['Epoch']==epoch, 'Checkpoint_Path' ].tolist()
+            self.ckpt_writer.append_record( self.progress_fp, { 'Epoch':epoch, 'Train_loss':float(self.loss_agg_epoch.result()), 'Train_mse':float(self.mse_agg_epoch.result()),
+                    'Val_loss':float(self.loss_agg_val.result()), 'Val_mse':float(self.mse_agg_val.result()), 
+                    'Checkpoint_Path':li_ckpt_paths[0] if li_ckpt_paths else '', 'Last_Trained_Batch':-1 }, self.record_columns )
+            if self.resumable_iterator:
+                self.save_batch_checkpoint( epoch, -1 )
             
             # Early Stop Callback 
             if epoch > ( max( self.df_training_info.loc[:, 'Epoch'], default=0 ) + self.t_params['early_stopping_period']) :
@@ -309,22 +563,132 @@ class WeatherModel():
                 break
             # endregion
         
+        # Waiting for the last checkpoint and records to be written
+        self.step_profiler.stop()
+        self.ckpt_writer.close()
         print("Model Training Finished")
 
-    def train_step(self, feature, target, mask, bounds, _init):
-        
-        if _init==1.0:
-            if self.m_params['time_sequential'] == True:
-                inp_shape = [self.t_params['batch_size'], self.t_params['lookback_feature']] + self.m_params['region_grid_params']['outer_box_dims'] + [len(self.t_params['vars_for_feature'])]
+    def steps_to_boundary(self, batch, batch_count, report_freq, reset_idxs):
+        """Returns the number of batches to run after batch, at most steps_per_execution. 
+            Runs stop at reporting batches, at batches after which model states are reset and at the last batch,
+            so that a run never crosses from training into validation
+
+            Args:
+                batch (int): number of batches completed so far
+                batch_count (int): number of batches in the training or validation loop
+                report_freq (int): frequency of reporting, in batches
+                reset_idxs (list): batches after which the model states are reset
+
+            Returns:
+                int: number of batches to run
+        """
+        next_report = (batch//report_freq + 1)*report_freq
+        next_reset = min( [ idx for idx in reset_idxs if idx > batch ], default=batch_count )
+
+        return int( min( self.steps_per_execution, next_report - batch, next_reset - batch, batch_count - batch ) )
+
+    def train_steps(self, steps, sync=False):
+        """Trains on the next steps batches from the train/val iterator. 
+            Records the time spent waiting on the iterator and training, and traces the steps in the profile_steps range
+
+            Args:
+                steps (int): number of batches to train on
+                sync (bool, optional): whether to wait for the steps to finish executing on the device, e.g. before reporting. 
+                    Otherwise only the time taken to dispatch the steps is recorded, unless they are being profiled. Defaults to False.
+        """
+        self.step_profiler.before_steps( self.train_step_count, steps )
+        start_time = time.perf_counter()
+
+        with self.step_profiler.trace( self.train_step_count ):
+            if steps == 1:
+                feature, target, mask = next(self.iter_train_val)
+                input_time = time.perf_counter()
+                self.distributed_train_step( feature, target, mask )
             else:
-                inp_shape = [self.t_params['batch_size'] ] + self.m_params['region_grid_params']['outer_box_dims'] + [ int(self.t_params['lookback_feature']*len(self.t_params['vars_for_feature'])) ]
-           
-            _ = self.model( tf.zeros( inp_shape, dtype=tf.float16), self.t_params['trainable'] )    #( bs, tar_seq_len, h, w)
+                input_time = start_time
+                self.distributed_train_steps( self.iter_train_val, tf.constant(steps) )
+
+            if self.grad_accum_steps > 1:
+                self.accum_count += steps
+                if self.accum_count >= self.grad_accum_steps:
+                    self.apply_accumulated_gradients()
+
+            if sync or self.step_profiler.profiling:
+                self.wait_for_steps()
+
+        self.step_timer.record( steps, input_time - start_time, time.perf_counter() - input_time )
+        self.train_step_count += steps
+        self.step_profiler.after_steps( self.train_step_count )
+
+    def wait_for_steps(self):
+        """Blocks until the dispatched steps have finished executing on the device. 
+            The loss metric is updated by every step and the optimizer's iterations by every application of the gradients,
+            so reading both waits for the last step and update. Only called at reporting batches, which read the loss anyway,
+            and while profiling, so that steps are otherwise dispatched without a host-device sync
+        """
+        self.loss_agg_batch.result().numpy()
+        self.optimizer.iterations.numpy()
+
+    def apply_accumulated_gradients(self):
+        """Applies the gradients accumulated over the last accum_count batches"""
+        self.distributed_apply_step( tf.constant(self.accum_count, dtype=tf.float32) )
+        self.accum_count = 0
+
+    def val_steps(self, steps):
+        """Validates on the next steps batches from the train/val iterator"""
+        if steps == 1:
+            feature, target, mask = next(self.iter_train_val)
+            self.distributed_val_step( feature, target, mask )
+        else:
+            self.distributed_val_steps( self.iter_train_val, tf.constant(steps) )
+
+    def train_step(self, feature, target, mask):
+        
+        gradients, loss_to_optimize, metric_mse = self.compute_gradients( feature, target, mask )
+
+        if self.grad_accum_steps > 1:
+            # The unscaled gradients are summed, then averaged, clipped and applied in apply_step
+            self.accum_var_idxs = [ idx for idx, gradient in enumerate(gradients) if gradient is not None ]
+            for idx in self.accum_var_idxs:
+                self.accum_gradients[idx].assign_add( tf.convert_to_tensor(gradients[idx]) )
+        else:
+            with tf.name_scope("clip_gradients"):
+                gradients, _ = tf.clip_by_global_norm( gradients, clip_norm=self.m_params['clip_norm'] ) #gradient clipping
+            with tf.name_scope("apply_gradients"):
+                self.optimizer.apply_gradients( zip(gradients, self.model.trainable_variables))
+        
+        # Metrics (batchwise, epoch)  
+        self.loss_agg_batch( loss_to_optimize )
+        self.loss_agg_epoch( loss_to_optimize )
+        self.mse_agg_epoch( metric_mse )    
+
+        return gradients
+
+    def apply_step(self, accum_count):
+        """Applies the mean of the gradients accumulated over accum_count batches, then resets the accumulators.
+            Only the variables that receive a gradient are passed to the optimizer, so zero gradients of unused variables
+            do not update the optimizer's moments
+        """
+        accum_gradients = [ self.accum_gradients[idx] for idx in self.accum_var_idxs ]
+        t_vars = [ self.model.trainable_variables[idx] for idx in self.accum_var_idxs ]
+
+        # Averaging before clipping, so that clipping is applied as it would be for one batch accum_count times larger
+        gradients = [ accum_gradient / accum_count for accum_gradient in accum_gradients ]
+        gradients, _ = tf.clip_by_global_norm( gradients, clip_norm=self.m_params['clip_norm'] ) #gradient clipping
 
-            gradients = [ tf.zeros_like(t_var, dtype=tf.float32 ) for t_var in self.model.trainable_variables  ]
-            self.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
-            return [0]
+        # Non finite gradients, from an overflow in any of the batches, are skipped by the LossScaleOptimizer which then reduces the loss scale
+        self.optimizer.apply_gradients( zip(gradients, t_vars))
 
+        for accum_gradient in accum_gradients:
+            accum_gradient.assign( tf.zeros_like(accum_gradient) )
+
+        return gradients
+
+    def compute_gradients(self, feature, target, mask):
+        """Returns the unscaled gradients, the loss and the mse for a batch. 
+            Compiled with XLA if the 'jit_compile' t_setting is True, see initialize_step_functions.
+            The gradients are applied outside of this function, since the optimizer's updates are aggregated across replicas
+        """
         with tf.GradientTape(persistent=False) as tape:
                                    
             # non conditional continuous training
@@ -335,19 +699,15 @@ class WeatherModel():
                 preds = tf.squeeze( preds,axis=[-1] )
 
                 
-                preds   = cl.extract_central_region(preds, bounds)
-                mask    = cl.extract_central_region(mask, bounds)
-                target  = cl.extract_central_region(target, bounds)
-
-                #Applying mask
-                preds_masked = tf.boolean_mask( preds, mask )
-                target_masked = tf.boolean_mask( target, mask ) 
+                preds   = cl.extract_central_region(preds, self.bounds)
+                mask    = cl.extract_central_region(mask, self.bounds)
+                target  = cl.extract_central_region(target, self.bounds)
 
                 # reversing standardization
-                preds_masked = utility.standardize_ati( preds_masked, self.t_params['normalization_shift']['rain'], self.t_params['normalization_scales']['rain'], reverse=True)
+                preds = utility.standardize_ati( preds, self.t_params['normalization_shift']['rain'], self.t_params['normalization_scales']['rain'], reverse=True)
 
-                # getting losses for records and/or optimizer
-                metric_mse = cl.mse(target_masked, preds_masked) 
+                # getting losses for records and/or optimizer, over the unmasked values
+                metric_mse = cl.masked_mse(target, preds, mask) 
                 loss_to_optimize = metric_mse
 
             # conditional continuous training        
@@ -360,76 +720,71 @@ class WeatherModel():
 
                 # extracting the central region of interest
             
-                preds   = cl.extract_central_region(preds, bounds)
-                probs   = cl.extract_central_region(probs, bounds)
-                mask    = cl.extract_central_region(mask, bounds)
-                target  = cl.extract_central_region(target, bounds)
-
-                # applying mask to predicted values
-                preds_masked    = tf.boolean_mask(preds, mask )
-                probs_masked    = tf.boolean_mask(probs, mask ) 
-                target_masked   = tf.boolean_mask(target, mask )
-                
+                preds   = cl.extract_central_region(preds, self.bounds)
+                probs   = cl.extract_central_region(probs, self.bounds)
+                mask    = cl.extract_central_region(mask, self.bounds)
+                target  = cl.extract_central_region(target, self.bounds)
+
                 # Reverising standardization of predictions 
-                preds_masked    = utility.standardize_ati( preds_masked, self.t_params['normalization_shift']['rain'], 
+                preds   = utility.standardize_ati( preds, self.t_params['normalization_shift']['rain'], 
                                                         self.t_params['normalization_scales']['rain'], reverse=True) 
                                                         
                 # Getting true labels and predicted labels for whether or not it rained [ 1 if if did rain, 0 if it did not rain]
-                labels_true = tf.where( target_masked > 0.0, 1.0, 0.0 )
-                labels_pred = probs_masked 
+                labels_true = tf.where( target > 0.0, 1.0, 0.0 )
+                labels_pred = probs 
 
-                all_count = tf.size( labels_true, out_type=tf.int64 )                
+                all_count = cl.masked_count( mask )
                 
-                # region Calculating Losses and Metrics
-                metric_mse  = cl.mse( target_masked, cl.cond_rain(preds_masked, probs_masked, threshold=0.5) )   
+                # region Calculating Losses and Metrics, over the unmasked values
+                metric_mse  = cl.masked_mse( target, cl.cond_rain(preds, probs, threshold=0.5), mask )   
                     # To calculate metric_mse for CC model we assume that pred_rain=0 if pred_prob<=0.5 
 
                 # CC Normal loss
                 loss_to_optimize = 0
-                loss_to_optimize += cl.mse( target_masked, preds_masked, all_count )    
-                loss_to_optimize += tf.reduce_mean( tf.keras.backend.binary_crossentropy(labels_true, labels_pred, from_logits=False) )         
+                loss_to_optimize += cl.masked_mse( target, preds, mask, all_count )    
+                loss_to_optimize += cl.masked_bce( labels_true, labels_pred, mask )         
                 # endregion
 
             loss_to_optimize_agg = tf.grad_pass_through( lambda x:  x/self.strategy_gpu_count )(loss_to_optimize)
-            scaled_loss = self.optimizer.get_scaled_loss( loss_to_optimize_agg )
-            scaled_gradients = tape.gradient( scaled_loss, self.model.trainable_variables )
-            unscaled_gradients = self.optimizer.get_unscaled_gradients(scaled_gradients)
-             
-            gradients, _ = tf.clip_by_global_norm( unscaled_gradients, clip_norm=self.m_params['clip_norm'] ) #gradient clipping
-            self.optimizer.apply_gradients( zip(gradients, self.model.trainable_variables))
-        
-        # Metrics (batchwise, epoch)  
-        self.loss_agg_batch( loss_to_optimize )
-        self.loss_agg_epoch( loss_to_optimize )
-        self.mse_agg_epoch( metric_mse )    
-        
-        val = cl.rNmse(target_masked, preds_masked, 10.0)
+            with tf.name_scope("loss_scaling"):
+                scaled_loss = self.optimizer.get_scaled_loss( loss_to_optimize_agg )
+            with tf.name_scope("backward"):
+                scaled_gradients = tape.gradient( scaled_loss, self.model.trainable_variables )
+            with tf.name_scope("loss_scaling"):
+                unscaled_gradients = self.optimizer.get_unscaled_gradients(scaled_gradients)
+
+        return unscaled_gradients, loss_to_optimize, metric_mse
+                
+    def val_step(self, feature, target, mask):
 
-        
+        loss, mse = self.compute_val_losses( feature, target, mask )
 
-        return gradients
-                
-    def val_step(self, feature, target, mask, bounds):
+        self.loss_agg_val(loss)
+        self.mse_agg_val(mse)
+                    
+        return True
+
+    def compute_val_losses(self, feature, target, mask):
+        """Returns the loss and the mse for a validation batch. 
+            Compiled with XLA if the 'jit_compile' t_setting is True, see initialize_step_functions
+        """
                     
         # Non CC distribution
         if self.m_params['model_type_settings']['discrete_continuous'] == False:
             
             # Get predictions
             preds = self.model(feature, False )
-            preds = tf.squeeze(preds)
+            preds = tf.squeeze(preds, axis=[-1])
 
             # Extracting central region for evaluation
-            preds   = cl.extract_central_region(preds, bounds)
-            mask    = cl.extract_central_region(mask, bounds)
-            target  = cl.extract_central_region(target, bounds)
+            preds   = cl.extract_central_region(preds, self.bounds)
+            mask    = cl.extract_central_region(mask, self.bounds)
+            target  = cl.extract_central_region(target, self.bounds)
             
-            # Applying masks to predictions
-            preds_masked = tf.boolean_mask( preds, mask )
-            target_masked = tf.boolean_mask( target, mask )
-            preds_masked = utility.standardize_ati( preds_masked, self.t_params['normalization_shift']['rain'], 
+            preds = utility.standardize_ati( preds, self.t_params['normalization_shift']['rain'], 
                                                     self.t_params['normalization_scales']['rain'], reverse=True)
-            # Updating losses
-            mse = cl.mse( target_masked , preds_masked ) 
+            # Updating losses, over the unmasked values
+            mse = cl.masked_mse( target , preds, mask ) 
             loss = mse                
 
         # CC distribution
@@ -442,50 +797,74 @@ class WeatherModel():
 
             # Extracting central region for evaluation
         
-            preds   = cl.extract_central_region(preds, bounds)
-            probs   = cl.extract_central_region(probs, bounds)
-            mask    = cl.extract_central_region(mask,  bounds)
-            target  = cl.extract_central_region(target,bounds)
-
-            # Applying masks to predictions
-            preds_masked    = tf.boolean_mask( preds, mask )
-            probs_masked    = tf.boolean_mask( probs, mask)
-            target_masked   = tf.boolean_mask( target, mask )
-            preds_masked    = utility.standardize_ati( preds_masked, self.t_params['normalization_shift']['rain'], 
+            preds   = cl.extract_central_region(preds, self.bounds)
+            probs   = cl.extract_central_region(probs, self.bounds)
+            mask    = cl.extract_central_region(mask, self.bounds)
+            target  = cl.extract_central_region(target, self.bounds)
+
+            preds   = utility.standardize_ati( preds, self.t_params['normalization_shift']['rain'], 
                                                     self.t_params['normalization_scales']['rain'], reverse=True)
 
             # Getting classification labels for whether or not it rained
             
-            labels_true = tf.where( target_masked > 0.0, 1.0, 0.0 )
-            labels_pred = probs_masked 
+            labels_true = tf.where( target > 0.0, 1.0, 0.0 )
+            labels_pred = probs 
 
-            all_count = tf.size( labels_true, out_type=tf.int64 )
+            all_count = cl.masked_count( mask )
 
-            # calculating seperate mse for reporting
+            # calculating seperate mse for reporting, over the unmasked values
                 # This mse metric assumes that if probability of rain is predicted below 0.5, the rain value is 0
-            mse = cl.mse( target_masked, cl.cond_rain( preds_masked, probs_masked, threshold=0.5) )
+            mse = cl.masked_mse( target, cl.cond_rain( preds, probs, threshold=0.5), mask )
 
             # Calculating cross entropy loss                         
-            loss = tf.reduce_mean(  tf.keras.backend.binary_crossentropy( labels_true, labels_pred, from_logits=False) )
+            loss = cl.masked_bce( labels_true, labels_pred, mask )
 
             # Calculating conditinal continuous loss
-            loss    += cl.mse( target_masked, preds_masked, all_count )
+            loss    += cl.masked_mse( target, preds, mask, all_count )
 
-        self.loss_agg_val(loss)
-        self.mse_agg_val(mse)
-                    
-        return True
+        return loss, mse
     
-    @tf.function
-    def distributed_train_step(self, feature, target, mask, bounds, _init):
-        gradients = self.strategy.run( self.train_step, args=(feature, target, mask, bounds, _init) )
+    # distributed_train_step and distributed_val_step are compiled as tf.functions in initialize_step_functions
+    def distributed_train_step(self, feature, target, mask):
+        self.count_trace("train_step")
+        gradients = self.strategy.run( self.train_step, args=(feature, target, mask) )
         return gradients
     
-    @tf.function
-    def distributed_val_step(self, feature, target, mask, bounds):
-        bool_completed = self.strategy.run( self.val_step, args=(feature, target, mask, bounds))
+    def distributed_val_step(self, feature, target, mask):
+        self.count_trace("val_step")
+        bool_completed = self.strategy.run( self.val_step, args=(feature, target, mask))
         return bool_completed
 
+    @tf.function
+    def distributed_apply_step(self, accum_count):
+        self.count_trace("apply_step")
+        gradients = self.strategy.run( self.apply_step, args=(accum_count,) )
+        return gradients
+
+    @tf.function
+    def distributed_train_steps(self, iterator, steps):
+        """Runs steps training steps within one graph execution, drawing batches from the distributed iterator.
+            Losses and metrics are aggregated in graph and read at reporting batches
+        """
+        self.count_trace("train_steps")
+
+        # The first step is taken outside of the loop, since the model and optimizer variables may be created on the first call
+        feature, target, mask = next(iterator)
+        self.strategy.run( self.train_step, args=(feature, target, mask) )
+
+        for _ in tf.range(steps-1):
+            feature, target, mask = next(iterator)
+            self.strategy.run( self.train_step, args=(feature, target, mask) )
+
+    @tf.function
+    def distributed_val_steps(self, iterator, steps):
+        """Runs steps validation steps within one graph execution, drawing batches from the distributed iterator"""
+        self.count_trace("val_steps")
+
+        for _ in tf.range(steps):
+            feature, target, mask = next(iterator)
+            self.strategy.run( self.val_step, args=(feature, target, mask) )
+
 
 if __name__ == "__main__":
     s_dir = utility.get_script_directory(sys.argv[0])
@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 import math
 import tensorflow as tf
 import sys
@@ -9,11 +10,12 @@ import hparameters
 import ast
 import copy
 import datetime
+import hashlib
 import re
 import pickle
 
 # region - Reporting
-def update_checkpoints_epoch(df_training_info, epoch, train_loss_epoch, val_loss_epoch, ckpt_manager_epoch, t_params, m_params, train_metric_mse=None,
+def update_checkpoints_epoch(df_training_info, epoch, train_loss_epoch, val_loss_epoch, ckpt_writer, t_params, m_params, train_metric_mse=None,
                                 val_metric_mse=None,  objective="mse"  ):
     """Updates the checkpoint and epoch records associated with an instance of training
 
@@ -22,7 +24,7 @@ def update_checkpoints_epoch(df_training_info, epoch, train_loss_epoch, val_loss
             epoch (int): current epoch
             train_loss_epoch (tf.keras.loss.Mean): aggregated loss from training batches within epoch
             val_loss_epoch (tf.keras.metric.Mean): aggregated loss from validation batches within epoch
-            ckpt_manager_epoch (tf.train.CheckpointManager): ckpt manager for epoch 
+            ckpt_writer (checkpoint_writer.CheckpointWriter): saves the epoch checkpoints and writes the records in the background
             t_params (dict): params related to training/testing
             m_params (dict): params related to model
             train_metric_mse (tf.keras.metric.Mean): aggregated mse from train batches within epoch
@@ -40,7 +42,7 @@ def update_checkpoints_epoch(df_training_info, epoch, train_loss_epoch, val_loss
     if( minimized  ):
 
         print('Saving Checkpoint for epoch {}'.format(epoch)) 
-        ckpt_save_path = ckpt_manager_epoch.save()
+        ckpt_save_path = ckpt_writer.save( checkpoint_number=epoch )
 
         
         # Possibly removing old non top5 records from end of epoch
@@ -67,11 +69,27 @@ def update_checkpoints_epoch(df_training_info, epoch, train_loss_epoch, val_loss
 
         print(df_training_info[['Epoch','Train_loss','Train_mse','Val_loss','Val_mse']] )
 
-        df_training_info.to_csv( path_or_buf="checkpoints/{}/checkpoint_scores.csv".format(model_name_mkr(m_params, t_params=t_params,  htuning=m_params.get('htuning',False)),
-                                    header=True, index=False) ) #saving df of scores                      
+        # appending the scores of the new checkpoint, the top scores are recovered from the file by load_checkpoint_scores
+        ckpt_writer.append_record( "checkpoints/{}/checkpoint_scores.csv".format(model_name_mkr(m_params, t_params=t_params,  htuning=m_params.get('htuning',False))),
+                                    df_training_info.loc[ df_training_info['Epoch']==epoch ].iloc[0].to_dict(), list(df_training_info.columns) )
     
     return df_training_info
 
+def load_checkpoint_scores(fp, checkpoints_to_keep=None):
+    """Loads the scores of the saved checkpoints, from the append only checkpoint_scores.csv file
+
+        Args:
+            fp (str): path of checkpoint_scores.csv
+            checkpoints_to_keep (int, optional): number of records to keep. Defaults to None, all records
+
+        Returns:
+            DataFrame: the latest record for each epoch, sorted by ascending validation loss
+    """
+    df_scores = pd.read_csv( fp, header=0, index_col=False )
+    df_scores = df_scores.drop_duplicates( subset=['Epoch'], keep='last' )
+    df_scores = df_scores.sort_values( by=['Val_loss'], ascending=True )[:checkpoints_to_keep]
+    return df_scores.reset_index(drop=True)
+
 def tensorboard_record(writer, li_metrics, li_names, step, gradients=None, trainable_variables=None):
     """
         Updates tensorboard records
@@ -172,6 +190,10 @@ def parse_arguments(s_dir=None):
     parser.add_argument('-pc','--parallel_calls', type=int, required=False, default=-1)
 
     parser.add_argument('-ep','--epochs', default=100, type=int, required=False)
+
+    parser.add_argument('-ga','--grad_accum_steps', default=1, type=int, required=False, help="number of batches over which gradients are accumulated before being applied")
+
+    parser.add_argument('-ps','--profile_steps', default=None, type=str, required=False, help="range of training steps to capture a profiler trace for, e.g. 10:20")
        
     args_dict = vars(parser.parse_args() )
 
@@ -182,6 +204,28 @@ def parse_arguments(s_dir=None):
 
 #endregion
 
+# region - Compilation
+def tf_function(fn, jit_compile=False, **kwargs):
+    """Wraps fn in a tf.function, optionally compiled with XLA
+
+        Args:
+            fn (callable): function to wrap
+            jit_compile (bool, optional): Whether to compile fn with XLA. Defaults to False.
+            kwargs : other arguments for tf.function, e.g. input_signature
+
+        Returns:
+            tf.function
+    """
+    if not jit_compile:
+        return tf.function(fn, **kwargs)
+
+    try:
+        return tf.function(fn, jit_compile=True, **kwargs)
+    except TypeError:
+        # Before tensorflow 2.5 the argument was named experimental_compile
+        return tf.function(fn, experimental_compile=True, **kwargs)
+#endregion
+
 # region - Saving model / settings / params
 def save_model_settings(m_params,t_params):
     """Saves the m_params and t_params dicts to file
@@ -286,26 +330,89 @@ def loc_name_shrtner(li_locs):
     li_locs = [ name[:3] for name in li_locs]
     return li_locs
 
-def cache_suffix_mkr(m_params, t_params):
-    """Creates the cache suffix for training datasets
+def cache_suffix_mkr(m_params, t_params, locations=None):
+    """Creates the cache suffix for datasets. The suffix is a hash of the params affecting the data pipeline,
+        therefore runs share a cache if and only if they produce identical datasets
 
     Args:
-        m_params ([type]): [description]
-        t_params ([type]): [description]
+        m_params (dict): params for model
+        t_params (dict): params for training/testing
+        locations (list, optional): locations in the dataset. Defaults to the locations in m_params.
 
     Returns:
-        [type]: [description]
+        str: cache suffix
     """        
-    if t_params['ctsm'] == "4ds_10years":
-        cache_suffix ='_{}_bs_{}_fyitrain_{}_loc_{}'.format( m_params['model_name'], t_params['model_name'], str(t_params['fyi_train']), loc_name_shrtner(m_params['model_type_settings']['location'])  )
-        
-    else: 
-        cache_suffix = '_{}_bs_{}_{}_{}'.format(m_params['model_name'], t_params['batch_size'],
-                            loc_name_shrtner(m_params['model_type_settings']['location']),
-                            m_params['ctsm']  )    
-        
+    cache_suffix = '_' + params_hash( data_pipeline_params(t_params, m_params, locations) )
     return cache_suffix
 
+def cache_metadata_update(cache_fp, m_params, t_params, locations=None):
+    """Creates or updates the metadata file stored alongside a dataset cache.
+        The metadata records the data pipeline params and when the cache was created and last used
+
+    Args:
+        cache_fp (str): filepath passed to tf.data.Dataset.cache
+        m_params (dict): params for model
+        t_params (dict): params for training/testing
+        locations (list, optional): locations in the dataset. Defaults to the locations in m_params.
+    """
+    metadata_fp = cache_fp + ".json"
+    now = datetime.datetime.now().isoformat(timespec='seconds')
+
+    try:
+        with open(metadata_fp, "r") as fp:
+            metadata = json.load(fp)
+    except FileNotFoundError:
+        params = data_pipeline_params(t_params, m_params, locations)
+        metadata = { 'key':params_hash(params), 'data_pipeline_params':params, 'created':now, 'model_names':[] }
+
+    metadata['last_used'] = now
+    if m_params['model_name'] not in metadata['model_names']:
+        metadata['model_names'].append( m_params['model_name'] )
+
+    with open(metadata_fp, "w") as fp:
+        json.dump( metadata, fp, default=default_pkl, indent=4 )
+
+def data_pipeline_params(t_params, m_params, locations=None):
+    """Returns the subset of params which affect the content of the datasets produced by data_generators.Era5_Eobs
+
+    Args:
+        t_params (dict): params for training/testing
+        m_params (dict): params for model
+        locations (list, optional): locations in the dataset. Defaults to the locations in m_params.
+
+    Returns:
+        dict: params affecting the data pipeline
+    """
+    t_settings = t_params.get('t_settings', {})
+    pipeline_params = {
+        'rain_fn':t_params.get('rain_fn', None),
+        'mf_fn':t_params.get('mf_fn', None),
+        'mf_store':t_settings.get('mf_store', None),
+        'vars_for_feature':t_params['vars_for_feature'],
+        'normalization_scales':t_params['normalization_scales'],
+        'normalization_shift':t_params['normalization_shift'],
+        'mask_fill_value':t_params['mask_fill_value'],
+        'window_shift':t_params['window_shift'],
+        'lookback_feature':t_params.get('lookback_feature', None),
+        'lookback_target':t_params.get('lookback_target', None),
+        'batch_size':t_params['batch_size'],
+        'ctsm':t_params.get('ctsm', None),
+        'ctsm_test':t_params.get('ctsm_test', None),
+        'fyi_train':t_params.get('fyi_train', None),
+        'feature_start_date':t_params['feature_start_date'],
+        'target_start_date':t_params['target_start_date'],
+        'region_grid_params':m_params['region_grid_params'],
+        'time_sequential':m_params['time_sequential'],
+        'locations':locations if locations is not None else location_getter(m_params['model_type_settings']),
+        'patch_gather':t_settings.get('patch_gather', False)
+    }
+    return pipeline_params
+
+def params_hash(params):
+    """Returns a hex digest identifying a dictionary of params"""
+    params_str = json.dumps( params, sort_keys=True, default=default_pkl )
+    return hashlib.sha1( params_str.encode('utf-8') ).hexdigest()[:16]
+
 def location_getter(model_settings):
 
     if model_settings.get('location_test', None) == None:
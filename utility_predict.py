@@ -42,7 +42,7 @@ def load_model(t_params, m_params):
     ckpt = tf.train.Checkpoint(model=model)
 
     # Choosing checkpoint with lowest validation loss
-    df_checkpoint_scores = pd.read_csv( t_params['script_dir']+'/checkpoints/{}/checkpoint_scores.csv'.format(utility.model_name_mkr(m_params, train_test="train", t_params=t_params, htuning=m_params.get('htuning',False)  )), header=0 )
+    df_checkpoint_scores = utility.load_checkpoint_scores( t_params['script_dir']+'/checkpoints/{}/checkpoint_scores.csv'.format(utility.model_name_mkr(m_params, train_test="train", t_params=t_params, htuning=m_params.get('htuning',False)  )) )
 
     best_checkpoint_path = df_checkpoint_scores['Checkpoint_Path'][0]
     checkpoint_code = "E"+str(df_checkpoint_scores['Epoch'][0])